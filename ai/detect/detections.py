@@ -0,0 +1,86 @@
+# ai/detect/detections.py
+"""
+Kết quả detect của 1 ảnh dạng cột (NumPy), thay cho list tuple dựng từng box trong Python.
+
+Detections vẫn là 1 sequence các tuple (x1, y1, x2, y2, conf, cls_id, cls_name) (len/iter/index) nên
+stage/emitter cũ và detector khác (replay/synth trả list tuple) dùng lẫn được; các stage nóng đọc
+thẳng mảng qua det_arrays()/det_names() — 2 hàm này nhận cả 2 dạng.
+"""
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+Det = Tuple[int, int, int, int, float, int, str]
+
+
+class Detections:
+    """
+    xyxy: (N, 4) int32 toạ độ pixel; conf: (N,) float32; cls_id: (N,) int32;
+    names: dict id -> tên lớp (đã lowercase), dùng chung giữa mọi kết quả của 1 detector.
+    """
+
+    __slots__ = ("xyxy", "conf", "cls_id", "names")
+
+    def __init__(self, xyxy: np.ndarray, conf: np.ndarray, cls_id: np.ndarray, names: Dict[int, str]):
+        self.xyxy = xyxy
+        self.conf = conf
+        self.cls_id = cls_id
+        self.names = names
+
+    @classmethod
+    def empty(cls, names: Dict[int, str]) -> "Detections":
+        return cls(np.zeros((0, 4), dtype=np.int32), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=np.int32), names)
+
+    def __len__(self) -> int:
+        return len(self.conf)
+
+    def __bool__(self) -> bool:
+        return len(self.conf) > 0
+
+    def class_names(self) -> List[str]:
+        names = self.names
+        return [names.get(i, str(i)) for i in self.cls_id.tolist()]
+
+    def tuples(self) -> List[Det]:
+        """Dạng list tuple (kiểu Python thuần) cho code cũ."""
+        return [
+            (x1, y1, x2, y2, cf, ci, name)
+            for (x1, y1, x2, y2), cf, ci, name in zip(self.xyxy.tolist(), self.conf.tolist(), self.cls_id.tolist(), self.class_names())
+        ]
+
+    def __iter__(self) -> Iterator[Det]:
+        return iter(self.tuples())
+
+    def __getitem__(self, i: int) -> Det:
+        x1, y1, x2, y2 = self.xyxy[i].tolist()
+        ci = int(self.cls_id[i])
+        return x1, y1, x2, y2, float(self.conf[i]), ci, self.names.get(ci, str(ci))
+
+    def __repr__(self) -> str:
+        return f"Detections(n={len(self)})"
+
+    def shifted(self, ox: int, oy: int) -> "Detections":
+        """Dịch bbox theo offset (crop ROI -> toạ độ frame gốc)."""
+        offset = np.array([ox, oy, ox, oy], dtype=self.xyxy.dtype)
+        return Detections(self.xyxy + offset, self.conf, self.cls_id, self.names)
+
+
+def det_arrays(dets: Sequence) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(boxes (N,4) float64, conf (N,) float64, cls_id (N,) int64) từ Detections hoặc list tuple."""
+    if isinstance(dets, Detections):
+        return dets.xyxy.astype(np.float64), dets.conf.astype(np.float64), dets.cls_id.astype(np.int64)
+    if not len(dets):
+        return np.zeros((0, 4)), np.zeros(0), np.zeros(0, dtype=np.int64)
+    x1, y1, x2, y2, conf, cls_id, _ = zip(*dets)
+    return (
+        np.array([x1, y1, x2, y2], dtype=np.float64).T,
+        np.asarray(conf, dtype=np.float64),
+        np.asarray(cls_id, dtype=np.int64),
+    )
+
+
+def det_names(dets: Sequence) -> List[str]:
+    """Tên lớp từng detection, từ Detections hoặc list tuple."""
+    if isinstance(dets, Detections):
+        return dets.class_names()
+    return [d[6] for d in dets]
@@ -0,0 +1,251 @@
+# ai/detect/runtime.py
+"""
+Chạy YOLOv8 qua ONNX Runtime / OpenVINO thay cho PyTorch.
+
+- Model .pt được export 1 lần (cần ultralytics) ra artifact trong thư mục cache, tên artifact
+  gồm hash model + imgsz + precision -> lần chạy sau chỉ load artifact, không import torch.
+- --model trỏ thẳng vào .onnx / .xml / thư mục *_openvino_model thì dùng luôn, không export.
+- Tiền xử lý (letterbox) và hậu xử lý (giải mã output + NMS theo class) làm bằng NumPy/OpenCV,
+  khớp với mặc định predict của Ultralytics (pad 114, iou 0.7, max_det 300).
+"""
+import os
+import ast
+import json
+import glob
+import shutil
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+RUNTIMES = ("torch", "onnx", "openvino")
+PRECISIONS = ("fp32", "fp16", "int8")
+
+NMS_IOU = 0.7
+MAX_DET = 300
+
+
+def _file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()[:12]
+
+
+def _is_artifact(model_path: str, runtime: str) -> bool:
+    if runtime == "onnx":
+        return model_path.endswith(".onnx")
+    return model_path.endswith(".xml") or model_path.rstrip("/\\").endswith("_openvino_model")
+
+
+def _meta_path(artifact: str) -> str:
+    return artifact.rstrip("/\\") + ".meta.json"
+
+
+def _read_names(artifact: str, runtime: str) -> Dict[int, str]:
+    """Tên class: file .meta.json cạnh artifact (do export ghi), nếu không có thì đọc metadata Ultralytics."""
+    meta = _meta_path(artifact)
+    if os.path.exists(meta):
+        with open(meta, encoding="utf-8") as f:
+            return {int(k): v for k, v in json.load(f)["names"].items()}
+    if runtime == "onnx":
+        import onnxruntime as ort  # type: ignore
+        m = ort.InferenceSession(artifact, providers=["CPUExecutionProvider"]).get_modelmeta()
+        names = m.custom_metadata_map.get("names")
+        return {int(k): v for k, v in ast.literal_eval(names).items()} if names else {}
+    folder = artifact if os.path.isdir(artifact) else os.path.dirname(artifact)
+    yml = os.path.join(folder, "metadata.yaml")
+    if os.path.exists(yml):
+        import yaml  # type: ignore
+        with open(yml, encoding="utf-8") as f:
+            return {int(k): v for k, v in (yaml.safe_load(f).get("names") or {}).items()}
+    return {}
+
+
+def _quantize_onnx(src: str, dst: str) -> None:
+    """INT8 cho ONNX: dynamic quantization trọng số (không cần dữ liệu calibration)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic  # type: ignore
+    quantize_dynamic(src, dst, weight_type=QuantType.QUInt8)
+
+
+def export_model(model_path: str, runtime: str, imgsz: int, precision: str, cache_dir: str) -> str:
+    """
+    Trả về đường dẫn artifact cho runtime (onnx: file .onnx, openvino: thư mục *_openvino_model).
+    Artifact có sẵn trong cache (cùng hash/imgsz/precision) thì dùng lại; ngược lại export bằng ultralytics.
+    """
+    if _is_artifact(model_path, runtime):
+        return model_path
+    if not os.path.exists(model_path):
+        # Tên model chuẩn (vd yolov8n.pt) chưa có trên disk: để ultralytics tải về trước
+        from ultralytics import YOLO  # type: ignore
+        model_path = YOLO(model_path).ckpt_path or model_path
+
+    stem = os.path.splitext(os.path.basename(model_path))[0]
+    key = f"{stem}-{_file_hash(model_path)}-{imgsz}-{precision}"
+    os.makedirs(cache_dir, exist_ok=True)
+    if runtime == "onnx":
+        artifact = os.path.join(cache_dir, key + ".onnx")
+    else:
+        artifact = os.path.join(cache_dir, key + "_openvino_model")
+    if os.path.exists(artifact) and os.path.exists(_meta_path(artifact)):
+        return artifact
+
+    print(f"[INFO] Export {model_path} -> {artifact} (lần đầu, cần ultralytics/torch)...")
+    from ultralytics import YOLO  # type: ignore
+
+    # Export vào thư mục tạm riêng để không ghi đè file cạnh model gốc
+    work = os.path.join(cache_dir, key + ".tmp")
+    shutil.rmtree(work, ignore_errors=True)
+    os.makedirs(work)
+    src = os.path.join(work, os.path.basename(model_path))
+    shutil.copy2(model_path, src)
+    model = YOLO(src)
+    names = {int(k): str(v) for k, v in model.names.items()}
+    if runtime == "onnx":
+        out = model.export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+        if precision == "int8":
+            _quantize_onnx(out, artifact)
+        else:
+            os.replace(out, artifact)
+    else:
+        out = model.export(
+            format="openvino",
+            imgsz=imgsz,
+            dynamic=True,
+            half=precision == "fp16",
+            int8=precision == "int8",
+        )
+        shutil.rmtree(artifact, ignore_errors=True)
+        shutil.move(out, artifact)
+    shutil.rmtree(work, ignore_errors=True)
+    with open(_meta_path(artifact), "w", encoding="utf-8") as f:
+        json.dump({"source": model_path, "imgsz": imgsz, "precision": precision, "names": names}, f)
+    return artifact
+
+
+class OnnxBackend:
+    def __init__(self, artifact: str, intra_threads: int = 0, inter_threads: int = 0):
+        import onnxruntime as ort  # type: ignore
+
+        so = ort.SessionOptions()
+        if intra_threads:
+            so.intra_op_num_threads = intra_threads
+        if inter_threads:
+            so.inter_op_num_threads = inter_threads
+            so.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        so.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(artifact, sess_options=so, providers=["CPUExecutionProvider"])
+        inp = self.session.get_inputs()[0]
+        self.input_name = inp.name
+        # Batch cố định (export không dynamic) -> chạy từng ảnh
+        self.dynamic_batch = not isinstance(inp.shape[0], int)
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class OpenVinoBackend:
+    def __init__(self, artifact: str, intra_threads: int = 0, inter_threads: int = 0):
+        import openvino as ov  # type: ignore
+
+        xml = artifact
+        if os.path.isdir(artifact):
+            xml = sorted(glob.glob(os.path.join(artifact, "*.xml")))[0]
+        config = {"PERFORMANCE_HINT": "LATENCY"}
+        if intra_threads:
+            config["INFERENCE_NUM_THREADS"] = intra_threads
+        if inter_threads:
+            config["NUM_STREAMS"] = inter_threads
+        core = ov.Core()
+        model = core.read_model(xml)
+        self.dynamic_batch = model.inputs[0].get_partial_shape()[0].is_dynamic
+        self.compiled = core.compile_model(model, "CPU", config)
+        self.request = self.compiled.create_infer_request()
+
+    def forward(self, batch: np.ndarray) -> np.ndarray:
+        return self.request.infer({0: batch})[self.compiled.output(0)]
+
+
+def letterbox(img: np.ndarray, size: int) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    """Resize giữ tỉ lệ vào ô size x size, pad màu 114 (như LetterBox của Ultralytics)."""
+    h, w = img.shape[:2]
+    r = min(size / h, size / w)
+    nw, nh = int(round(w * r)), int(round(h * r))
+    dw, dh = (size - nw) / 2, (size - nh) / 2
+    if (nw, nh) != (w, h):
+        img = cv2.resize(img, (nw, nh), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    img = cv2.copyMakeBorder(img, top, bottom, left, right, cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    return img, r, (left, top)
+
+
+def postprocess(
+    pred: np.ndarray,
+    conf: float,
+    ratio: float,
+    pad: Tuple[float, float],
+    shape: Tuple[int, int],
+    class_ids: Optional[np.ndarray] = None,
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    pred: output YOLOv8 của 1 ảnh (4 + nc, N) với box cx,cy,w,h theo toạ độ letterbox.
+    Trả về (boxes int xyxy theo ảnh gốc, conf, cls_id) sau NMS theo class.
+    """
+    scores = pred[4:]
+    cls = scores.argmax(0)
+    best = scores[cls, np.arange(scores.shape[1])]
+    keep = best >= conf
+    if class_ids is not None:
+        keep &= np.isin(cls, class_ids)
+    if not keep.any():
+        return np.zeros((0, 4), dtype=int), np.zeros(0, dtype=np.float32), np.zeros(0, dtype=int)
+    box, best, cls = pred[:4, keep].T, best[keep], cls[keep]
+    xyxy = np.empty_like(box)
+    xyxy[:, :2] = box[:, :2] - box[:, 2:] / 2
+    xyxy[:, 2:] = box[:, :2] + box[:, 2:] / 2
+    # NMS theo class: dịch box của mỗi class ra vùng riêng rồi NMS 1 lần
+    off = (cls * 7680.0)[:, None]
+    shifted = xyxy + off
+    idx = cv2.dnn.NMSBoxes(
+        np.c_[shifted[:, :2], shifted[:, 2:] - shifted[:, :2]].tolist(), best.tolist(), conf, NMS_IOU
+    )
+    # Chỉ số trả về theo conf giảm dần; top_k của OpenCV cắt trước NMS nên tự cắt max_det sau NMS
+    idx = np.asarray(idx, dtype=int).reshape(-1)[:MAX_DET]
+    xyxy, best, cls = xyxy[idx], best[idx], cls[idx]
+    xyxy[:, [0, 2]] -= pad[0]
+    xyxy[:, [1, 3]] -= pad[1]
+    xyxy /= ratio
+    h, w = shape
+    xyxy[:, [0, 2]] = xyxy[:, [0, 2]].clip(0, w)
+    xyxy[:, [1, 3]] = xyxy[:, [1, 3]].clip(0, h)
+    return xyxy.astype(int), best.astype(np.float32), cls.astype(int)
+
+
+class RuntimeModel:
+    """YOLOv8 đã export chạy qua ONNX Runtime/OpenVINO; predict trả về mảng (boxes, conf, cls) cho từng ảnh."""
+
+    def __init__(self, artifact: str, runtime: str, imgsz: int, intra_threads: int = 0, inter_threads: int = 0):
+        backend = OnnxBackend if runtime == "onnx" else OpenVinoBackend
+        self.backend = backend(artifact, intra_threads, inter_threads)
+        self.imgsz = imgsz
+        self.names = _read_names(artifact, runtime)
+
+    def predict(
+        self, frames: List[np.ndarray], conf: float, class_ids: Optional[np.ndarray] = None
+    ) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        metas = []
+        blobs = []
+        for f in frames:
+            img, r, pad = letterbox(f, self.imgsz)
+            blobs.append(img)
+            metas.append((r, pad, f.shape[:2]))
+        # BGR HWC uint8 -> RGB NCHW float32 [0,1]
+        batch = np.ascontiguousarray(np.stack(blobs)[..., ::-1].transpose(0, 3, 1, 2), dtype=np.float32) / 255.0
+        if self.backend.dynamic_batch:
+            preds = self.backend.forward(batch)
+        else:
+            preds = np.concatenate([self.backend.forward(batch[i:i + 1]) for i in range(len(batch))])
+        return [postprocess(p, conf, r, pad, shape, class_ids) for p, (r, pad, shape) in zip(preds, metas)]
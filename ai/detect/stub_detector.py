@@ -0,0 +1,271 @@
+# ai/detect/stub_detector.py
+"""
+Detector thay thế YOLO để chạy offline, không GPU, không mạng (test, benchmark, profiling tracker/emitter).
+
+Giao diện detector của pipeline (YoloDetector và các lớp dưới đây đều theo):
+  - infer(frame) -> [(x1, y1, x2, y2, conf, cls_id, cls_name)]
+  - infer_batch(frames) -> list cùng độ dài/thứ tự với frames
+  - frame_keyed = True: infer_batch nhận thêm keys=[(frame_index, stream, ox, oy, frame_shape)] cho
+    từng ảnh (stream: tên "camera_id/stream_id" ở multi-camera, None ở 1 camera; ox, oy: góc trên trái
+    của ảnh trong frame gốc khi ảnh là crop ROI/tile; frame_shape: (h, w) của frame gốc). Detector
+    không nhìn pixel dùng khoá này để trả về bbox của đúng frame, theo toạ độ của ảnh được đưa vào.
+
+- ReplayDetector : đọc lại detection từ file NDJSON đã emit (schema full hoặc compact, .gz/.zst)
+- SyntheticDetector: ground truth của SyntheticScene (cảnh mà scripts/make_synth_video.py --objects vẽ ra)
+"""
+import glob
+import gzip
+import io
+import json
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+Det = Tuple[int, int, int, int, float, int, str]
+Key = Tuple[int, Optional[str], int, int, Tuple[int, int]]  # (frame_index, stream, ox, oy, (h, w) frame gốc)
+
+OBJ_COLOR = (40, 220, 40)  # BGR
+
+
+def _to_view(dets: List[Det], ox: int, oy: int, view: np.ndarray, frame_shape: Tuple[int, int]) -> List[Det]:
+    """
+    Dịch bbox toạ độ frame về ảnh crop đặt tại (ox, oy); bỏ bbox nằm ngoài, cắt bbox ở mép.
+    Bbox bị cắt có conf nhân với tỉ lệ diện tích còn thấy (như model thật thấy 1 phần người),
+    để khi gộp tile bbox đầy đủ ở ô khác được giữ thay cho mảnh.
+    """
+    h, w = view.shape[:2]
+    if not ox and not oy and (h, w) == tuple(frame_shape[:2]):
+        return dets
+    out = []
+    for (x1, y1, x2, y2, cf, ci, name) in dets:
+        cx1, cy1, cx2, cy2 = max(x1 - ox, 0), max(y1 - oy, 0), min(x2 - ox, w), min(y2 - oy, h)
+        if cx2 <= cx1 or cy2 <= cy1:
+            continue
+        area = max(1, (x2 - x1) * (y2 - y1))
+        visible = (cx2 - cx1) * (cy2 - cy1)
+        out.append((cx1, cy1, cx2, cy2, cf * min(1.0, visible / area), ci, name))
+    return out
+
+
+class SyntheticScene:
+    """
+    Nền nhiễu cố định + n đối tượng hình người (chữ nhật) di chuyển thẳng, nảy ở mép khung.
+    still: tỉ lệ đối tượng đứng yên (mô phỏng khách đứng ở quầy). Mọi thứ xác định theo seed;
+    vị trí ở frame i tính trực tiếp từ i nên không phụ thuộc thứ tự gọi.
+    """
+
+    def __init__(self, width: int, height: int, objects: int, speed: float = 4.0, still: float = 0.0, seed: int = 0):
+        rng = np.random.RandomState(seed)
+        self.width, self.height = width, height
+        self.seed = seed
+        self._bg_noise = rng.randint(60, 110, (height // 8 + 1, width // 8 + 1, 3)).astype(np.uint8)
+        self._bg = None
+        oh = max(12, height // 8)
+        ow = max(6, int(oh * 0.4))
+        self.size = np.array([ow, oh])
+        self.pos = rng.uniform([0, 0], [width - ow, height - oh], (objects, 2))
+        ang = rng.uniform(0, 2 * np.pi, objects)
+        self.vel = np.stack([np.cos(ang), np.sin(ang)], axis=1) * speed
+        self.vel[: int(round(still * objects))] = 0.0
+
+    def boxes(self, i: int) -> np.ndarray:
+        """Bbox xyxy (int) của mọi đối tượng ở frame thứ i (0-based), thứ tự cố định theo đối tượng."""
+        span = np.array([self.width, self.height]) - self.size
+        p = self.pos + self.vel * i
+        # Phản xạ ở mép: gấp toạ độ vào [0, span]
+        p = np.abs(np.mod(p + span, 2 * span) - span).astype(int)
+        return np.concatenate([p, p + self.size], axis=1)
+
+    def frame(self, i: int) -> np.ndarray:
+        import cv2
+        if self._bg is None:
+            self._bg = cv2.resize(self._bg_noise, (self.width, self.height), interpolation=cv2.INTER_LINEAR)
+        img = self._bg.copy()
+        for x1, y1, x2, y2 in self.boxes(i):
+            cv2.rectangle(img, (x1, y1), (x2, y2), OBJ_COLOR, -1)
+        return img
+
+
+class SyntheticDetector:
+    """
+    Trả về ground truth của SyntheticScene cho frame_index (1-based như pipeline, frame i của video
+    tổng hợp là frame_index i + 1). Cảnh được dựng theo kích thước frame đầu vào nên dùng được với
+    bất kỳ video nào, với số đối tượng tuỳ ý.
+
+    - jitter : độ lệch chuẩn nhiễu toạ độ bbox (pixel)
+    - miss   : xác suất bỏ sót mỗi đối tượng mỗi frame
+    - latency_ms: ngủ thêm mỗi lần infer_batch để mô phỏng thời gian forward của model
+    Nhiễu/bỏ sót sinh từ (seed, frame_index) nên kết quả giống hệt nhau giữa các lần chạy.
+    """
+
+    frame_keyed = True
+
+    def __init__(
+        self,
+        objects: int = 10,
+        speed: float = 4.0,
+        still: float = 0.0,
+        seed: int = 0,
+        jitter: float = 0.0,
+        miss: float = 0.0,
+        latency_ms: float = 0.0,
+        cls_name: str = "person",
+        scene: Optional[SyntheticScene] = None,
+    ):
+        self.objects = objects
+        self.speed = speed
+        self.still = still
+        self.seed = seed
+        self.jitter = jitter
+        self.miss = miss
+        self.latency = latency_ms / 1000.0
+        self.cls_name = cls_name
+        self._scenes: Dict[Tuple[int, int], SyntheticScene] = {}
+        if scene is not None:
+            self._scenes[(scene.height, scene.width)] = scene
+
+    def _scene(self, h: int, w: int) -> SyntheticScene:
+        scene = self._scenes.get((h, w))
+        if scene is None:
+            scene = SyntheticScene(w, h, self.objects, self.speed, self.still, self.seed)
+            self._scenes[(h, w)] = scene
+        return scene
+
+    def detect_index(self, frame_index: int, shape: Tuple[int, ...]) -> List[Det]:
+        """Detection của cả frame (toạ độ frame gốc) theo frame_index."""
+        h, w = shape[:2]
+        boxes = self._scene(h, w).boxes(frame_index - 1).astype(np.float64)
+        conf = np.full(len(boxes), 0.9)
+        if self.jitter > 0 or self.miss > 0:
+            rng = np.random.default_rng((self.seed, frame_index))
+            if self.jitter > 0:
+                boxes += rng.normal(0.0, self.jitter, boxes.shape)
+            conf = rng.uniform(0.5, 0.95, len(boxes))
+            keep = rng.random(len(boxes)) >= self.miss
+            boxes, conf = boxes[keep], conf[keep]
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+        return [
+            (int(x1), int(y1), int(x2), int(y2), float(cf), 0, self.cls_name)
+            for (x1, y1, x2, y2), cf in zip(boxes.astype(int), conf)
+        ]
+
+    def infer(self, frame_bgr: np.ndarray) -> List[Det]:
+        return self.infer_batch([frame_bgr])[0]
+
+    def infer_batch(self, frames: List[np.ndarray], keys: Optional[Sequence[Key]] = None) -> List[List[Det]]:
+        if not frames:
+            return []
+        if self.latency:
+            time.sleep(self.latency)
+        if keys is None:
+            # Không có khoá (gọi trực tiếp): coi là các frame nguyên liên tiếp từ frame_index 1
+            keys = [(i + 1, None, 0, 0, f.shape[:2]) for i, f in enumerate(frames)]
+        return [
+            _to_view(self.detect_index(index, shape), ox, oy, f, shape)
+            for f, (index, _stream, ox, oy, shape) in zip(frames, keys)
+        ]
+
+
+def _open_text(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    if path.endswith(".zst"):
+        import zstandard  # type: ignore
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, "rb")), encoding="utf-8")
+    return open(path, "r", encoding="utf-8")
+
+
+class ReplayDetector:
+    """
+    Phát lại detection từ NDJSON đã emit (--emit detection), tra theo (stream, frame_index).
+
+    - path: file hoặc glob (vd các segment đã xoay "out/cam01*.ndjson*"), đọc theo thứ tự tên file
+    - stream: tên "camera_id/stream_id" mặc định khi pipeline không truyền stream (1 camera);
+      file chỉ có 1 stream thì luôn dùng stream đó
+    Frame không có trong file (hoặc là frame predicted của lần chạy cũ) trả về rỗng.
+    """
+
+    frame_keyed = True
+
+    def __init__(self, path: str, stream: Optional[str] = None, conf: float = 0.0, classes: Optional[List[str]] = None, latency_ms: float = 0.0):
+        self.conf = conf
+        self.classes = set(c.lower() for c in classes) if classes else None
+        self.latency = latency_ms / 1000.0
+        self.frames: Dict[Tuple[str, int], List[Det]] = {}
+        self.streams: List[str] = []
+        files = sorted(glob.glob(path)) or [path]
+        for p in files:
+            self._load(p)
+        self.default_stream = stream if stream in self.streams else (self.streams[0] if self.streams else None)
+        self.hits = 0
+        self.misses = 0
+
+    def _add(self, stream: str, index: int, dets: List[Det]) -> None:
+        if stream not in self.streams:
+            self.streams.append(stream)
+        if self.conf > 0 or self.classes:
+            dets = [d for d in dets if d[4] >= self.conf and (not self.classes or d[6].lower() in self.classes)]
+        self.frames[(stream, int(index))] = dets
+
+    def _load(self, path: str) -> None:
+        runs: Dict[int, str] = {}  # compact: stream id trong file -> tên stream
+        names: Dict[int, Dict[str, str]] = {}
+        with _open_text(path) as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                obj = json.loads(line)
+                rec = obj.get("record")
+                if rec is None:
+                    if obj.get("predicted") or "detections" not in obj:
+                        continue
+                    src = obj.get("source") or {}
+                    dets = [
+                        (
+                            d["bbox"]["x1"], d["bbox"]["y1"], d["bbox"]["x2"], d["bbox"]["y2"],
+                            float(d.get("conf", 0.0)), int(d.get("class_id", -1)), str(d.get("class")),
+                        )
+                        for d in obj["detections"]
+                    ]
+                    self._add(f"{src.get('camera_id')}/{src.get('stream_id')}", obj["frame_index"], dets)
+                elif rec == "run":
+                    src = obj.get("source") or {}
+                    runs[obj["stream"]] = f"{src.get('camera_id')}/{src.get('stream_id')}"
+                elif rec == "classes":
+                    names[obj["stream"]] = obj.get("names", {})
+                elif rec == "frame":
+                    if obj.get("predicted"):
+                        continue
+                    cls_names = names.get(obj["stream"], {})
+                    dets = [
+                        (b[0], b[1], b[2], b[3], float(cf), int(ci), str(cls_names.get(str(ci), ci)))
+                        for b, ci, cf in zip(obj.get("bbox", []), obj.get("class_id", []), obj.get("conf", []))
+                    ]
+                    self._add(runs.get(obj["stream"], str(obj["stream"])), obj["frame_index"], dets)
+
+    def detect_index(self, frame_index: int, stream: Optional[str] = None) -> List[Det]:
+        key = (stream if stream in self.streams else self.default_stream, int(frame_index))
+        dets = self.frames.get(key)
+        if dets is None:
+            self.misses += 1
+            return []
+        self.hits += 1
+        return dets
+
+    def infer(self, frame_bgr: np.ndarray) -> List[Det]:
+        return self.infer_batch([frame_bgr])[0]
+
+    def infer_batch(self, frames: List[np.ndarray], keys: Optional[Sequence[Key]] = None) -> List[List[Det]]:
+        if not frames:
+            return []
+        if self.latency:
+            time.sleep(self.latency)
+        if keys is None:
+            keys = [(i + 1, None, 0, 0, f.shape[:2]) for i, f in enumerate(frames)]
+        return [
+            _to_view(self.detect_index(index, stream), ox, oy, f, shape)
+            for f, (index, stream, ox, oy, shape) in zip(frames, keys)
+        ]
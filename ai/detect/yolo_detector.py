@@ -1,33 +1,100 @@
 # ai/detect/yolo_detector.py
-from typing import List, Tuple, Optional
+from typing import List, Optional
 import numpy as np
-from ultralytics import YOLO
+
+from .detections import Detections
 
 class YoloDetector:
     """
     Thin wrapper quanh Ultralytics YOLOv8 để detect theo lớp mong muốn.
-    Kết quả trả về: list (x1, y1, x2, y2, conf, cls_id, cls_name)
+    Kết quả trả về: Detections (mảng xyxy/conf/cls_id), duyệt được như list (x1, y1, x2, y2, conf, cls_id, cls_name).
+    classes: tên lớp, đổi sang id 1 lần lúc khởi tạo và lọc ngay trong model (trước NMS), không lọc từng box.
+
+    runtime:
+      - "torch"   : Ultralytics/PyTorch như trước (device chọn được)
+      - "onnx"    : ONNX Runtime trên CPU
+      - "openvino": OpenVINO trên CPU
+    Với onnx/openvino, model .pt được export 1 lần vào cache_dir (khoá theo hash model, imgsz, precision);
+    các lần chạy sau không import torch/ultralytics.
     """
-    def __init__(self, model_path: str = "yolov8n.pt", conf: float = 0.25, classes: Optional[List[str]] = None):
-        self.model = YOLO(model_path)  # tự tải nếu chưa có
+    def __init__(
+        self,
+        model_path: str = "yolov8n.pt",
+        conf: float = 0.25,
+        classes: Optional[List[str]] = None,
+        runtime: str = "torch",
+        device: str = "cpu",
+        imgsz: int = 640,
+        precision: str = "fp32",
+        intra_threads: int = 0,
+        inter_threads: int = 0,
+        cache_dir: str = ".cache/models",
+    ):
         self.conf = conf
         self.classes = set([c.lower() for c in classes]) if classes else None
-        # map id -> name từ model
-        self.id2name = self.model.model.names if hasattr(self.model.model, "names") else {}
+        self.runtime = runtime
+        self.device = device
+        self.imgsz = imgsz
+        if runtime == "torch":
+            from ultralytics import YOLO
+            if intra_threads or inter_threads:
+                import torch
+                if intra_threads:
+                    torch.set_num_threads(intra_threads)
+                if inter_threads:
+                    torch.set_num_interop_threads(inter_threads)
+            self.model = YOLO(model_path)  # tự tải nếu chưa có
+            # map id -> name từ model
+            self.id2name = self.model.model.names if hasattr(self.model.model, "names") else {}
+        else:
+            from .runtime import RuntimeModel, export_model
+            artifact = export_model(model_path, runtime, imgsz, precision, cache_dir)
+            self.model = RuntimeModel(artifact, runtime, imgsz, intra_threads, inter_threads)
+            self.id2name = self.model.names
+        if isinstance(self.id2name, (list, tuple)):
+            self.id2name = dict(enumerate(self.id2name))
+        # Tên lớp lowercase 1 lần, dùng chung cho mọi Detections
+        self.names = {int(i): str(n).lower() for i, n in (self.id2name or {}).items()}
+        # Lọc class theo id ngay trước NMS (NMS theo class nên kết quả không đổi)
+        self.class_ids = None
+        if self.classes:
+            ids = [i for i, n in self.names.items() if n in self.classes]
+            # Model không có bảng tên: lớp được ghi bằng id ("0", "2"...)
+            ids += [int(c) for c in self.classes if c.isdigit() and int(c) not in self.names]
+            unknown = sorted(c for c in self.classes if c not in self.names.values() and not c.isdigit())
+            if unknown:
+                print(f"[WARN] --classes không có trong model, bỏ qua: {unknown}")
+            self.class_ids = np.array(sorted(ids), dtype=int)
+
+    def _detections(self, xyxy: np.ndarray, conf: np.ndarray, cls_id: np.ndarray) -> Detections:
+        return Detections(xyxy.astype(np.int32), conf.astype(np.float32), cls_id.astype(np.int32), self.names)
+
+    def _extract(self, r) -> Detections:
+        if r.boxes is None or not len(r.boxes):
+            return Detections.empty(self.names)
+        # 1 lần chép khỏi device cho cả ảnh: cột (x1, y1, x2, y2, [track_id], conf, cls)
+        data = r.boxes.data.cpu().numpy()
+        return self._detections(data[:, :4], data[:, -2], data[:, -1])
+
+    def infer(self, frame_bgr: np.ndarray) -> Detections:
+        return self.infer_batch([frame_bgr])[0]
 
-    def infer(self, frame_bgr: np.ndarray) -> List[Tuple[int, int, int, int, float, int, str]]:
-        # Ultralytics nhận BGR hoặc RGB; tự xử lý nội bộ
-        results = self.model.predict(frame_bgr, verbose=False, conf=self.conf, device="cpu")
-        out = []
-        for r in results:
-            if r.boxes is None:
-                continue
-            boxes = r.boxes.xyxy.cpu().numpy().astype(int)
-            confs = r.boxes.conf.cpu().numpy()
-            clss = r.boxes.cls.cpu().numpy().astype(int)
-            for (x1, y1, x2, y2), cf, ci in zip(boxes, confs, clss):
-                name = str(self.id2name.get(int(ci), ci)).lower()
-                if self.classes and name not in self.classes:
-                    continue
-                out.append((x1, y1, x2, y2, float(cf), int(ci), name))
-        return out
+    def infer_batch(self, frames: List[np.ndarray]) -> List[Detections]:
+        """
+        Detect nhiều frame trong 1 lần forward (frames có thể đến từ nhiều camera).
+        Kết quả: list cùng độ dài và thứ tự với frames, mỗi phần tử là Detections của frame đó.
+        """
+        if not frames:
+            return []
+        if self.runtime != "torch":
+            return [self._detections(*r) for r in self.model.predict(list(frames), self.conf, self.class_ids)]
+        # Ultralytics nhận BGR hoặc RGB; tự xử lý nội bộ. Với list input, results giữ đúng thứ tự.
+        results = self.model.predict(
+            list(frames),
+            verbose=False,
+            conf=self.conf,
+            device=self.device,
+            imgsz=self.imgsz,
+            classes=self.class_ids.tolist() if self.class_ids is not None else None,
+        )
+        return [self._extract(r) for r in results]
@@ -0,0 +1,218 @@
+# ai/emit/columnar_emitter.py
+"""
+Xuất detection dạng cột (Parquet hoặc Arrow IPC) thay cho NDJSON: mỗi detection 1 dòng
+với cột có kiểu (frame_index, capture_ts, class_id, conf, bbox, track_id...), quét bằng
+pyarrow/pandas/DuckDB nhanh hơn nhiều so với json.loads từng dòng.
+
+- Dòng được gom trong bộ nhớ và ghi thành 1 row group khi đủ group_frames frame hoặc group_secs giây.
+- arrow  : Arrow IPC stream, mỗi row group là 1 record batch tự đủ -> bị kill vẫn đọc được
+           mọi batch đã ghi (không cần footer).
+- parquet: footer chỉ được ghi khi đóng file, nên mỗi file part chỉ chứa file_groups row group
+           rồi đóng lại (<stem>.00000.parquet, <stem>.00001.parquet, ...). Bị kill chỉ mất part đang mở.
+- Không ghi đè dữ liệu của lần chạy trước: part parquet đánh số tiếp từ chỉ số trống kế tiếp;
+  file arrow đã tồn tại thì ghi sang <stem>.NNNNN.arrow trống kế tiếp (stream IPC không nối thêm được).
+
+Frame không có detection vẫn có 1 dòng với det_idx = null để giữ số frame.
+"""
+import os
+import re
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from ai.detect.detections import det_names
+
+from .json_emitter import Det, Tracked, _utc_now_iso, det_columns
+
+FORMATS = ("parquet", "arrow")
+
+_FIELDS = (
+    "pipeline_run_id", "store_id", "camera_id", "stream_id",
+    "frame_index", "capture_ts", "predicted", "image_w", "image_h",
+    "det_idx", "class_id", "class", "conf", "x1", "y1", "x2", "y2", "track_id",
+)
+
+
+def _schema(pa):
+    dict_str = pa.dictionary(pa.int32(), pa.string())
+    return pa.schema([
+        ("pipeline_run_id", dict_str),
+        ("store_id", dict_str),
+        ("camera_id", dict_str),
+        ("stream_id", dict_str),
+        ("frame_index", pa.int64()),
+        ("capture_ts", pa.timestamp("us", tz="UTC")),
+        ("predicted", pa.bool_()),
+        ("image_w", pa.int32()),
+        ("image_h", pa.int32()),
+        ("det_idx", pa.int16()),
+        ("class_id", pa.int16()),
+        ("class", dict_str),
+        ("conf", pa.float32()),
+        ("x1", pa.int32()),
+        ("y1", pa.int32()),
+        ("x2", pa.int32()),
+        ("y2", pa.int32()),
+        ("track_id", pa.int64()),
+    ])
+
+
+def _next_part(stem: str, ext: str) -> int:
+    """Chỉ số part kế tiếp sau part lớn nhất đang có (<stem>.NNNNN<ext>) trong thư mục."""
+    folder, base = os.path.split(stem)
+    pat = re.compile(re.escape(base) + r"\.(\d{5,})" + re.escape(ext) + "$")
+    try:
+        names = os.listdir(folder or ".")
+    except FileNotFoundError:
+        return 0
+    nums = [int(m.group(1)) for m in map(pat.match, names) if m]
+    return max(nums) + 1 if nums else 0
+
+
+class ColumnarEmitter:
+    def __init__(
+        self,
+        out_path: str,
+        fmt: str = "parquet",
+        group_frames: int = 300,
+        group_secs: float = 10.0,
+        file_groups: int = 10,
+    ):
+        """
+        out_path: file đích (arrow) hoặc tên gốc cho các file part (parquet).
+        group_frames/group_secs: cắt row group theo số frame hoặc thời gian (0 = tắt tiêu chí đó).
+        file_groups: số row group mỗi file part parquet.
+        """
+        import pyarrow as pa  # type: ignore
+
+        if not out_path or out_path == "-":
+            raise ValueError(f"--emit_format {fmt} cần đường dẫn file (--out), không ghi ra stdout được")
+        self._pa = pa
+        self.schema = _schema(pa)
+        self.out_path = out_path
+        self.fmt = fmt
+        self.group_frames = group_frames
+        self.group_secs = group_secs
+        self.file_groups = max(1, file_groups)
+        self._cols: Dict[str, List] = {k: [] for k in _FIELDS}
+        self._frames = 0
+        self._group_t0 = time.monotonic()
+        self._writer = None
+        self._sink = None
+        self._part: Optional[int] = None
+        self._part_groups = 0
+        # Bộ đếm
+        self.rows = 0
+        self.groups = 0
+
+    def _open_writer(self):
+        pa = self._pa
+        stem, ext = os.path.splitext(self.out_path)
+        if self.fmt == "arrow":
+            path = self.out_path
+            if os.path.exists(path) and os.path.getsize(path) > 0:
+                ext = ext or ".arrow"
+                path = f"{stem}.{_next_part(stem, ext):05d}{ext}"
+                print(f"[WARN] {self.out_path} đã có dữ liệu, ghi sang {path}")
+            self._sink = pa.OSFile(path, "wb")
+            self._writer = pa.ipc.new_stream(self._sink, self.schema)
+            return
+        import pyarrow.parquet as pq  # type: ignore
+        ext = ext or ".parquet"
+        if self._part is None:
+            # Tiếp nối sau part của lần chạy trước thay vì ghi đè từ 00000
+            self._part = _next_part(stem, ext)
+        path = f"{stem}.{self._part:05d}{ext}"
+        while os.path.exists(path):
+            self._part += 1
+            path = f"{stem}.{self._part:05d}{ext}"
+        self._part += 1
+        self._part_groups = 0
+        self._writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+
+    def _close_writer(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        if self._sink is not None:
+            self._sink.close()
+            self._sink = None
+
+    def _flush_group(self):
+        if not self._frames:
+            return
+        table = self._pa.Table.from_pydict(self._cols, schema=self.schema)
+        if self._writer is None:
+            self._open_writer()
+        if self.fmt == "parquet":
+            self._writer.write_table(table, row_group_size=max(1, table.num_rows))
+        else:
+            self._writer.write_table(table)
+        self.groups += 1
+        self._cols = {k: [] for k in _FIELDS}
+        self._frames = 0
+        self._group_t0 = time.monotonic()
+        if self.fmt == "parquet":
+            self._part_groups += 1
+            if self._part_groups >= self.file_groups:
+                # Đóng part để footer được ghi xuống disk
+                self._close_writer()
+
+    def close(self):
+        self._flush_group()
+        self._close_writer()
+
+    def emit_detection(
+        self,
+        *,
+        schema_version: str,
+        pipeline_run_id: str,
+        source: Dict,
+        frame_index: int,
+        capture_ts: Optional[str],
+        image_size: Tuple[int,int],
+        dets: List[Det],
+        tracked: Optional[List[Tracked]] = None,
+        predicted: bool = False
+    ):
+        """Cùng giao diện với JsonEmitter.emit_detection; schema_version không cần lưu theo dòng."""
+        w, h = image_size
+        ts = datetime.fromisoformat(capture_ts or _utc_now_iso())
+        n = max(1, len(dets))
+        c = self._cols
+        c["pipeline_run_id"] += [pipeline_run_id] * n
+        c["store_id"] += [source.get("store_id")] * n
+        c["camera_id"] += [source.get("camera_id")] * n
+        c["stream_id"] += [source.get("stream_id")] * n
+        c["frame_index"] += [int(frame_index)] * n
+        c["capture_ts"] += [ts] * n
+        c["predicted"] += [bool(predicted)] * n
+        c["image_w"] += [int(w)] * n
+        c["image_h"] += [int(h)] * n
+
+        cols = det_columns(dets, image_size)
+        if cols is None:
+            for k in ("det_idx", "class_id", "class", "conf", "x1", "y1", "x2", "y2", "track_id"):
+                c[k].append(None)
+        else:
+            boxes, _, _, conf, cls_id = cols
+            c["det_idx"] += list(range(len(dets)))
+            c["class_id"] += cls_id
+            c["class"] += det_names(dets)
+            c["conf"] += conf
+            x1, y1, x2, y2 = zip(*boxes)
+            c["x1"] += x1
+            c["y1"] += y1
+            c["x2"] += x2
+            c["y2"] += y2
+            if tracked is not None and len(tracked) == len(dets):
+                c["track_id"] += [int(t[4]) for t in tracked]
+            else:
+                c["track_id"] += [None] * len(dets)
+        self.rows += n
+        self._frames += 1
+
+        if (self.group_frames and self._frames >= self.group_frames) or (
+            self.group_secs and time.monotonic() - self._group_t0 >= self.group_secs
+        ):
+            self._flush_group()
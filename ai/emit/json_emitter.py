@@ -1,8 +1,16 @@
 # ai/emit/json_emitter.py
-import sys, json, uuid
 from datetime import datetime, timezone
 from typing import List, Dict, Tuple, Optional
 
+import numpy as np
+
+from ai.detect.detections import det_arrays, det_names
+
+from .ndjson_writer import NdjsonWriter
+from .serializer import get_serializer
+
+SCHEMAS = ("full", "compact")
+
 Det = Tuple[int,int,int,int,float,int,str]       # (x1,y1,x2,y2,conf,cls_id,cls_name)
 Tracked = Tuple[int,int,int,int,int,float,str]   # (x1,y1,x2,y2,track_id,conf,cls_name)
 
@@ -10,28 +18,48 @@ def _utc_now_iso() -> str:
     return datetime.now(timezone.utc).isoformat()
 
 class JsonEmitter:
-    def __init__(self, out_path: Optional[str] = None):
+    def __init__(
+        self,
+        out_path: Optional[str] = None,
+        flush_interval: float = 0.0,
+        flush_bytes: int = 0,
+        async_write: bool = False,
+        queue_size: int = 1024,
+        rotate_bytes: int = 0,
+        rotate_secs: float = 0.0,
+        compress: str = "none",
+        schema: str = "full",
+        serializer: str = "auto",
+    ):
         """
         out_path: đường dẫn file NDJSON. Nếu None hoặc "-", ghi ra stdout.
+        schema: "full" (mỗi detection 1 object) hoặc "compact" (cột mảng mỗi frame + bản ghi header "run").
+        serializer: auto|orjson|msgspec|json (xem ai.emit.serializer).
+        Các tham số còn lại xem NdjsonWriter (buffer/flush, thread ghi nền, xoay + nén file).
         """
         self.out_path = out_path
-        self._fh = None
-        if out_path and out_path != "-":
-            self._fh = open(out_path, "a", encoding="utf-8")
+        self.schema = schema
+        self._dumps = get_serializer(serializer)
+        # Header đã ghi cho từng stream (schema compact)
+        self._streams: Dict[Tuple, Dict] = {}
+        self.writer = NdjsonWriter(
+            out_path,
+            flush_interval=flush_interval,
+            flush_bytes=flush_bytes,
+            async_write=async_write,
+            queue_size=queue_size,
+            rotate_bytes=rotate_bytes,
+            rotate_secs=rotate_secs,
+            compress=compress,
+        )
 
     def close(self):
-        if self._fh:
-            self._fh.close()
-            self._fh = None
-
-    def _write_line(self, obj: Dict):
-        line = json.dumps(obj, ensure_ascii=False)
-        if self._fh:
-            self._fh.write(line + "\n")
-            self._fh.flush()
-        else:
-            sys.stdout.write(line + "\n")
-            sys.stdout.flush()
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+    def _write_line(self, obj: Dict, preamble_key=None):
+        self.writer.write(self._dumps(obj), preamble_key=preamble_key)
 
     def emit_detection(
         self,
@@ -43,51 +71,38 @@ class JsonEmitter:
         capture_ts: Optional[str],
         image_size: Tuple[int,int],       # (w,h)
         dets: List[Det],
-        tracked: Optional[List[Tracked]] = None
+        tracked: Optional[List[Tracked]] = None,
+        predicted: bool = False
     ):
         """
         Ghi 1 bản ghi detection cho 1 frame. Nếu có 'tracked', sẽ điền track_id tương ứng.
+        predicted=True: frame không chạy detector, bbox là dự đoán Kalman của tracker.
         """
-        w, h = image_size
         ts = capture_ts or _utc_now_iso()
+        # giả định output của tracker giữ thứ tự theo detections
+        track_ids = [int(t[4]) for t in tracked] if tracked is not None and len(tracked) == len(dets) else None
+        cols = det_columns(dets, image_size)
+
+        if self.schema == "compact":
+            self._emit_compact(schema_version, pipeline_run_id, source, frame_index, ts, image_size, dets, cols, track_ids, predicted)
+            return
 
         detections = []
-        if tracked is not None and len(tracked) == len(dets):
-            # giả định output của tracker giữ thứ tự theo detections
-            for i, (d, t) in enumerate(zip(dets, tracked)):
-                x1, y1, x2, y2, conf, cls_id, cls_name = d
-                _, _, _, _, track_id, _, _ = t
-                detections.append({
-                    "det_id": f"{frame_index}-{i}",
-                    "class": cls_name,
-                    "class_id": int(cls_id),
-                    "conf": float(conf),
-                    "bbox": {"x1": int(x1), "y1": int(y1), "x2": int(x2), "y2": int(y2)},
-                    "bbox_norm": {
-                        "x": float(x1)/max(1,w),
-                        "y": float(y1)/max(1,h),
-                        "w": float(x2 - x1)/max(1,w),
-                        "h": float(y2 - y1)/max(1,h),
-                    },
-                    "centroid": {"x": int((x1 + x2)//2), "y": int((y1 + y2)//2)},
-                    "track_id": int(track_id)
-                })
-        else:
-            for i, (x1, y1, x2, y2, conf, cls_id, cls_name) in enumerate(dets):
+        if cols is not None:
+            boxes, norm, cen, conf, cls_id = cols
+            tids = track_ids if track_ids is not None else [None] * len(dets)
+            for i, name in enumerate(det_names(dets)):
+                x1, y1, x2, y2 = boxes[i]
+                nx, ny, nw, nh = norm[i]
                 detections.append({
                     "det_id": f"{frame_index}-{i}",
-                    "class": cls_name,
-                    "class_id": int(cls_id),
-                    "conf": float(conf),
-                    "bbox": {"x1": int(x1), "y1": int(y1), "x2": int(x2), "y2": int(y2)},
-                    "bbox_norm": {
-                        "x": float(x1)/max(1,w),
-                        "y": float(y1)/max(1,h),
-                        "w": float(x2 - x1)/max(1,w),
-                        "h": float(y2 - y1)/max(1,h),
-                    },
-                    "centroid": {"x": int((x1 + x2)//2), "y": int((y1 + y2)//2)},
-                    "track_id": None
+                    "class": name,
+                    "class_id": cls_id[i],
+                    "conf": conf[i],
+                    "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+                    "bbox_norm": {"x": nx, "y": ny, "w": nw, "h": nh},
+                    "centroid": {"x": cen[i][0], "y": cen[i][1]},
+                    "track_id": tids[i]
                 })
 
         record = {
@@ -98,4 +113,73 @@ class JsonEmitter:
             "capture_ts": ts,
             "detections": detections
         }
+        if predicted:
+            record["predicted"] = True
         self._write_line(record)
+
+    def _emit_compact(self, schema_version, pipeline_run_id, source, frame_index, ts, image_size, dets, cols, track_ids, predicted):
+        """
+        Schema compact: header (run/source/image_size) ghi 1 lần trong bản ghi "run",
+        mỗi frame chỉ còn các cột mảng. bbox_norm/centroid suy ra từ bbox + image_size.
+        """
+        key = (pipeline_run_id, source.get("store_id"), source.get("camera_id"), source.get("stream_id"))
+        stream = self._streams.get(key)
+        size = [int(image_size[0]), int(image_size[1])]
+        if stream is None or stream["image_size"] != size:
+            if stream is None:
+                stream = {"id": len(self._streams), "image_size": size, "classes": {}}
+                self._streams[key] = stream
+            stream["image_size"] = size
+            self._write_line({
+                "record": "run",
+                "schema_version": f"{schema_version}-compact",
+                "stream": stream["id"],
+                "pipeline_run_id": pipeline_run_id,
+                "source": source,
+                "image_size": size,
+            }, preamble_key=("run", stream["id"]))
+
+        names = stream["classes"]
+        new = {str(ci): name for ci, name in zip(cols[4], det_names(dets)) if str(ci) not in names} if cols is not None else {}
+        if new:
+            names.update(new)
+            self._write_line({"record": "classes", "stream": stream["id"], "names": dict(names)}, preamble_key=("classes", stream["id"]))
+
+        record = {
+            "record": "frame",
+            "stream": stream["id"],
+            "frame_index": int(frame_index),
+            "capture_ts": ts,
+            "bbox": cols[0] if cols is not None else [],
+            "class_id": cols[4] if cols is not None else [],
+            "conf": cols[3] if cols is not None else [],
+            "track_id": track_ids,
+        }
+        if predicted:
+            record["predicted"] = True
+        self._write_line(record)
+
+
+def det_columns(dets: List[Det], image_size: Tuple[int,int]):
+    """
+    Tính các cột (bbox, bbox_norm, centroid, conf, class_id) bằng NumPy cho cả frame,
+    trả về list Python (đã tolist) để serialize; None nếu không có detection.
+    """
+    if not len(dets):
+        return None
+    w, h = image_size
+    raw, conf, cls_id = det_arrays(dets)
+    boxes = raw.astype(np.int64)
+    norm = np.empty_like(raw)
+    norm[:, 0] = raw[:, 0] / max(1, w)
+    norm[:, 1] = raw[:, 1] / max(1, h)
+    norm[:, 2] = (raw[:, 2] - raw[:, 0]) / max(1, w)
+    norm[:, 3] = (raw[:, 3] - raw[:, 1]) / max(1, h)
+    cen = np.stack([(raw[:, 0] + raw[:, 2]) // 2, (raw[:, 1] + raw[:, 3]) // 2], axis=1).astype(np.int64)
+    return (
+        boxes.tolist(),
+        norm.tolist(),
+        cen.tolist(),
+        conf.tolist(),
+        cls_id.tolist(),
+    )
@@ -0,0 +1,312 @@
+# ai/emit/ndjson_writer.py
+"""
+Ghi NDJSON có buffer: gom dòng và flush theo chu kỳ/kích thước thay vì flush mỗi frame,
+tuỳ chọn ghi trên thread nền (hàng đợi giới hạn) và xoay file theo dung lượng/thời gian
+(nén gzip/zstd các segment đã đóng).
+"""
+import os
+import sys
+import gzip
+import time
+import queue
+import shutil
+import threading
+from datetime import datetime
+from typing import Dict, Hashable, List, Optional, Tuple
+
+COMPRESSIONS = ("none", "gzip", "zstd")
+
+
+def _compress_file(path: str, method: str) -> None:
+    """Nén 1 segment đã đóng rồi xoá file gốc."""
+    if method == "gzip":
+        dst = path + ".gz"
+        with open(path, "rb") as fin, gzip.open(dst, "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+    else:
+        import zstandard  # type: ignore
+        dst = path + ".zst"
+        with open(path, "rb") as fin, open(dst, "wb") as fout:
+            zstandard.ZstdCompressor().copy_stream(fin, fout)
+    os.remove(path)
+
+
+class RotatingFile:
+    """
+    File text (UTF-8) ghi nối tiếp, xoay khi vượt rotate_bytes hoặc mở quá rotate_secs (0 = tắt).
+    Mở ở chế độ nhị phân để dung lượng tính theo byte thật (tên class/camera tiếng Việt nhiều byte).
+    Segment đã đóng được đổi tên thành <stem>.<YYYYmmdd-HHMMSS><ext> và nén trên thread riêng;
+    file đang ghi luôn giữ nguyên tên out_path để công cụ downstream đọc tiếp.
+    Các dòng header (preamble) được ghi lại ở đầu mỗi segment mới để segment tự đủ thông tin.
+    """
+
+    def __init__(self, path: str, rotate_bytes: int = 0, rotate_secs: float = 0.0, compress: str = "none"):
+        if compress == "zstd":
+            try:
+                import zstandard  # type: ignore  # noqa: F401
+            except Exception:
+                print("[WARN] Thiếu zstandard ('pip install zstandard'), nén segment bằng gzip.")
+                compress = "gzip"
+        self.path = path
+        self.rotate_bytes = rotate_bytes
+        self.rotate_secs = rotate_secs
+        self.compress = compress
+        self._fh = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._jobs: List[threading.Thread] = []
+        self.preamble: Dict[Hashable, str] = {}
+        self.rotations = 0
+        self._open()
+
+    def _open(self) -> None:
+        self._fh = open(self.path, "ab")
+        self._size = self._fh.tell()
+        self._opened_at = time.monotonic()
+
+    def _due(self) -> bool:
+        if self.rotate_bytes and self._size >= self.rotate_bytes:
+            return True
+        return bool(self.rotate_secs) and time.monotonic() - self._opened_at >= self.rotate_secs
+
+    def _rotate(self) -> None:
+        self._fh.close()
+        stem, ext = os.path.splitext(self.path)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        seg = f"{stem}.{stamp}{ext}"
+        n = 1
+        while os.path.exists(seg) or os.path.exists(seg + ".gz") or os.path.exists(seg + ".zst"):
+            seg = f"{stem}.{stamp}-{n}{ext}"
+            n += 1
+        os.replace(self.path, seg)
+        self.rotations += 1
+        if self.compress != "none":
+            t = threading.Thread(target=_compress_file, args=(seg, self.compress), name="ndjson-compress", daemon=True)
+            t.start()
+            self._jobs = [j for j in self._jobs if j.is_alive()] + [t]
+        self._open()
+        for line in self.preamble.values():
+            data = line.encode("utf-8")
+            self._fh.write(data)
+            self._size += len(data)
+
+    def write(self, text: str, preamble_key: Optional[Hashable] = None) -> None:
+        """preamble_key != None: text là 1 dòng header, chỉ đăng ký sau khi đã thật sự ghi xuống file."""
+        if self._size and self._due():
+            self._rotate()
+        data = text.encode("utf-8")
+        self._fh.write(data)
+        self._size += len(data)
+        if preamble_key is not None:
+            self.preamble[preamble_key] = text
+
+    def flush(self) -> None:
+        self._fh.flush()
+
+    def close(self) -> None:
+        if self._fh:
+            self._fh.close()
+            self._fh = None
+        for t in self._jobs:
+            t.join()
+        self._jobs = []
+
+
+class _Stdout:
+    def write(self, text: str, preamble_key: Optional[Hashable] = None) -> None:
+        sys.stdout.write(text)
+
+    def flush(self) -> None:
+        sys.stdout.flush()
+
+    def close(self) -> None:
+        sys.stdout.flush()
+
+
+class NdjsonWriter:
+    """
+    Ghi từng dòng NDJSON ra file (RotatingFile) hoặc stdout.
+
+    - flush_interval : flush khi dòng cũ nhất trong buffer đã chờ quá N giây (ghi đồng bộ: có thêm
+      thread timer flush khi không còn write() nào, vd camera im/motion gate/chờ reconnect)
+    - flush_bytes    : flush khi buffer vượt N byte (UTF-8)
+      (cả 2 bằng 0 -> flush mỗi dòng như trước)
+    - async_write    : ghi trên thread nền; write() chỉ đẩy vào hàng đợi giới hạn queue_size
+      (đầy thì chờ, đếm vào `stalls`) nên vòng lặp chính không bị chặn bởi disk; thread ghi chết
+      vì lỗi I/O thì write()/close() ném lại lỗi đó thay vì chờ hàng đợi mãi
+    """
+
+    def __init__(
+        self,
+        out_path: Optional[str] = None,
+        flush_interval: float = 0.0,
+        flush_bytes: int = 0,
+        async_write: bool = False,
+        queue_size: int = 1024,
+        rotate_bytes: int = 0,
+        rotate_secs: float = 0.0,
+        compress: str = "none",
+    ):
+        if out_path and out_path != "-":
+            self._out = RotatingFile(out_path, rotate_bytes, rotate_secs, compress)
+        else:
+            self._out = _Stdout()
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+        self._buf: List[Tuple[str, Optional[Hashable]]] = []
+        self._buf_bytes = 0
+        self._buf_t0 = 0.0
+        # Bộ đếm
+        self.lines = 0
+        self.flushes = 0
+        self.stalls = 0
+
+        self._q: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._error: Optional[BaseException] = None
+        # Ghi đồng bộ: buffer dùng chung giữa write() và thread timer
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._timer: Optional[threading.Thread] = None
+        if async_write:
+            self._q = queue.Queue(maxsize=max(1, queue_size))
+            self._thread = threading.Thread(target=self._writer_loop, name="ndjson-writer", daemon=True)
+            self._thread.start()
+        elif flush_interval:
+            self._timer = threading.Thread(target=self._timer_loop, name="ndjson-flush", daemon=True)
+            self._timer.start()
+
+    def _append(self, line: str, preamble_key: Optional[Hashable] = None) -> None:
+        if not self._buf:
+            self._buf_t0 = time.monotonic()
+        self._buf.append((line, preamble_key))
+        self._buf_bytes += len(line) if line.isascii() else len(line.encode("utf-8"))
+        self.lines += 1
+
+    def _flush_due(self) -> bool:
+        if not self._buf:
+            return False
+        if not self.flush_interval and not self.flush_bytes:
+            return True
+        if self.flush_bytes and self._buf_bytes >= self.flush_bytes:
+            return True
+        return bool(self.flush_interval) and time.monotonic() - self._buf_t0 >= self.flush_interval
+
+    def _flush_buffer(self) -> None:
+        if not self._buf:
+            return
+        out = self._out
+        if isinstance(out, RotatingFile) and out.rotate_bytes:
+            # Ghi từng dòng để xoay file đúng ranh giới dòng
+            for line, key in self._buf:
+                out.write(line, key)
+        else:
+            out.write("".join(line for line, _ in self._buf))
+            if isinstance(out, RotatingFile):
+                for line, key in self._buf:
+                    if key is not None:
+                        out.preamble[key] = line
+        out.flush()
+        self._buf = []
+        self._buf_bytes = 0
+        self.flushes += 1
+
+    def _writer_loop(self) -> None:
+        try:
+            while True:
+                timeout = None
+                if self._buf and self.flush_interval:
+                    timeout = max(0.0, self.flush_interval - (time.monotonic() - self._buf_t0))
+                try:
+                    item = self._q.get(timeout=timeout)
+                except queue.Empty:
+                    self._flush_buffer()
+                    continue
+                if item is None:
+                    break
+                self._append(*item)
+                # Gom hết dòng đang chờ trước khi quyết định flush
+                while True:
+                    try:
+                        item = self._q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is None:
+                        self._flush_buffer()
+                        return
+                    self._append(*item)
+                if self._flush_due():
+                    self._flush_buffer()
+            self._flush_buffer()
+        except BaseException as e:  # noqa: BLE001
+            self._error = e
+
+    def _timer_loop(self) -> None:
+        """Ghi đồng bộ: flush buffer quá flush_interval kể cả khi không có write() mới."""
+        timeout = self.flush_interval
+        while not self._stop.wait(timeout):
+            with self._lock:
+                try:
+                    if self._flush_due():
+                        self._flush_buffer()
+                except BaseException as e:  # noqa: BLE001
+                    self._error = e
+                    return
+                timeout = self.flush_interval
+                if self._buf:
+                    timeout = max(0.01, self.flush_interval - (time.monotonic() - self._buf_t0))
+
+    def write(self, line: str, preamble_key: Optional[Hashable] = None) -> None:
+        """
+        Ghi 1 dòng (không kèm '\\n'). preamble_key != None: dòng header, được ghi lại
+        đầu mỗi segment sau khi xoay file (cùng key thì dòng mới thay dòng cũ).
+        """
+        if self._error is not None:
+            raise self._error
+        item = (line + "\n", preamble_key)
+        if self._q is None:
+            with self._lock:
+                self._append(*item)
+                if self._flush_due():
+                    self._flush_buffer()
+            return
+        try:
+            self._q.put_nowait(item)
+        except queue.Full:
+            self.stalls += 1
+            self._put(item)
+
+    def _put(self, item) -> None:
+        """Chờ chỗ trống trong hàng đợi, kiểm tra lại thread ghi giữa các lần chờ."""
+        while True:
+            if self._error is not None:
+                raise self._error
+            if not self._thread.is_alive():
+                raise RuntimeError("Thread ghi NDJSON đã dừng")
+            try:
+                self._q.put(item, timeout=0.5)
+                return
+            except queue.Full:
+                continue
+
+    def close(self) -> None:
+        if self._thread is not None:
+            # Thread ghi đã chết (lỗi I/O) thì không còn ai lấy sentinel: không chờ
+            while self._thread.is_alive():
+                try:
+                    self._q.put(None, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            self._thread.join()
+            self._thread = None
+        else:
+            if self._timer is not None:
+                self._stop.set()
+                self._timer.join()
+                self._timer = None
+            if self._error is None:
+                self._flush_buffer()
+        self._out.close()
+        if self._error is not None:
+            raise self._error
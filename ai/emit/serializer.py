@@ -0,0 +1,47 @@
+# ai/emit/serializer.py
+"""
+Chọn bộ serialize JSON: orjson / msgspec nếu đã cài (nhanh hơn nhiều lần), fallback json stdlib.
+Mọi serializer trả về str 1 dòng (không kèm '\\n').
+"""
+import json
+from typing import Any, Callable
+
+SERIALIZERS = ("auto", "orjson", "msgspec", "json")
+
+
+def _orjson() -> Callable[[Any], str]:
+    import orjson  # type: ignore
+    opt = orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(obj: Any) -> str:
+        return orjson.dumps(obj, option=opt).decode("utf-8")
+    return dumps
+
+
+def _msgspec() -> Callable[[Any], str]:
+    import msgspec  # type: ignore
+    enc = msgspec.json.Encoder()
+
+    def dumps(obj: Any) -> str:
+        return enc.encode(obj).decode("utf-8")
+    return dumps
+
+
+def _stdlib() -> Callable[[Any], str]:
+    def dumps(obj: Any) -> str:
+        return json.dumps(obj, ensure_ascii=False)
+    return dumps
+
+
+def get_serializer(name: str = "auto") -> Callable[[Any], str]:
+    """Trả về hàm obj -> str. name='auto' thử orjson, rồi msgspec, cuối cùng json."""
+    if name == "json":
+        return _stdlib()
+    candidates = ("orjson", "msgspec") if name == "auto" else (name,)
+    for cand in candidates:
+        try:
+            return _orjson() if cand == "orjson" else _msgspec()
+        except ImportError:
+            if name != "auto":
+                print(f"[WARN] Chưa cài {cand} ('pip install {cand}'), dùng json stdlib.")
+    return _stdlib()
@@ -1,224 +1,364 @@
 """
 CLI điều phối ingest -> detect -> track -> emit.
-Hỗ trợ backend GStreamer (mặc định) và fallback OpenCV, tracker DeepSORT hoặc Simple.
+Hỗ trợ backend GStreamer (mặc định) và fallback OpenCV, tracker DeepSORT hoặc SORT/ByteTrack (chỉ chuyển động).
+cv2 (GUI), gi, torch/ultralytics chỉ được import khi thật sự cần (--display 1, backend gst, --yolo...).
 """
 
-import os
 import time
+
+_T0 = time.perf_counter()  # mốc tính thời gian khởi động (gồm cả import)
+
+import os
 import uuid
 import argparse
 from datetime import datetime, timezone
 
-import cv2
-
-
-def safe_int_env(env_var: str, default: str) -> int:
-    """Parse env var to int safely, return default if invalid."""
-    try:
-        return int(os.getenv(env_var, default))
-    except ValueError:
-        return int(default)
-
-
-def safe_float_env(env_var: str, default: str) -> float:
-    """Parse env var to float safely, return default if invalid."""
+from .factory import (
+    ModelLoader,
+    add_detect_track_args,
+    add_emit_args,
+    add_metrics_args,
+    add_pipeline_args,
+    init_detect_controls,
+    init_emitter,
+    init_metrics,
+    open_source,
+    resolve_drop_policy,
+    safe_int_env,
+)
+from .pipeline import FramePacket, ThreadedPipeline, detect_stage, motion_stage, run_serial, track_stage
+from .reconnect import ReconnectingSource
+from .startup import StartupTimer
+
+
+def _draw_tracked(frame, tracked, scale: tuple[float, float] = (1.0, 1.0)) -> None:
+    import cv2
+
+    sx, sy = scale
+    for x1, y1, x2, y2, tid, cf, name in tracked:
+        if (sx, sy) != (1.0, 1.0):
+            x1, y1, x2, y2 = int(x1 * sx), int(y1 * sy), int(x2 * sx), int(y2 * sy)
+        color = (0, 255, 0) if tid > 0 else (255, 0, 0)
+        label = f"{'ID'+str(tid)+':' if tid>0 else ''}{name}:{cf:.2f}"
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(
+            frame,
+            label,
+            (x1, max(0, y1 - 5)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            color,
+            1,
+            cv2.LINE_AA,
+        )
+
+
+class _Sink:
+    """Stage cuối: emit NDJSON, hiển thị, log FPS. Luôn chạy trên main thread."""
+
+    def __init__(self, args, det, tracker, emitter, pipeline_run_id, source_info, pipeline=None, controls=None, metrics=None, startup=None):
+        self.args = args
+        self.det = det
+        self.tracker = tracker
+        self.emitter = emitter
+        self.pipeline_run_id = pipeline_run_id
+        self.source_info = source_info
+        self.source = None
+        self.pipeline = pipeline
+        self.controls = controls
+        self.metrics = metrics
+        self.startup = startup
+        self.t0 = time.time()
+        self.frames = 0
+        self.det_total = 0
+        self.detected = 0
+        self.win = "Ingestion Preview (q=quit)"
+
+    def __call__(self, pkt: FramePacket) -> bool:
+        args = self.args
+        frame = pkt.frame
+        self.frames += 1
+        if self.startup is not None and self.startup.mark_ready():
+            print(f"[INFO] Startup: {self.startup.summary()}")
+        if not pkt.predicted:
+            self.det_total += len(pkt.dets)
+            self.detected += 1
+
+        metrics = self.metrics
+        t0 = time.perf_counter()
+        # Emit NDJSON (detection per-frame)
+        if self.emitter and self.det is not None:
+            h, w = frame.shape[:2]
+            self.emitter.emit_detection(
+                schema_version="1.0",
+                pipeline_run_id=self.pipeline_run_id,
+                source=self.source_info,
+                frame_index=pkt.index,
+                capture_ts=pkt.capture_ts,
+                image_size=(w, h),
+                dets=pkt.dets,
+                tracked=pkt.tracked if self.tracker else None,
+                predicted=pkt.predicted,
+            )
+            if metrics is not None:
+                t1 = time.perf_counter()
+                metrics.observe("emit", t1 - t0)
+                t0 = t1
+
+        # Vẽ bbox + ID (nếu bật display). Có nhánh full-res thì vẽ lên frame gốc (scale bbox).
+        view = frame
+        if args.display and pkt.full is not None:
+            view = pkt.full
+        if args.display and self.det is not None and pkt.tracked is not None:
+            scale = (view.shape[1] / frame.shape[1], view.shape[0] / frame.shape[0])
+            _draw_tracked(view, pkt.tracked, scale)
+
+        # Hiển thị
+        if args.display:
+            import cv2
+
+            cv2.imshow(self.win, view)
+            key = cv2.waitKey(1) & 0xFF
+            if metrics is not None:
+                metrics.observe("display", time.perf_counter() - t0)
+            if key == ord("q"):
+                print("[INFO] Quit by user.")
+                return False
+        if metrics is not None:
+            metrics.tick()
+
+        # Log
+        if self.frames % args.fps_log == 0:
+            fps = self.frames / (time.time() - self.t0)
+            h, w = frame.shape[:2]
+            extra = ""
+            if self.det is not None:
+                extra = f" | det_total={self.det_total}"
+                if self.tracker is not None:
+                    extra += f" | active_tracks={self.tracker.tracks_count}"
+                    if hasattr(self.tracker, "embed_stats"):
+                        extra += f" | {self.tracker.embed_stats()}"
+                if self.detected < self.frames:
+                    extra += f" | detected={self.detected}/{self.frames}"
+                gate = self.controls.gate if self.controls is not None else None
+                if gate is not None:
+                    extra += f" | motion_gated={gate.gated} | motion_processed={gate.processed}"
+            if self.pipeline is not None:
+                extra += f" | queues={self.pipeline.queue_depths()} | dropped={self.pipeline.dropped}"
+            if isinstance(self.source, ReconnectingSource):
+                extra += f" | {self.source.stats()}"
+            if metrics is not None:
+                extra += f" | {metrics.short()}"
+            print(f"[INFO] Frames={self.frames} | Res={w}x{h} | ~{fps:.1f} FPS{extra}")
+        return True
+
+
+def _reader(src, metrics=None, startup=None):
+    state = {"index": 0}
+    read_full = getattr(src, "read_full", None)
+    hist = metrics.histogram("read") if metrics is not None else None
+
+    def read() -> FramePacket | None:
+        t0 = time.perf_counter()
+        ok, frame = src.read()
+        if hist is not None and ok:
+            hist.observe(time.perf_counter() - t0)
+        if not ok or frame is None:
+            print("[INFO] End of stream or read error.")
+            return None
+        state["index"] += 1
+        if startup is not None:
+            startup.mark_first_frame()
+        pkt = FramePacket(state["index"], frame, datetime.now(timezone.utc).isoformat(), on_release=src.release_frame)
+        if read_full is not None:
+            pkt.full = read_full()
+        return pkt
+    return read
+
+
+def _build_stages(args, det, tracker, controls, metrics=None) -> list:
+    if det is None:
+        return []
+    stages = [("motion", motion_stage(lambda _pkt: controls))] if controls.gate is not None else []
+    stages += [
+        ("infer", detect_stage(det, args.det_batch, args.det_batch_wait_ms, controls=controls)),
+        ("track", track_stage(tracker)),
+    ]
+    if metrics is None:
+        return [stage for _, stage in stages]
+    return [metrics.timed(name, stage) for name, stage in stages]
+
+
+def _register_gauges(metrics, sink, src) -> None:
+    """Gauge/counter đọc trực tiếp từ trạng thái pipeline lúc scrape."""
+    if sink.startup is not None:
+        startup = sink.startup
+        metrics.gauge(
+            "pipeline_startup_seconds",
+            "Thời gian khởi động theo phase (first_frame/first_result tính từ lúc import)",
+            lambda: [({"phase": name}, sec) for name, sec in startup.phases()],
+        )
+    metrics.gauge("pipeline_frames_total", "Số frame đã xử lý", lambda: sink.frames, "counter")
+    metrics.gauge("pipeline_detections_total", "Số detection từ detector", lambda: sink.det_total, "counter")
+    metrics.gauge("pipeline_detected_frames_total", "Số frame chạy detector", lambda: sink.detected, "counter")
+    metrics.gauge("pipeline_fps", "FPS trung bình từ lúc chạy", lambda: sink.frames / max(1e-6, time.time() - sink.t0))
+    if sink.tracker is not None:
+        metrics.gauge("pipeline_active_tracks", "Số track đang giữ", lambda: sink.tracker.tracks_count)
+        if hasattr(sink.tracker, "embed_hits"):
+            metrics.gauge("pipeline_embed_cache_hits_total", "Embedding dùng lại từ cache", lambda: sink.tracker.embed_hits, "counter")
+            metrics.gauge("pipeline_embed_cache_misses_total", "Embedding phải tính lại", lambda: sink.tracker.embed_misses, "counter")
+    gate = sink.controls.gate if sink.controls is not None else None
+    if gate is not None:
+        metrics.gauge("pipeline_motion_gated_total", "Frame bị motion gate chặn", lambda: gate.gated, "counter")
+    if sink.pipeline is not None:
+        pipe = sink.pipeline
+        metrics.gauge(
+            "pipeline_queue_depth",
+            "Số phần tử trong hàng đợi giữa các stage",
+            lambda: [({"queue": str(i)}, d) for i, d in enumerate(pipe.queue_depths())],
+        )
+        metrics.gauge("pipeline_dropped_frames_total", "Frame bị bỏ do hàng đợi đầy", lambda: pipe.dropped, "counter")
+    if isinstance(src, ReconnectingSource):
+        metrics.gauge("pipeline_source_reconnects_total", "Số lần kết nối lại nguồn", lambda: src.reconnects, "counter")
+        metrics.gauge("pipeline_source_downtime_seconds_total", "Tổng thời gian mất nguồn", lambda: src.downtime, "counter")
+
+
+def _report_source(src) -> None:
+    pool = getattr(src, "pool", None)
+    if pool is not None:
+        print(f"[INFO] Frame pool: allocated={pool.allocated} | misses={pool.misses} | in_use={pool.in_use}")
+    if isinstance(src, ReconnectingSource):
+        print(f"[INFO] Source: {src.stats()}")
+
+
+def _run_serial(args, src, det, tracker, emitter, pipeline_run_id, source_info, metrics=None, startup=None) -> None:
+    controls = init_detect_controls(args)
+    sink = _Sink(args, det, tracker, emitter, pipeline_run_id, source_info, controls=controls, metrics=metrics, startup=startup)
+    sink.source = src
+    if metrics is not None:
+        _register_gauges(metrics, sink, src)
     try:
-        return float(os.getenv(env_var, default))
-    except ValueError:
-        return float(default)
+        run_serial(_reader(src, metrics, startup), _build_stages(args, det, tracker, controls, metrics), sink)
+    finally:
+        if metrics is not None:
+            metrics.close()
+        _report_source(src)
+        src.release()
+        if emitter:
+            emitter.close()
+        if args.display:
+            import cv2
 
-try:
-    from .gst_source import GstSource  # type: ignore
-    _GST_AVAILABLE = True
-except Exception:
-    GstSource = None  # type: ignore
-    _GST_AVAILABLE = False
+            cv2.destroyAllWindows()
 
-from .cv_source import CvSource
 
+def _run_threaded(args, src, det, tracker, emitter, pipeline_run_id, source_info, drop_policy: str, metrics=None, startup=None) -> None:
+    controls = init_detect_controls(args)
+    sink = _Sink(args, det, tracker, emitter, pipeline_run_id, source_info, controls=controls, metrics=metrics, startup=startup)
+    pipe = ThreadedPipeline(
+        _reader(src, metrics, startup),
+        _build_stages(args, det, tracker, controls, metrics),
+        sink,
+        queue_size=args.queue_size,
+        drop_policy=drop_policy,
+    )
+    sink.pipeline = pipe
+    sink.source = src
+    if metrics is not None:
+        _register_gauges(metrics, sink, src)
+    if isinstance(src, ReconnectingSource):
+        # Dừng pipeline thì ngắt luôn vòng chờ reconnect
+        src.stop = pipe.stop
+    print(f"[INFO] Pipeline threaded: queue_size={args.queue_size} | drop_policy={drop_policy}")
+    try:
+        pipe.run()
+    finally:
+        if metrics is not None:
+            metrics.close()
+        _report_source(src)
+        src.release()
+        if emitter:
+            emitter.close()
+        if args.display:
+            import cv2
 
-def _maybe_init_detector(args):
-    if not args.yolo:
-        return None
-    from ai.detect.yolo_detector import YoloDetector
-    classes = [c.strip() for c in args.classes.split(",")] if args.classes else None
-    return YoloDetector(model_path=args.model, conf=args.conf, classes=classes)
+            cv2.destroyAllWindows()
+        if pipe.dropped:
+            print(f"[INFO] Dropped frames (queue đầy): {pipe.dropped}")
 
 
 def main():
+    startup = StartupTimer(_T0)
+    startup.record("imports", time.perf_counter() - _T0)
+    t_args = time.perf_counter()
     ap = argparse.ArgumentParser()
     # Ingest & hiển thị
     ap.add_argument("--src", required=True, help="Đường dẫn file hoặc RTSP URL")
-    ap.add_argument(
-        "--backend",
-        type=str,
-        choices=["gst", "cv"],
-        default=os.getenv("INGEST_BACKEND", "gst"),
-        help="Chọn backend đọc video: gst (GStreamer) hoặc cv (OpenCV)",
-    )
+    add_pipeline_args(ap)
     ap.add_argument("--display", type=int, default=safe_int_env("DISPLAY", "1"), help="Hiển thị preview (1/0)")
     ap.add_argument("--fps_log", type=int, default=safe_int_env("FPS_LOG_INTERVAL", "30"), help="Chu kỳ log FPS")
+    add_metrics_args(ap)
 
-    # YOLO (detect)
-    ap.add_argument("--yolo", type=int, default=1, help="Bật YOLO detect (1/0)")
-    ap.add_argument("--model", type=str, default=os.getenv("YOLO_MODEL", "yolov8n.pt"), help="Model YOLOv8")
-    ap.add_argument("--conf", type=float, default=safe_float_env("YOLO_CONF", "0.25"), help="Ngưỡng confidence")
+    # Chế độ chạy pipeline
     ap.add_argument(
-        "--classes",
+        "--pipeline",
         type=str,
-        default=os.getenv("YOLO_CLASSES", "person"),
-        help="Lọc class, ví dụ: 'person,bag'",
+        choices=["serial", "threaded"],
+        default=os.getenv("PIPELINE_MODE", "serial"),
+        help="serial: 1 vòng lặp; threaded: ingest/detect/track/emit chạy thread riêng",
     )
-
-    # Tracking
-    ap.add_argument("--track", type=int, default=safe_int_env("ENABLE_TRACK", "1"), help="Bật tracking (1/0)")
-    # DeepSORT tuning
-    ap.add_argument("--track_max_age", type=int, default=safe_int_env("TRACK_MAX_AGE", "30"), help="Frames giữ track khi bị mất (max_age)")
-    ap.add_argument("--track_n_init", type=int, default=safe_int_env("TRACK_N_INIT", "3"), help="Số lần hit để xác nhận track (n_init)")
-    ap.add_argument("--track_iou", type=float, default=safe_float_env("TRACK_IOU", "0.7"), help="Ngưỡng IoU cho matching (max_iou_distance)")
-    ap.add_argument("--track_nms_overlap", type=float, default=safe_float_env("TRACK_NMS_OVERLAP", "1.0"), help="NMS max overlap trong tracker")
-    ap.add_argument("--track_embedder", type=str, default=os.getenv("TRACK_EMBEDDER", "mobilenet"), help="Loại embedder appearance (vd: mobilenet)")
-    ap.add_argument("--track_embedder_gpu", type=int, default=safe_int_env("TRACK_EMBEDDER_GPU", "0"), help="Dùng GPU cho embedder (1/0)")
-    ap.add_argument("--track_half", type=int, default=safe_int_env("TRACK_EMBEDDER_HALF", "0"), help="FP16 cho embedder (1/0)")
+    add_detect_track_args(ap)
 
     # Emit NDJSON (detection per-frame) & metadata nguồn
     ap.add_argument("--emit", type=str, default="none", choices=["none", "detection"], help="Kiểu dữ liệu xuất NDJSON")
     ap.add_argument("--out", type=str, default="-", help="Đường dẫn file NDJSON (mặc định '-' = stdout)")
+    add_emit_args(ap)
     ap.add_argument("--store_id", type=str, default=os.getenv("STORE_ID", "store_01"))
     ap.add_argument("--camera_id", type=str, default=os.getenv("CAMERA_ID", "cam_01"))
     ap.add_argument("--stream_id", type=str, default=os.getenv("STREAM_ID", "stream_01"))
     ap.add_argument("--run_id", type=str, default=os.getenv("PIPELINE_RUN_ID", ""))
 
     args = ap.parse_args()
+    startup.record("args", time.perf_counter() - t_args)
 
-    # Detector & Tracker
-    det = _maybe_init_detector(args)
-    tracker = None
-    if args.track:
-        try:
-            from ai.track.deepsort_tracker import DeepSortTracker
-            tracker = DeepSortTracker(
-                max_age=args.track_max_age,
-                n_init=args.track_n_init,
-                max_iou_distance=args.track_iou,
-                nms_max_overlap=args.track_nms_overlap,
-                embedder=args.track_embedder,
-                embedder_gpu=bool(args.track_embedder_gpu),
-                half=bool(args.track_half),
-            )
-        except Exception as e:
-            print("[ERROR] Không khởi tạo được DeepSORT. Hãy cài đặt deep-sort-realtime: 'pip install deep-sort-realtime'.")
-            print(f"Chi tiết: {e}")
-            raise SystemExit(2)
+    # Detector & Tracker: load + warmup trên thread nền, song song với mở emitter/source
+    models = ModelLoader(args, startup)
 
     # Emitter NDJSON
     emitter = None
     if args.emit != "none":
-        from ai.emit.json_emitter import JsonEmitter
-
-        emitter = JsonEmitter(out_path=args.out)
+        with startup.phase("emitter"):
+            emitter = init_emitter(args, args.out)
 
     pipeline_run_id = args.run_id if args.run_id else uuid.uuid4().hex
     source_info = {"store_id": args.store_id, "camera_id": args.camera_id, "stream_id": args.stream_id}
 
-    # Mở nguồn video
-    backend = args.backend
-    if backend == "gst" and not _GST_AVAILABLE:
-        print("[WARN] GStreamer backend không sẵn sàng (thiếu gi). Tự động chuyển sang OpenCV.")
-        backend = "cv"
-
-    if backend == "gst":
-        src = GstSource(args.src)  # type: ignore
-    else:
-        src = CvSource(args.src)
-
-    if not src.open():
-        print(f"[ERROR] Không mở được nguồn: {args.src} (backend={backend})")
-        raise SystemExit(2)
-
-    t0 = time.time()
-    frames = 0
-    det_total = 0
-    win = "Ingestion Preview (q=quit)"
+    metrics = init_metrics(args, base={"pipeline_run_id": pipeline_run_id, "source": source_info})
 
+    # Mở nguồn video; lỗi (mở source hoặc load model) thì đóng emitter/metrics đã tạo rồi mới thoát
+    src = None
     try:
-        while True:
-            ok, frame = src.read()
-            if not ok or frame is None:
-                print("[INFO] End of stream or read error.")
-                break
-            frames += 1
-
-            tracked = None
-            dets = []
-            # Detect + Track
-            if det is not None:
-                dets = det.infer(frame)  # [(x1,y1,x2,y2,conf,cls_id,cls_name)]
-                det_total += len(dets)
-
-                if tracker:
-                    tracked = tracker.update(dets, frame)  # [(x1,y1,x2,y2,tid,conf,cls)]
-                else:
-                    tracked = [(x1, y1, x2, y2, -1, conf, cls) for (x1, y1, x2, y2, conf, _, cls) in dets]
-
-                # Vẽ bbox + ID (nếu bật display)
-                if args.display:
-                    for x1, y1, x2, y2, tid, cf, name in tracked:
-                        color = (0, 255, 0) if tid > 0 else (255, 0, 0)
-                        label = f"{'ID'+str(tid)+':' if tid>0 else ''}{name}:{cf:.2f}"
-                        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
-                        cv2.putText(
-                            frame,
-                            label,
-                            (x1, max(0, y1 - 5)),
-                            cv2.FONT_HERSHEY_SIMPLEX,
-                            0.5,
-                            color,
-                            1,
-                            cv2.LINE_AA,
-                        )
-
-            # Emit NDJSON (detection per-frame)
-            if emitter and det is not None:
-                h, w = frame.shape[:2]
-                capture_ts = datetime.now(timezone.utc).isoformat()
-                emitter.emit_detection(
-                    schema_version="1.0",
-                    pipeline_run_id=pipeline_run_id,
-                    source=source_info,
-                    frame_index=frames,
-                    capture_ts=capture_ts,
-                    image_size=(w, h),
-                    dets=dets,
-                    tracked=tracked if tracker else None,
-                )
-
-            # Hiển thị
-            if args.display:
-                cv2.imshow(win, frame)
-                if cv2.waitKey(1) & 0xFF == ord("q"):
-                    print("[INFO] Quit by user.")
-                    break
-
-            # Log
-            if frames % args.fps_log == 0:
-                fps = frames / (time.time() - t0)
-                h, w = frame.shape[:2]
-                extra = ""
-                if det is not None:
-                    active_tracks = 0
-                    if tracker is not None:
-                        if hasattr(tracker, "tracker") and hasattr(tracker.tracker, "tracks"):
-                            active_tracks = len(tracker.tracker.tracks)
-                    extra = f" | det_total={det_total}" + (f" | active_tracks={active_tracks}" if tracker else "")
-                print(f"[INFO] Frames={frames} | Res={w}x{h} | ~{fps:.1f} FPS{extra}")
-
-    finally:
-        src.release()
+        with startup.phase("source"):
+            src = open_source(args.src, args.backend, pool_size=args.frame_pool, args=args, full_res=bool(args.display))
+        if src is None:
+            raise SystemExit(2)
+        with startup.phase("wait_models"):
+            det, tracker = models.result()
+    except BaseException:
+        models.close()
+        if src is not None:
+            src.release()
+        if metrics is not None:
+            metrics.close()
         if emitter:
             emitter.close()
-        if args.display:
-            cv2.destroyAllWindows()
+        raise
+
+    if args.pipeline == "threaded":
+        drop_policy = resolve_drop_policy(args.drop_policy, args.src)
+        _run_threaded(args, src, det, tracker, emitter, pipeline_run_id, source_info, drop_policy, metrics, startup)
+    else:
+        _run_serial(args, src, det, tracker, emitter, pipeline_run_id, source_info, metrics, startup)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+# ai/ingest/cadence.py
+"""
+Nhịp chạy detector (detect cadence): chỉ chạy YOLO mỗi N frame, các frame còn lại
+để tracker dự đoán Kalman (predicted). Chế độ adaptive tự chọn N theo mức chuyển động.
+"""
+from typing import List, Optional
+
+import numpy as np
+
+from ai.detect.detections import det_arrays
+
+
+class DetectCadence:
+    """
+    - Cố định : detect khi đã qua `every` frame kể từ lần detect trước.
+    - Adaptive: khoảng cách detect thay đổi trong [1, max_every]:
+        * không có đối tượng        -> nhân đôi (cảnh tĩnh)
+        * chuyển động nhanh         -> giảm một nửa
+        * có đối tượng, di chuyển chậm -> tăng dần 1
+      Chuyển động = dịch chuyển tâm bbox trung bình mỗi frame, chuẩn hoá theo chiều cao bbox.
+    """
+
+    def __init__(self, every: int = 1, adaptive: bool = False, max_every: int = 8, motion_thresh: float = 0.05):
+        self.every = max(1, every)
+        self.adaptive = adaptive
+        self.min_every = 1
+        self.max_every = max(self.every, max_every)
+        self.motion_thresh = motion_thresh
+        self.interval = self.every
+        self._last_index: Optional[int] = None
+        self._last_centroids: Optional[np.ndarray] = None
+        # Bộ đếm
+        self.detected = 0
+        self.skipped = 0
+
+    def should_detect(self, index: int) -> bool:
+        if self._last_index is None or index - self._last_index >= self.interval:
+            self._last_index = index
+            self.detected += 1
+            return True
+        self.skipped += 1
+        return False
+
+    def observe(self, index: int, dets: List) -> None:
+        """Cập nhật interval sau 1 lần detect (chỉ dùng ở chế độ adaptive)."""
+        if not self.adaptive:
+            return
+        if not dets:
+            self.interval = min(self.max_every, self.interval * 2)
+            self._last_centroids = None
+            return
+
+        boxes = det_arrays(dets)[0].astype(np.float32)
+        cur = np.stack([(boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2], axis=1)
+        heights = np.maximum(1.0, boxes[:, 3] - boxes[:, 1])
+        motion = 0.0
+        if self._last_centroids is not None and len(self._last_centroids):
+            # Khoảng cách tới tâm gần nhất ở lần detect trước, chia cho số frame đã trôi qua
+            dist = np.linalg.norm(cur[:, None, :] - self._last_centroids[None, :, :], axis=2).min(axis=1)
+            motion = float(np.mean(dist / heights)) / max(1, self.interval)
+        self._last_centroids = cur
+
+        if motion > self.motion_thresh:
+            self.interval = max(self.min_every, self.interval // 2)
+        else:
+            self.interval = min(self.max_every, self.interval + 1)
+
+    @property
+    def ratio(self) -> float:
+        """Tỉ lệ frame thực sự chạy detector."""
+        total = self.detected + self.skipped
+        return self.detected / total if total else 1.0
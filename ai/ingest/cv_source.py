@@ -2,29 +2,56 @@ import cv2
 import numpy as np
 from typing import Optional, Tuple
 
+from .frame_pool import FramePool
+
 
 class CvSource:
     """
     OpenCV-based video source. Supports file path or RTSP URL.
     Produces BGR frames compatible with OpenCV/Ultralytics.
+
+    pool_size > 0: decode thẳng vào buffer tái sử dụng (FramePool); consumer gọi release_frame().
+    pool: pool dựng sẵn (vd ShmFramePool dùng chung qua các lần reconnect), thay cho pool_size.
+    stall_timeout > 0: timeout mở/đọc (giây) của backend FFmpeg, tránh read() treo khi camera mất kết nối.
     """
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, pool_size: int = 0, stall_timeout: float = 0.0, pool=None):
         self.path = path
+        self.stall_timeout = stall_timeout
         self.cap: Optional[cv2.VideoCapture] = None
+        self.pool = pool if pool is not None else (FramePool(pool_size) if pool_size > 0 else None)
+        self._shape: Optional[Tuple[int, ...]] = None
 
     def open(self) -> bool:
-        self.cap = cv2.VideoCapture(self.path)
+        if self.stall_timeout > 0 and hasattr(cv2, "CAP_PROP_READ_TIMEOUT_MSEC"):
+            ms = int(self.stall_timeout * 1000)
+            params = [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, ms, cv2.CAP_PROP_READ_TIMEOUT_MSEC, ms]
+            self.cap = cv2.VideoCapture(self.path, cv2.CAP_ANY, params)
+        else:
+            self.cap = cv2.VideoCapture(self.path)
         return bool(self.cap and self.cap.isOpened())
 
     def read(self) -> Tuple[bool, Optional[np.ndarray]]:
         if not self.cap:
             return False, None
-        ok, frame = self.cap.read()
+        if self.pool is not None and self._shape is not None:
+            buf = self.pool.acquire(self._shape)
+            ok, frame = self.cap.read(buf)
+            if frame is not buf:
+                # Lỗi hoặc đổi độ phân giải: OpenCV cấp phát mảng mới
+                self.pool.release(buf)
+        else:
+            ok, frame = self.cap.read()
         if not ok:
             return False, None
+        self._shape = frame.shape
         return True, frame
 
+    def release_frame(self, frame: np.ndarray) -> None:
+        """Trả buffer của frame về pool (no-op nếu không bật pool)."""
+        if self.pool is not None:
+            self.pool.release(frame)
+
     def release(self) -> None:
         if self.cap:
             self.cap.release()
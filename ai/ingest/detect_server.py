@@ -0,0 +1,406 @@
+# ai/ingest/detect_server.py
+"""
+Server detect chạy lâu dài: load detector (YOLO/ONNX/OpenVINO/replay/synth) 1 lần, giữ model "nóng"
+và phục vụ nhiều process ingest qua Unix socket (hoặc named pipe Windows / TCP).
+
+- Mỗi client 1 kết nối (multiprocessing.connection): header nhỏ (pickle) + pixel gửi bằng send_bytes
+  (không pickle mảng ảnh). Detector frame_keyed (replay/synth) không nhìn pixel nên chỉ gửi shape.
+- Client decode vào shared memory (--frame_shm 1, cùng máy): chỉ gửi (segment, offset, strides) của
+  frame/crop, server đọc thẳng slot đó, không copy pixel. Server không attach được thì client tự
+  quay về gửi pixel.
+- 1 thread infer duy nhất gom ảnh từ mọi client thành batch (tối đa --det_batch ảnh, chờ tối đa
+  --det_batch_wait_ms) rồi trả kết quả về từng client.
+- Process ingest dùng --detector remote --det_server ADDR: không import torch/ultralytics, không giữ
+  bản model riêng.
+- Header được pickle nên kết nối luôn phải xác thực (authkey): TCP bắt buộc --det_server_key; Unix
+  socket / named pipe không đặt key thì server tự sinh và ghi vào file <địa chỉ>.key (quyền 0600),
+  client cùng user đọc file đó.
+
+Ví dụ:
+    python -m ai.ingest.detect_server --listen /tmp/ai_detect.sock --model yolov8n.pt --det_batch 8
+    python -m ai.ingest --src rtsp://... --detector remote --det_server /tmp/ai_detect.sock --display 0
+"""
+import os
+import sys
+import time
+import queue
+import signal
+import argparse
+import tempfile
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import List, Optional
+
+import numpy as np
+
+from .factory import add_detect_track_args, init_detector, safe_float_env, safe_int_env, warmup_detector
+from .shm_ring import ShmAttachments, shm_ref
+
+DEFAULT_ADDRESS = r"\\.\pipe\ai_detect" if sys.platform == "win32" else "/tmp/ai_detect.sock"
+
+
+def parse_address(addr: str):
+    """'host:port' -> (host, port) TCP; còn lại là đường dẫn Unix socket / named pipe Windows."""
+    host, sep, port = addr.rpartition(":")
+    if sep and host and port.isdigit() and not addr.startswith("\\\\"):
+        return host, int(port)
+    return addr
+
+
+def _authkey(key: str) -> Optional[bytes]:
+    return key.encode("utf-8") if key else None
+
+
+def key_file(address) -> Optional[str]:
+    """File chứa authkey tự sinh của server Unix socket / named pipe; None với TCP."""
+    if not isinstance(address, str):
+        return None
+    if address.startswith("\\\\"):
+        return os.path.join(tempfile.gettempdir(), address.rsplit("\\", 1)[-1] + ".key")
+    return address + ".key"
+
+
+def read_key_file(address) -> Optional[bytes]:
+    path = key_file(address)
+    if path is None or not os.path.exists(path):
+        return None
+    with open(path, "rb") as f:
+        return f.read().strip() or None
+
+
+class _Request:
+    __slots__ = ("conn", "frames", "keys")
+
+    def __init__(self, conn, frames: list, keys: Optional[list]):
+        self.conn = conn
+        self.frames = frames
+        self.keys = keys
+
+
+class DetectServer:
+    """
+    det: detector đã khởi tạo (interface infer_batch). batch_size/max_wait: gom ảnh giữa các client.
+    serve_forever() chạy accept trên thread gọi; Ctrl+C hoặc stop() để dừng.
+    authkey: bắt buộc với TCP (ValueError nếu thiếu); Unix socket / named pipe không có authkey thì
+    tự sinh và ghi ra key_file(address) khi bắt đầu listen.
+    """
+
+    def __init__(self, det, address, authkey: Optional[bytes] = None, batch_size: int = 8, max_wait: float = 0.005, log_interval: float = 10.0):
+        if not authkey and not isinstance(address, str):
+            raise ValueError("Detect server TCP cần authkey")
+        self.det = det
+        self.address = address
+        self._key_file = None
+        if not authkey:
+            authkey = os.urandom(16).hex().encode("utf-8")
+            self._key_file = key_file(address)
+        self.authkey = authkey
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.log_interval = log_interval
+        self.keyed = bool(getattr(det, "frame_keyed", False))
+        self.info = {
+            "frame_keyed": self.keyed,
+            "detector": type(det).__name__,
+            "pid": os.getpid(),
+        }
+        self._q: "queue.Queue[_Request]" = queue.Queue()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self.clients = 0
+        self.requests = 0
+        self.frames = 0
+        self.batches = 0
+        self.errors = 0
+        self._listener = None
+
+    def _prepare_address(self) -> None:
+        """Xoá file socket cũ còn sót (server trước bị kill) nếu không còn ai listen."""
+        if not isinstance(self.address, str) or self.address.startswith("\\\\") or not os.path.exists(self.address):
+            return
+        try:
+            # Không authkey: chỉ kiểm tra có ai listen (server kia bỏ qua kết nối ở bước xác thực)
+            Client(self.address).close()
+        except (OSError, EOFError):
+            os.unlink(self.address)
+            return
+        raise OSError(f"Đã có server khác đang listen tại {self.address}")
+
+    def _write_key_file(self) -> None:
+        fd = os.open(self._key_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(self.authkey)
+        print(f"[INFO] Detect server: authkey tự sinh tại {self._key_file}")
+
+    def _remove_key_file(self) -> None:
+        if self._key_file is not None:
+            try:
+                os.unlink(self._key_file)
+            except FileNotFoundError:
+                pass
+
+    def serve_forever(self) -> None:
+        self._prepare_address()
+        if self._key_file is not None:
+            self._write_key_file()
+        self._listener = Listener(self.address, authkey=self.authkey)
+        infer = threading.Thread(target=self._infer_loop, name="detect-server-infer", daemon=True)
+        infer.start()
+        print(f"[INFO] Detect server: listen={self.address} | detector={self.info['detector']} | batch={self.batch_size} | wait={self.max_wait * 1000:.0f}ms")
+        try:
+            while not self._stop.is_set():
+                try:
+                    conn = self._listener.accept()
+                    if self._stop.is_set():
+                        conn.close()
+                        break
+                except (OSError, EOFError, AuthenticationError) as e:
+                    # Client sai authkey / ngắt giữa handshake: bỏ qua, tiếp tục accept
+                    if self._stop.is_set():
+                        break
+                    print(f"[WARN] Detect server: kết nối lỗi ({type(e).__name__}: {e})")
+                    continue
+                threading.Thread(target=self._client_loop, args=(conn,), name="detect-server-client", daemon=True).start()
+        finally:
+            self.stop()
+            infer.join(timeout=5.0)
+            self._listener.close()
+            self._remove_key_file()
+
+    def stop(self) -> None:
+        if self._stop.is_set():
+            return
+        self._stop.set()
+        if self._listener is not None:
+            # Đánh thức accept() đang chặn (kết nối không authkey: server bỏ qua ở bước xác thực)
+            try:
+                Client(self.address).close()
+            except (OSError, EOFError):
+                pass
+
+    def _client_loop(self, conn) -> None:
+        with self._lock:
+            self.clients += 1
+        shm = ShmAttachments()
+        try:
+            conn.send(self.info)
+            while not self._stop.is_set():
+                shapes, dtype, keys, refs = conn.recv()
+                if self.keyed:
+                    # Không cần pixel: mảng "ảo" đúng shape (không cấp phát) cho phần clip bbox theo view
+                    frames = [np.broadcast_to(np.zeros(1, dtype=dtype), shape) for shape in shapes]
+                else:
+                    refs = refs or [None] * len(shapes)
+                    frames = [np.frombuffer(conn.recv_bytes(), dtype=dtype).reshape(shape) if ref is None else None for shape, ref in zip(shapes, refs)]
+                    try:
+                        for i, ref in enumerate(refs):
+                            if ref is not None:
+                                frames[i] = shm.view(ref[0], ref[1], shapes[i], ref[2], dtype)
+                    except (OSError, ValueError, TypeError) as e:
+                        conn.send(("noshm", str(e)))
+                        continue
+                self._q.put(_Request(conn, frames, keys))
+        except (EOFError, OSError):
+            pass
+        except Exception as e:  # gói tin sai định dạng: bỏ client này, server vẫn chạy
+            print(f"[WARN] Detect server: client gửi dữ liệu lỗi ({e}), đóng kết nối.")
+        finally:
+            conn.close()
+            shm.close()
+            with self._lock:
+                self.clients -= 1
+
+    def _next_batch(self) -> List[_Request]:
+        try:
+            first = self._q.get(timeout=0.5)
+        except queue.Empty:
+            return []
+        batch = [first]
+        n = len(first.frames)
+        deadline = time.perf_counter() + self.max_wait
+        while n < self.batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                req = self._q.get(timeout=remaining) if remaining > 0 else self._q.get_nowait()
+            except queue.Empty:
+                break
+            batch.append(req)
+            n += len(req.frames)
+        return batch
+
+    def _infer_loop(self) -> None:
+        last_log = time.time()
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._run_batch(batch)
+            now = time.time()
+            if self.log_interval > 0 and now - last_log >= self.log_interval:
+                last_log = now
+                print(f"[INFO] Detect server: {self.stats()}")
+
+    def _run_batch(self, batch: List[_Request]) -> None:
+        frames = [f for req in batch for f in req.frames]
+        try:
+            if self.keyed:
+                results = self.det.infer_batch(frames, keys=[k for req in batch for k in req.keys])
+            else:
+                results = self.det.infer_batch(frames)
+            replies = []
+            start = 0
+            for req in batch:
+                replies.append(("ok", results[start:start + len(req.frames)]))
+                start += len(req.frames)
+        except Exception as e:
+            self.errors += 1
+            print(f"[ERROR] Detect server: infer_batch lỗi: {e}")
+            replies = [("error", str(e))] * len(batch)
+        self.batches += 1
+        self.requests += len(batch)
+        self.frames += len(frames)
+        for req, reply in zip(batch, replies):
+            try:
+                req.conn.send(reply)
+            except (OSError, EOFError):
+                pass  # client đã ngắt; _client_loop tự dọn
+
+    def stats(self) -> str:
+        avg = self.frames / self.batches if self.batches else 0.0
+        return f"clients={self.clients} | requests={self.requests} | frames={self.frames} | batches={self.batches} (avg {avg:.1f} ảnh/batch) | errors={self.errors}"
+
+
+class RemoteDetector:
+    """
+    Detector phía client: cùng interface infer/infer_batch, gửi ảnh tới DetectServer và chờ kết quả.
+    frame_keyed lấy theo detector của server. Mất kết nối thì tự kết nối lại 1 lần rồi gửi lại.
+    Frame nằm trong ShmFramePool (--frame_shm) chỉ gửi tham chiếu slot; server khác máy/không attach
+    được thì tắt shared memory và gửi pixel.
+    wait: số giây chờ server sẵn sàng (server có thể đang khởi động cùng lúc).
+    authkey: None thì đọc key_file(address) do server Unix socket / named pipe tự sinh.
+    """
+
+    def __init__(self, address: str, authkey: Optional[bytes] = None, wait: float = 10.0):
+        self.address = parse_address(address)
+        self.authkey = authkey
+        self.wait = wait
+        self._lock = threading.Lock()
+        self._conn = None
+        self.server: dict = {}
+        self.frame_keyed = False
+        self.use_shm = True
+        self.shm_frames = 0
+        self._connect()
+
+    def _connect(self) -> None:
+        deadline = time.monotonic() + self.wait
+        while True:
+            try:
+                # Không truyền key: dùng key server tự sinh (đọc lại mỗi lần, server khởi động lại thì key đổi)
+                conn = Client(self.address, authkey=self.authkey or read_key_file(self.address))
+                break
+            except (OSError, EOFError, AuthenticationError) as e:
+                # Sai key tự đặt thì thôi; key đọc từ file có thể là của server cũ đang được thay
+                if time.monotonic() >= deadline or (isinstance(e, AuthenticationError) and self.authkey):
+                    raise
+                time.sleep(0.2)
+        self.server = conn.recv()
+        self.frame_keyed = bool(self.server.get("frame_keyed", False))
+        self._conn = conn
+
+    def _request(self, frames: List[np.ndarray], keys: Optional[list]) -> list:
+        conn = self._conn
+        dtype = frames[0].dtype.str if frames else "|u1"
+        refs = None
+        if not self.frame_keyed and self.use_shm:
+            refs = [shm_ref(f) for f in frames]
+            if not any(refs):
+                refs = None
+        conn.send(([f.shape for f in frames], dtype, keys if self.frame_keyed else None, refs))
+        if not self.frame_keyed:
+            for i, f in enumerate(frames):
+                if refs is None or refs[i] is None:
+                    # send_bytes cắt buffer theo chiều đầu tiên nên phải là mảng 1 chiều (crop ROI mới bị copy)
+                    conn.send_bytes(np.ascontiguousarray(f).reshape(-1))
+        status, payload = conn.recv()
+        if status == "noshm":
+            print(f"[WARN] Detect server không đọc được shared memory ({payload}), chuyển sang gửi pixel.")
+            self.use_shm = False
+            return self._request(frames, keys)
+        if status != "ok":
+            raise RuntimeError(f"Detect server lỗi: {payload}")
+        if refs is not None:
+            self.shm_frames += sum(r is not None for r in refs)
+        return payload
+
+    def infer(self, frame_bgr: np.ndarray) -> list:
+        return self.infer_batch([frame_bgr])[0]
+
+    def infer_batch(self, frames: List[np.ndarray], keys: Optional[list] = None) -> list:
+        if not frames:
+            return []
+        with self._lock:
+            try:
+                return self._request(frames, keys)
+            except (EOFError, OSError):
+                print(f"[WARN] Mất kết nối detect server {self.address}, kết nối lại...")
+                self.close()
+                self._connect()
+                return self._request(frames, keys)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except OSError:
+                pass
+            self._conn = None
+
+
+def _sigterm(_signum, _frame):
+    raise KeyboardInterrupt
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Server detect dùng chung: load model 1 lần, phục vụ nhiều process ingest")
+    ap.add_argument("--listen", type=str, default=os.getenv("DET_SERVER", DEFAULT_ADDRESS), help="Đường dẫn Unix socket / named pipe, hoặc host:port (TCP)")
+    ap.add_argument("--log_interval", type=float, default=safe_float_env("DET_SERVER_LOG_INTERVAL", "10"), help="Chu kỳ log thống kê (giây, 0 = tắt)")
+    add_detect_track_args(ap)
+    # Server gom ảnh từ nhiều client: batch lớn hơn, chờ ngắn hơn mặc định của ai.ingest
+    ap.set_defaults(det_batch=safe_int_env("DET_BATCH", "8"), det_batch_wait_ms=safe_float_env("DET_BATCH_WAIT_MS", "5"))
+    args = ap.parse_args()
+    if args.detector == "remote":
+        print("[ERROR] Server không thể dùng --detector remote.")
+        raise SystemExit(2)
+    address = parse_address(args.listen)
+    if not isinstance(address, str) and not args.det_server_key:
+        # Header được pickle: listen TCP không xác thực = ai tới được port cũng chạy được code trên máy
+        print("[ERROR] Listen TCP (host:port) cần --det_server_key (ENV: DET_SERVER_KEY).")
+        raise SystemExit(2)
+    args.yolo = 1
+
+    det = init_detector(args)
+    if args.model_warmup:
+        warmup_detector(det, args)
+    server = DetectServer(
+        det,
+        address,
+        authkey=_authkey(args.det_server_key),
+        batch_size=args.det_batch,
+        max_wait=args.det_batch_wait_ms / 1000.0,
+        log_interval=args.log_interval,
+    )
+    # systemd/docker dừng bằng SIGTERM: xử lý như Ctrl+C để đóng listener và xoá file socket
+    signal.signal(signal.SIGTERM, _sigterm)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("[INFO] Quit by user.")
+    except OSError as e:
+        print(f"[ERROR] {e}")
+        raise SystemExit(2)
+    print(f"[INFO] Detect server: {server.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,628 @@
+# ai/ingest/factory.py
+"""
+Khởi tạo dùng chung cho các entry point ingest (1 camera và multi-camera):
+tham số CLI detect/track, detector, tracker, nguồn video.
+
+Module nặng (cv2, gi/GStreamer, torch/ultralytics, embedder) chỉ được import khi stage tương ứng
+thật sự được bật, để khởi động nhanh.
+"""
+import os
+import argparse
+from typing import Optional
+
+from .pipeline import DROP_POLICIES, DetectControls
+from .reconnect import ReconnectingSource, is_live_source
+
+_GST_AVAILABLE: Optional[bool] = None
+
+
+def _gst_available() -> bool:
+    """Import gst_source (gi) lần đầu cần tới backend gst; kết quả được nhớ lại."""
+    global _GST_AVAILABLE
+    if _GST_AVAILABLE is None:
+        try:
+            from . import gst_source  # noqa: F401
+            _GST_AVAILABLE = True
+        except Exception:
+            _GST_AVAILABLE = False
+    return _GST_AVAILABLE
+
+
+def safe_int_env(env_var: str, default: str) -> int:
+    """Parse env var to int safely, return default if invalid."""
+    try:
+        return int(os.getenv(env_var, default))
+    except ValueError:
+        return int(default)
+
+
+def safe_float_env(env_var: str, default: str) -> float:
+    """Parse env var to float safely, return default if invalid."""
+    try:
+        return float(os.getenv(env_var, default))
+    except ValueError:
+        return float(default)
+
+
+def add_pipeline_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument(
+        "--backend",
+        type=str,
+        choices=["gst", "cv"],
+        default=os.getenv("INGEST_BACKEND", "gst"),
+        help="Chọn backend đọc video: gst (GStreamer) hoặc cv (OpenCV)",
+    )
+    ap.add_argument("--queue_size", type=int, default=safe_int_env("PIPELINE_QUEUE_SIZE", "4"), help="Kích thước hàng đợi giữa các stage (threaded)")
+    ap.add_argument(
+        "--drop_policy",
+        type=str,
+        choices=["auto", *DROP_POLICIES],
+        default=os.getenv("PIPELINE_DROP_POLICY", "auto"),
+        help="Khi hàng đợi ingest đầy: auto (RTSP=drop_oldest, file=block), block, drop_oldest",
+    )
+    ap.add_argument(
+        "--frame_pool",
+        type=int,
+        default=safe_int_env("FRAME_POOL", "0"),
+        help="Số buffer frame tái sử dụng (0 = tắt, mỗi frame cấp phát mới)",
+    )
+    ap.add_argument(
+        "--frame_shm",
+        type=int,
+        default=safe_int_env("FRAME_SHM", "0"),
+        help="Decode vào ring shared memory (--frame_pool slot, mặc định 16) để detect server đọc frame theo slot, không copy (1/0)",
+    )
+    # Scale/rate trong graph GStreamer (chỉ backend gst)
+    ap.add_argument("--gst_width", type=int, default=safe_int_env("GST_WIDTH", "0"), help="Scale frame về chiều rộng này trong GStreamer (0 = giữ nguyên)")
+    ap.add_argument("--gst_height", type=int, default=safe_int_env("GST_HEIGHT", "0"), help="Scale frame về chiều cao này trong GStreamer (0 = giữ nguyên)")
+    ap.add_argument("--gst_fps", type=float, default=safe_float_env("GST_FPS", "0"), help="FPS mục tiêu qua videorate (0 = giữ nguyên)")
+    # Codec/graph decode (chỉ backend gst)
+    ap.add_argument(
+        "--gst_codec",
+        type=str,
+        choices=["auto", "h264", "h265"],
+        default=os.getenv("GST_CODEC", "auto"),
+        help="auto = uridecodebin tự chọn container/codec; h264/h265 = graph decode tường minh",
+    )
+    ap.add_argument(
+        "--gst_pipeline",
+        type=str,
+        default=os.getenv("GST_PIPELINE", ""),
+        help="Template graph GStreamer tuỳ chỉnh, placeholder {src}/{uri}; không có appsink thì tự nối phần output",
+    )
+    # Reconnect nguồn live (RTSP/HTTP)
+    ap.add_argument("--reconnect", type=int, default=safe_int_env("RECONNECT", "1"), help="Tự kết nối lại nguồn live khi mất tín hiệu (1/0)")
+    ap.add_argument("--reconnect_max_retries", type=int, default=safe_int_env("RECONNECT_MAX_RETRIES", "0"), help="Số lần thử tối đa mỗi lần mất kết nối (0 = không giới hạn)")
+    ap.add_argument("--reconnect_backoff_max", type=float, default=safe_float_env("RECONNECT_BACKOFF_MAX", "30"), help="Thời gian chờ tối đa giữa 2 lần thử (giây)")
+    ap.add_argument("--stall_timeout", type=float, default=safe_float_env("STALL_TIMEOUT", "10"), help="Không có frame quá N giây thì coi là mất kết nối (0 = chờ mãi)")
+    ap.add_argument("--gst_decoder_threads", type=int, default=safe_int_env("GST_DECODER_THREADS", "0"), help="Số thread decoder mỗi nguồn (0 = tự động)")
+
+
+def add_metrics_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument("--metrics_port", type=int, default=safe_int_env("METRICS_PORT", "0"), help="Cổng HTTP /metrics kiểu Prometheus (0 = tắt)")
+    ap.add_argument("--metrics_host", type=str, default=os.getenv("METRICS_HOST", "127.0.0.1"), help="Địa chỉ bind của endpoint /metrics")
+    ap.add_argument("--metrics_out", type=str, default=os.getenv("METRICS_OUT", ""), help="File NDJSON ghi bản ghi stats định kỳ ('-' = stdout, rỗng = tắt)")
+    ap.add_argument("--metrics_interval", type=float, default=safe_float_env("METRICS_INTERVAL", "10"), help="Chu kỳ ghi bản ghi stats (giây)")
+
+
+def add_detect_track_args(ap: argparse.ArgumentParser) -> None:
+    # YOLO (detect)
+    ap.add_argument("--yolo", type=int, default=1, help="Bật YOLO detect (1/0)")
+    ap.add_argument(
+        "--detector",
+        type=str,
+        choices=["yolo", "replay", "synth", "remote"],
+        default=os.getenv("DETECTOR", "yolo"),
+        help="yolo (model thật), replay (phát lại detection từ NDJSON --replay), synth (ground truth cảnh tổng hợp) hoặc remote (gửi ảnh tới ai.ingest.detect_server); replay/synth/remote không cần ultralytics/GPU/mạng",
+    )
+    ap.add_argument(
+        "--det_server",
+        type=str,
+        default=os.getenv("DET_SERVER", ""),
+        help="remote: địa chỉ detect server (Unix socket / named pipe, hoặc host:port); trống = địa chỉ mặc định của server",
+    )
+    ap.add_argument("--det_server_key", type=str, default=os.getenv("DET_SERVER_KEY", ""), help="Khoá xác thực kết nối detect server (bắt buộc với TCP; Unix socket bỏ trống = dùng key server tự sinh)")
+    ap.add_argument("--det_server_wait", type=float, default=safe_float_env("DET_SERVER_WAIT", "10"), help="remote: số giây chờ server sẵn sàng")
+    ap.add_argument("--replay", type=str, default=os.getenv("DET_REPLAY", ""), help="replay: file/glob NDJSON detection đã emit")
+    ap.add_argument("--synth_objects", type=int, default=safe_int_env("SYNTH_OBJECTS", "10"), help="synth: số đối tượng")
+    ap.add_argument("--synth_speed", type=float, default=safe_float_env("SYNTH_SPEED", "4"), help="synth: tốc độ đối tượng (pixel/frame)")
+    ap.add_argument("--synth_still", type=float, default=safe_float_env("SYNTH_STILL", "0"), help="synth: tỉ lệ đối tượng đứng yên")
+    ap.add_argument("--synth_seed", type=int, default=safe_int_env("SYNTH_SEED", "0"), help="synth: seed cảnh/nhiễu")
+    ap.add_argument("--synth_jitter", type=float, default=safe_float_env("SYNTH_JITTER", "0"), help="synth: nhiễu toạ độ bbox (pixel, độ lệch chuẩn)")
+    ap.add_argument("--synth_miss", type=float, default=safe_float_env("SYNTH_MISS", "0"), help="synth: xác suất bỏ sót mỗi đối tượng mỗi frame")
+    ap.add_argument("--stub_latency_ms", type=float, default=safe_float_env("STUB_LATENCY_MS", "0"), help="replay/synth: thời gian giả lập mỗi lần infer_batch (ms)")
+    ap.add_argument(
+        "--model_warmup",
+        type=int,
+        default=safe_int_env("MODEL_WARMUP", "1"),
+        help="Load + chạy 1 lần infer/embed giả trên thread nền, song song với mở source (1/0)",
+    )
+    ap.add_argument("--model", type=str, default=os.getenv("YOLO_MODEL", "yolov8n.pt"), help="Model YOLOv8")
+    ap.add_argument("--conf", type=float, default=safe_float_env("YOLO_CONF", "0.25"), help="Ngưỡng confidence")
+    ap.add_argument(
+        "--classes",
+        type=str,
+        default=os.getenv("YOLO_CLASSES", "person"),
+        help="Lọc class, ví dụ: 'person,bag'",
+    )
+    ap.add_argument(
+        "--runtime",
+        type=str,
+        default=os.getenv("YOLO_RUNTIME", "torch"),
+        choices=["torch", "onnx", "openvino"],
+        help="Runtime chạy YOLO: torch (Ultralytics) hoặc onnx/openvino (export .pt 1 lần vào cache, không cần torch khi chạy)",
+    )
+    ap.add_argument("--device", type=str, default=os.getenv("YOLO_DEVICE", "cpu"), help="Device cho runtime torch (vd: cpu, cuda:0)")
+    ap.add_argument("--imgsz", type=int, default=safe_int_env("YOLO_IMGSZ", "640"), help="Kích thước ảnh đầu vào model")
+    ap.add_argument(
+        "--precision",
+        type=str,
+        default=os.getenv("YOLO_PRECISION", "fp32"),
+        choices=["fp32", "fp16", "int8"],
+        help="Độ chính xác artifact export (onnx: fp32/int8, openvino: fp32/fp16/int8)",
+    )
+    ap.add_argument("--intra_threads", type=int, default=safe_int_env("YOLO_INTRA_THREADS", "0"), help="Số thread trong 1 op (0 = mặc định runtime)")
+    ap.add_argument("--inter_threads", type=int, default=safe_int_env("YOLO_INTER_THREADS", "0"), help="Số thread giữa các op / stream OpenVINO (0 = mặc định)")
+    ap.add_argument("--model_cache", type=str, default=os.getenv("MODEL_CACHE_DIR", ".cache/models"), help="Thư mục cache artifact đã export")
+    ap.add_argument("--det_batch", type=int, default=safe_int_env("DET_BATCH", "1"), help="Số frame tối đa gom vào 1 lần YOLO forward")
+    ap.add_argument(
+        "--det_batch_wait_ms",
+        type=float,
+        default=safe_float_env("DET_BATCH_WAIT_MS", "50"),
+        help="Deadline gom batch (ms) tính từ frame đầu tiên của batch",
+    )
+    ap.add_argument("--detect_every", type=int, default=safe_int_env("DETECT_EVERY", "1"), help="Chạy YOLO mỗi N frame, frame còn lại dùng dự đoán của tracker")
+    ap.add_argument("--detect_adaptive", type=int, default=safe_int_env("DETECT_ADAPTIVE", "0"), help="Tự chọn N theo mức chuyển động (1/0)")
+    ap.add_argument("--detect_max_every", type=int, default=safe_int_env("DETECT_MAX_EVERY", "8"), help="N tối đa ở chế độ adaptive")
+
+    # Motion gate (bỏ YOLO khi cảnh tĩnh)
+    ap.add_argument("--motion_gate", type=int, default=safe_int_env("MOTION_GATE", "0"), help="Bật motion gate trước detect (1/0)")
+    ap.add_argument("--motion_width", type=int, default=safe_int_env("MOTION_WIDTH", "160"), help="Chiều rộng frame thu nhỏ để so sánh")
+    ap.add_argument("--motion_thresh", type=int, default=safe_int_env("MOTION_THRESH", "25"), help="Ngưỡng chênh lệch mức xám (0-255)")
+    ap.add_argument("--motion_min_area", type=float, default=safe_float_env("MOTION_MIN_AREA", "0.002"), help="Tỉ lệ pixel thay đổi tối thiểu")
+    ap.add_argument("--motion_alpha", type=float, default=safe_float_env("MOTION_ALPHA", "0.05"), help="Tốc độ học background (1.0 = frame differencing)")
+    ap.add_argument("--motion_roi", type=int, default=safe_int_env("MOTION_ROI", "1"), help="Chỉ detect vùng có chuyển động (1/0)")
+
+    # Vùng detect: polygon ROI và chia tile cho camera độ phân giải cao
+    ap.add_argument(
+        "--det_roi",
+        type=str,
+        default=os.getenv("DET_ROI", ""),
+        help="Polygon ROI 'x,y;x,y;x,y' (nhiều polygon ngăn bởi '|', toạ độ <= 1 là tỉ lệ); pixel ngoài ROI không được detect",
+    )
+    ap.add_argument("--tile", type=int, default=safe_int_env("DET_TILE", "0"), help="Cạnh ô tile (pixel frame gốc, 0 = tắt), nên bằng imgsz")
+    ap.add_argument("--tile_overlap", type=float, default=safe_float_env("DET_TILE_OVERLAP", "0.2"), help="Tỉ lệ chồng lấn giữa 2 ô kề nhau")
+    ap.add_argument("--tile_full", type=int, default=safe_int_env("DET_TILE_FULL", "1"), help="Detect thêm cả frame thu nhỏ khi chia tile (1/0)")
+    ap.add_argument("--tile_merge", type=float, default=safe_float_env("DET_TILE_MERGE", "0.6"), help="Ngưỡng giao/box nhỏ hơn để gộp bbox trùng giữa các ô")
+
+    # Tracking
+    ap.add_argument("--track", type=int, default=safe_int_env("ENABLE_TRACK", "1"), help="Bật tracking (1/0)")
+    ap.add_argument(
+        "--tracker",
+        type=str,
+        choices=["deepsort", "sort", "bytetrack"],
+        default=os.getenv("TRACKER", "deepsort"),
+        help="deepsort (Kalman + appearance embedder) hoặc sort/bytetrack (chỉ Kalman + IoU, không embedder)",
+    )
+    ap.add_argument("--track_high", type=float, default=safe_float_env("TRACK_HIGH", "0.5"), help="bytetrack: conf tối thiểu của detection vòng 1 / tạo track mới")
+    ap.add_argument("--track_low", type=float, default=safe_float_env("TRACK_LOW", "0.1"), help="bytetrack: conf tối thiểu của detection vòng 2")
+    # DeepSORT tuning
+    ap.add_argument("--track_max_age", type=int, default=safe_int_env("TRACK_MAX_AGE", "30"), help="Frames giữ track khi bị mất (max_age)")
+    ap.add_argument("--track_n_init", type=int, default=safe_int_env("TRACK_N_INIT", "3"), help="Số lần hit để xác nhận track (n_init)")
+    ap.add_argument("--track_iou", type=float, default=safe_float_env("TRACK_IOU", "0.7"), help="Ngưỡng IoU cho matching (max_iou_distance)")
+    ap.add_argument("--track_nms_overlap", type=float, default=safe_float_env("TRACK_NMS_OVERLAP", "1.0"), help="NMS max overlap trong tracker")
+    ap.add_argument("--track_embedder", type=str, default=os.getenv("TRACK_EMBEDDER", "mobilenet"), help="Loại embedder appearance (vd: mobilenet; stub = không torch/weights, cho chạy offline)")
+    ap.add_argument("--track_embedder_gpu", type=int, default=safe_int_env("TRACK_EMBEDDER_GPU", "0"), help="Dùng GPU cho embedder (1/0)")
+    ap.add_argument("--track_half", type=int, default=safe_int_env("TRACK_EMBEDDER_HALF", "0"), help="FP16 cho embedder (1/0)")
+    ap.add_argument(
+        "--track_embed_cache_iou",
+        type=float,
+        default=safe_float_env("TRACK_EMBED_CACHE_IOU", "0.9"),
+        help="Dùng lại embedding của track khi bbox có IoU >= ngưỡng với bbox lúc tính (0 = tắt cache)",
+    )
+    ap.add_argument(
+        "--track_embed_refresh",
+        type=int,
+        default=safe_int_env("TRACK_EMBED_REFRESH", "10"),
+        help="Tính lại embedding sau tối đa N lần detect dù bbox không đổi",
+    )
+
+
+def add_emit_args(ap: argparse.ArgumentParser) -> None:
+    ap.add_argument(
+        "--emit_format",
+        type=str,
+        choices=["ndjson", "parquet", "arrow"],
+        default=os.getenv("EMIT_FORMAT", "ndjson"),
+        help="Định dạng file xuất: ndjson, parquet (file part có footer) hoặc arrow (IPC stream)",
+    )
+    ap.add_argument("--emit_group_frames", type=int, default=safe_int_env("EMIT_GROUP_FRAMES", "300"), help="parquet/arrow: cắt row group sau N frame")
+    ap.add_argument("--emit_group_secs", type=float, default=safe_float_env("EMIT_GROUP_SECS", "10"), help="parquet/arrow: cắt row group sau N giây")
+    ap.add_argument("--emit_file_groups", type=int, default=safe_int_env("EMIT_FILE_GROUPS", "10"), help="parquet: số row group mỗi file part")
+    # Ghi NDJSON có buffer / thread nền / xoay file
+    ap.add_argument("--emit_flush_ms", type=float, default=safe_float_env("EMIT_FLUSH_MS", "0"), help="Flush NDJSON sau tối đa N ms (0 + emit_flush_kb=0 = flush mỗi dòng)")
+    ap.add_argument("--emit_flush_kb", type=int, default=safe_int_env("EMIT_FLUSH_KB", "0"), help="Flush NDJSON khi buffer vượt N KB")
+    ap.add_argument("--emit_async", type=int, default=safe_int_env("EMIT_ASYNC", "0"), help="Ghi NDJSON trên thread nền (1/0)")
+    ap.add_argument("--emit_queue", type=int, default=safe_int_env("EMIT_QUEUE", "1024"), help="Số dòng tối đa chờ ghi ở chế độ async")
+    ap.add_argument("--emit_rotate_mb", type=float, default=safe_float_env("EMIT_ROTATE_MB", "0"), help="Xoay file NDJSON khi vượt N MB (0 = tắt)")
+    ap.add_argument("--emit_rotate_min", type=float, default=safe_float_env("EMIT_ROTATE_MIN", "0"), help="Xoay file NDJSON sau N phút (0 = tắt)")
+    ap.add_argument(
+        "--emit_compress",
+        type=str,
+        choices=["none", "gzip", "zstd"],
+        default=os.getenv("EMIT_COMPRESS", "none"),
+        help="Nén segment NDJSON đã xoay",
+    )
+    ap.add_argument(
+        "--emit_schema",
+        type=str,
+        choices=["full", "compact"],
+        default=os.getenv("EMIT_SCHEMA", "full"),
+        help="full: mỗi detection 1 object; compact: cột mảng mỗi frame, header ghi 1 lần mỗi stream",
+    )
+    ap.add_argument(
+        "--emit_serializer",
+        type=str,
+        choices=["auto", "orjson", "msgspec", "json"],
+        default=os.getenv("EMIT_SERIALIZER", "auto"),
+        help="Thư viện serialize JSON (auto: orjson > msgspec > json)",
+    )
+
+
+def resolve_drop_policy(policy: str, src: str) -> str:
+    if policy == "auto":
+        return "drop_oldest" if src.startswith("rtsp://") else "block"
+    return policy
+
+
+def init_detector(args):
+    if not args.yolo:
+        return None
+    classes = [c.strip() for c in args.classes.split(",")] if args.classes else None
+    if args.detector == "replay":
+        from ai.detect.stub_detector import ReplayDetector
+        if not args.replay:
+            print("[ERROR] --detector replay cần --replay <file NDJSON>.")
+            raise SystemExit(2)
+        try:
+            det = ReplayDetector(
+                args.replay,
+                stream=f"{getattr(args, 'camera_id', '')}/{getattr(args, 'stream_id', '')}",
+                conf=args.conf,
+                classes=classes,
+                latency_ms=args.stub_latency_ms,
+            )
+        except (OSError, ValueError, KeyError) as e:
+            print(f"[ERROR] Không đọc được --replay {args.replay}: {e}")
+            raise SystemExit(2)
+        print(f"[INFO] Replay detector: {len(det.frames)} frame, stream={det.streams}")
+        return det
+    if args.detector == "remote":
+        from .detect_server import DEFAULT_ADDRESS, RemoteDetector, _authkey
+        address = args.det_server or DEFAULT_ADDRESS
+        try:
+            det = RemoteDetector(address, authkey=_authkey(args.det_server_key), wait=args.det_server_wait)
+        except Exception as e:
+            print(f"[ERROR] Không kết nối được detect server {address}: {e}")
+            print("Chạy server trước: python -m ai.ingest.detect_server --listen <địa chỉ> --model ...; server bật xác thực thì cần cùng --det_server_key.")
+            raise SystemExit(2)
+        print(f"[INFO] Remote detector: {address} | server={det.server}")
+        return det
+    if args.detector == "synth":
+        from ai.detect.stub_detector import SyntheticDetector
+        return SyntheticDetector(
+            objects=args.synth_objects,
+            speed=args.synth_speed,
+            still=args.synth_still,
+            seed=args.synth_seed,
+            jitter=args.synth_jitter,
+            miss=args.synth_miss,
+            latency_ms=args.stub_latency_ms,
+        )
+    from ai.detect.yolo_detector import YoloDetector
+    if args.runtime == "onnx" and args.precision == "fp16":
+        print("[WARN] ONNX Runtime CPU không hỗ trợ export fp16, dùng fp32.")
+        args.precision = "fp32"
+    try:
+        return YoloDetector(
+            model_path=args.model,
+            conf=args.conf,
+            classes=classes,
+            runtime=args.runtime,
+            device=args.device,
+            imgsz=args.imgsz,
+            precision=args.precision,
+            intra_threads=args.intra_threads,
+            inter_threads=args.inter_threads,
+            cache_dir=args.model_cache,
+        )
+    except ImportError as e:
+        pkg = {"onnx": "onnxruntime", "openvino": "openvino"}.get(args.runtime, "ultralytics")
+        print(f"[ERROR] Runtime {args.runtime} thiếu thư viện ({e}). Cài: pip install {pkg}")
+        raise SystemExit(2)
+
+
+def init_cadence(args):
+    """Trả về DetectCadence nếu bật bỏ frame detect, ngược lại None (detect mọi frame)."""
+    if args.detect_every <= 1 and not args.detect_adaptive:
+        return None
+    from .cadence import DetectCadence
+    return DetectCadence(
+        every=args.detect_every,
+        adaptive=bool(args.detect_adaptive),
+        max_every=args.detect_max_every,
+    )
+
+
+def init_motion_gate(args):
+    if not args.motion_gate:
+        return None
+    from .motion import MotionGate
+    return MotionGate(
+        width=args.motion_width,
+        thresh=args.motion_thresh,
+        min_area=args.motion_min_area,
+        alpha=args.motion_alpha,
+        roi=bool(args.motion_roi),
+    )
+
+
+def init_detect_region(args):
+    """Trả về DetectRegion nếu có polygon ROI hoặc bật tile, ngược lại None (detect cả frame)."""
+    if not args.det_roi and args.tile <= 0:
+        return None
+    from .region import DetectRegion, parse_polygons
+    try:
+        polygons = parse_polygons(args.det_roi)
+    except (ValueError, TypeError, IndexError) as e:
+        print(f"[ERROR] --det_roi không hợp lệ: {e}")
+        raise SystemExit(2)
+    if not polygons and args.tile <= 0:
+        return None
+    return DetectRegion(
+        polygons=polygons,
+        tile=args.tile,
+        overlap=args.tile_overlap,
+        full=bool(args.tile_full),
+        merge=args.tile_merge,
+    )
+
+
+def init_detect_controls(args) -> DetectControls:
+    return DetectControls(cadence=init_cadence(args), gate=init_motion_gate(args), region=init_detect_region(args))
+
+
+def init_metrics(args, base: Optional[dict] = None):
+    """Trả về Metrics nếu bật endpoint hoặc file stats, ngược lại None (không đo thời gian stage)."""
+    if args.metrics_port <= 0 and not args.metrics_out:
+        return None
+    from .metrics import Metrics, MetricsServer, StatsWriter
+    metrics = Metrics()
+    if args.metrics_port > 0:
+        try:
+            metrics.server = MetricsServer(metrics, args.metrics_port, args.metrics_host)
+        except OSError as e:
+            print(f"[ERROR] Không mở được endpoint metrics {args.metrics_host}:{args.metrics_port}: {e}")
+            raise SystemExit(2)
+        print(f"[INFO] Metrics: http://{args.metrics_host}:{args.metrics_port}/metrics")
+    if args.metrics_out:
+        metrics.writer = StatsWriter(metrics, args.metrics_out, args.metrics_interval, base)
+    return metrics
+
+
+def init_tracker(args, shared_embedder=None):
+    if not args.track:
+        return None
+    if args.tracker in ("sort", "bytetrack"):
+        from ai.track.sort_tracker import SortTracker
+        return SortTracker(
+            max_age=args.track_max_age,
+            n_init=args.track_n_init,
+            max_iou_distance=args.track_iou,
+            mode=args.tracker,
+            high_thresh=args.track_high,
+            low_thresh=args.track_low,
+        )
+    try:
+        from ai.track.deepsort_tracker import DeepSortTracker
+        return DeepSortTracker(
+            max_age=args.track_max_age,
+            n_init=args.track_n_init,
+            max_iou_distance=args.track_iou,
+            nms_max_overlap=args.track_nms_overlap,
+            embedder=args.track_embedder,
+            embedder_gpu=bool(args.track_embedder_gpu),
+            half=bool(args.track_half),
+            shared_embedder=shared_embedder,
+            embed_cache_iou=args.track_embed_cache_iou,
+            embed_refresh=args.track_embed_refresh,
+        )
+    except Exception as e:
+        print("[ERROR] Không khởi tạo được DeepSORT. Hãy cài đặt deep-sort-realtime: 'pip install deep-sort-realtime'.")
+        print(f"Chi tiết: {e}")
+        raise SystemExit(2)
+
+
+def warmup_detector(det, args) -> None:
+    """
+    1 lần infer trên ảnh đen imgsz x imgsz: load weights lên device, khởi tạo graph/kernel
+    (torch/ONNX Runtime/OpenVINO) để frame thật đầu tiên không chịu độ trễ này.
+    Detector frame_keyed (replay/synthetic) không nhìn pixel nên bỏ qua.
+    """
+    if det is None or getattr(det, "frame_keyed", False):
+        return
+    import numpy as np
+    det.infer_batch([np.zeros((args.imgsz, args.imgsz, 3), dtype=np.uint8)])
+
+
+class ModelLoader:
+    """
+    Khởi tạo detector (+ tracker) và warmup trên 1 thread nền (daemon) để main thread mở source
+    song song. result() chờ xong và trả về (det, tracker); SystemExit/lỗi khởi tạo được raise lại ở đây.
+    --model_warmup 0: khởi tạo tuần tự ngay trong constructor, không warmup (hành vi cũ).
+    startup: StartupTimer (tuỳ chọn) nhận các phase detector / detector_warmup / tracker / tracker_warmup.
+    close(): main thread bỏ kết quả (thoát sớm) -> đóng detector ngay hoặc khi thread nền load xong.
+    """
+
+    def __init__(self, args, startup=None, with_tracker: bool = True):
+        self.args = args
+        self.startup = startup
+        self.with_tracker = with_tracker
+        self._result = None
+        self._error: Optional[BaseException] = None
+        self._thread = None
+        self._closed = False
+        import threading
+        self._lock = threading.Lock()
+        if args.model_warmup:
+            self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+            self._thread.start()
+        else:
+            self._result = self._load(warmup=False)
+
+    def _phase(self, name: str):
+        if self.startup is None:
+            from contextlib import nullcontext
+            return nullcontext()
+        return self.startup.phase(name)
+
+    def _load(self, warmup: bool) -> tuple:
+        args = self.args
+        with self._phase("detector"):
+            det = init_detector(args)
+        if warmup and det is not None:
+            with self._phase("detector_warmup"):
+                warmup_detector(det, args)
+        tracker = None
+        if self.with_tracker:
+            with self._phase("tracker"):
+                tracker = init_tracker(args)
+            if warmup and tracker is not None:
+                with self._phase("tracker_warmup"):
+                    tracker.warmup()
+        return det, tracker
+
+    def _run(self) -> None:
+        try:
+            result = self._load(warmup=True)
+        except BaseException as e:  # SystemExit từ init_* cũng phải tới được main thread
+            self._error = e
+            return
+        with self._lock:
+            self._result = result
+            if self._closed:
+                self._release()
+
+    def _release(self) -> None:
+        det = self._result[0] if self._result else None
+        if det is not None and hasattr(det, "close"):
+            det.close()  # RemoteDetector: đóng kết nối tới detect server
+        self._result = None
+
+    def close(self) -> None:
+        """Không chờ thread nền (model có thể đang load vài giây)."""
+        with self._lock:
+            self._closed = True
+            self._release()
+
+    def result(self) -> tuple:
+        if self._thread is not None:
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
+        return self._result
+
+
+def _open_raw(path: str, backend: str, pool_size: int, args, full_res: bool, live: bool, pool=None):
+    stall = args.stall_timeout if args is not None and live else 0.0
+    if backend == "gst":
+        gst_opts = {}
+        if args is not None:
+            gst_opts = {
+                "width": args.gst_width,
+                "height": args.gst_height,
+                "fps": args.gst_fps,
+                "codec": args.gst_codec,
+                "template": args.gst_pipeline or None,
+                "decoder_threads": args.gst_decoder_threads,
+            }
+        from .gst_source import GstSource
+        src = GstSource(path, pool_size=pool_size, full_res=full_res, stall_timeout=stall, pool=pool, **gst_opts)
+    else:
+        if args is not None and (args.gst_width or args.gst_height or args.gst_fps or args.gst_pipeline):
+            print("[WARN] Các tuỳ chọn --gst_* chỉ áp dụng cho backend gst, bỏ qua.")
+        from .cv_source import CvSource
+        src = CvSource(path, pool_size=pool_size, stall_timeout=stall, pool=pool)
+
+    if not src.open():
+        src.release()
+        print(f"[ERROR] Không mở được nguồn: {path} (backend={backend})")
+        return None
+    return src
+
+
+def init_emitter(args, out_path: str):
+    if args.emit_format != "ndjson":
+        try:
+            from ai.emit.columnar_emitter import ColumnarEmitter
+            return ColumnarEmitter(
+                out_path,
+                fmt=args.emit_format,
+                group_frames=args.emit_group_frames,
+                group_secs=args.emit_group_secs,
+                file_groups=args.emit_file_groups,
+            )
+        except ImportError as e:
+            print("[ERROR] --emit_format parquet/arrow cần pyarrow: 'pip install pyarrow'.")
+            print(f"Chi tiết: {e}")
+            raise SystemExit(2)
+        except ValueError as e:
+            print(f"[ERROR] {e}")
+            raise SystemExit(2)
+
+    from ai.emit.json_emitter import JsonEmitter
+    return JsonEmitter(
+        out_path=out_path,
+        flush_interval=args.emit_flush_ms / 1000.0,
+        flush_bytes=args.emit_flush_kb * 1024,
+        async_write=bool(args.emit_async),
+        queue_size=args.emit_queue,
+        rotate_bytes=int(args.emit_rotate_mb * 1024 * 1024),
+        rotate_secs=args.emit_rotate_min * 60.0,
+        compress=args.emit_compress,
+        schema=args.emit_schema,
+        serializer=args.emit_serializer,
+    )
+
+
+def open_source(path: str, backend: str, pool_size: int = 0, args=None, full_res: bool = False, stop=None):
+    """
+    Mở nguồn video; trả về source đã open() hoặc None nếu lỗi.
+    args: đọc các tuỳ chọn --gst_* (scale/rate trong graph) và --reconnect*; full_res giữ nhánh
+    độ phân giải gốc cho display. Nguồn live được bọc ReconnectingSource (stop: Event ngắt backoff).
+    """
+    if backend == "gst" and not _gst_available():
+        print("[WARN] GStreamer backend không sẵn sàng (thiếu gi). Tự động chuyển sang OpenCV.")
+        backend = "cv"
+
+    pool = None
+    if args is not None and getattr(args, "frame_shm", 0):
+        # 1 ring shared memory cho mọi lần reconnect của nguồn này
+        from .shm_ring import ShmFramePool
+        pool = ShmFramePool(pool_size if pool_size > 0 else 16)
+
+    live = is_live_source(path)
+    if not (live and args is not None and args.reconnect):
+        src = _open_raw(path, backend, pool_size, args, full_res, live, pool)
+    else:
+        src = ReconnectingSource(
+            lambda: _open_raw(path, backend, pool_size, args, full_res, live, pool),
+            name=path,
+            backoff_max=args.reconnect_backoff_max,
+            max_retries=args.reconnect_max_retries,
+            stop=stop,
+        )
+        src = src if src.open() else None
+    if src is None and pool is not None:
+        pool.close()  # mở lỗi: trả segment shared memory ngay thay vì giữ tới atexit
+    return src
@@ -1,5 +1,9 @@
 # ai/ingest/gst_source.py
 import os
+import time
+from pathlib import Path
+from typing import Optional
+
 import gi
 import numpy as np
 
@@ -7,57 +11,187 @@ gi.require_version("Gst", "1.0")
 gi.require_version("GstApp", "1.0")
 from gi.repository import Gst, GstApp
 
-# Khởi tạo GStreamer
-Gst.init(None)
+from .frame_pool import FramePool
+
+_GST_READY = False
+
+
+def _init_gst() -> None:
+    """Gst.init lúc tạo source đầu tiên thay vì lúc import (import module không tốn thời gian khởi tạo plugin)."""
+    global _GST_READY
+    if not _GST_READY:
+        Gst.init(None)
+        _GST_READY = True
+
+
+# Codec hỗ trợ ở chế độ khai báo tường minh: (depay RTSP, parser, decoder)
+_EXPLICIT_CODECS = {
+    "h264": ("rtph264depay", "h264parse", "avdec_h264"),
+    "h265": ("rtph265depay", "h265parse", "avdec_h265"),
+}
+
+
+def _bgr_view(mapinfo, w: int, h: int) -> np.ndarray | None:
+    """
+    View (h, w, 3) lên buffer BGR đã map, không copy. GStreamer căn mỗi hàng tới bội số 4 byte nên
+    khi w*3 không chia hết cho 4 hàng có padding: stride lấy theo kích thước buffer, không giả định w*3.
+    None nếu buffer không khớp caps (nhỏ hơn w*3 mỗi hàng).
+    """
+    if h <= 0 or w <= 0:
+        return None
+    stride = mapinfo.size // h
+    if stride < w * 3:
+        return None
+    return np.ndarray((h, w, 3), dtype=np.uint8, buffer=mapinfo.data, strides=(stride, 3, 1))
 
 
 def _to_file_uri(path: str) -> str:
-    """Chuyển đường dẫn Windows sang file:// URI an toàn."""
-    abs_path = os.path.abspath(path)
-    # thay \ thành / để GStreamer hiểu
-    abs_path = abs_path.replace("\\", "/")
-    return f"file:///{abs_path}"
+    """Chuyển đường dẫn (Windows/POSIX) sang file:// URI an toàn."""
+    return Path(os.path.abspath(path)).as_uri()
 
 
 class GstSource:
     """
     Nguồn video dựa trên GStreamer, đọc frame (BGR) qua appsink.
 
-    - File MP4 H.264: filesrc ! qtdemux ! h264parse ! avdec_h264 ! videoconvert ! appsink
-    - RTSP H.264    : rtspsrc ! rtph264depay ! h264parse ! avdec_h264 ! videoconvert ! appsink
+    - codec="auto" (mặc định): uridecodebin tự chọn demux/decoder (MP4/MKV/AVI, H.264/H.265/MPEG-4...)
+    - codec="h264"/"h265": graph tường minh, vd RTSP: rtspsrc ! rtph265depay ! h265parse ! avdec_h265
+    - template: graph do người dùng cung cấp (GST_PIPELINE), hỗ trợ placeholder {src} và {uri}.
+      Không có appsink thì phần output (scale/convert/appsink) được nối vào cuối.
+    - decoder_threads: số thread decode (property max-threads của avdec_*), 0 = tự động.
+
+    pool_size > 0: frame được chép vào ring buffer tái sử dụng (FramePool), consumer gọi
+    release_frame() khi xong; pool_size = 0: mỗi frame là 1 bản copy mới. pool: pool dựng sẵn
+    (vd ShmFramePool) thay cho pool_size.
+
+    width/height/fps: videorate + videoscale ngay trong graph (trước videoconvert) để frame ra
+    appsink đúng độ phân giải model và FPS mục tiêu. full_res=True giữ thêm 1 nhánh BGR độ phân
+    giải gốc (tee, queue leaky) cho display, đọc bằng read_full().
     """
 
-    def __init__(self, path: str):
+    def __init__(
+        self,
+        path: str,
+        pool_size: int = 0,
+        width: int = 0,
+        height: int = 0,
+        fps: float = 0,
+        full_res: bool = False,
+        codec: str = "auto",
+        template: Optional[str] = None,
+        decoder_threads: int = 0,
+        rtsp_latency: int = 200,
+        stall_timeout: float = 0.0,
+        pool=None,
+    ):
+        _init_gst()
         self.path = path
+        self.codec = codec
+        self.template = template
+        self.decoder_threads = decoder_threads
+        self.rtsp_latency = rtsp_latency
+        # Watchdog: quá stall_timeout giây không có sample thì read() trả lỗi (0 = chờ mãi)
+        self.stall_timeout = stall_timeout
+        self.pool = pool if pool is not None else (FramePool(pool_size) if pool_size > 0 else None)
+        self.width = width
+        self.height = height
+        self.fps = fps
+        # Nhánh full-res chỉ có ý nghĩa khi đang scale
+        self.full_res = full_res and bool(width or height)
         self.pipeline: Gst.Pipeline | None = None
         self.appsink: GstApp.AppSink | None = None
+        self.fullsink: GstApp.AppSink | None = None
         self.bus: Gst.Bus | None = None
 
-    def _build_pipeline_desc(self) -> str:
+    def _uri(self) -> str:
+        return self.path if "://" in self.path else _to_file_uri(self.path)
+
+    def _decode_desc(self) -> str:
+        """Phần graph từ nguồn tới decoder (raw video)."""
+        is_uri = "://" in self.path
+        if not is_uri and not os.path.exists(self.path):
+            # Không phải URI cũng không phải file có sẵn
+            return ""
+
+        if self.codec == "auto":
+            # Chỉ expose luồng video; latency RTSP và số thread decoder đặt qua signal trong open()
+            return f'uridecodebin name=dec uri="{self._uri()}" caps="video/x-raw" expose-all-streams=false'
+
+        depay, parse, decoder = _EXPLICIT_CODECS[self.codec]
+        threads = f" max-threads={self.decoder_threads}" if self.decoder_threads else ""
         if self.path.startswith("rtsp://"):
-            # Pipeline RTSP (H.264)
             return (
-                f'rtspsrc location="{self.path}" latency=200 drop-on-late=true ! '
-                'rtph264depay ! h264parse ! avdec_h264 ! '
-                'videoconvert ! video/x-raw,format=BGR ! '
-                'appsink name=sink sync=false drop=true max-buffers=1 emit-signals=false'
-            )
-        else:
-            # Pipeline file MP4 (H.264)
-            if not os.path.exists(self.path):
-                # Không phải RTSP cũng không phải file có sẵn
-                return ""
-
-            # Dùng demux tường minh để chỉ lấy nhánh video_0
-            file_uri = _to_file_uri(self.path)
-            # filesrc cần 'location' (không phải uri). Ta vẫn dùng location trực tiếp.
-            # qtdemux tạo pad động video_0 → link tường minh
-            return (
-                f'filesrc location="{self.path}" ! qtdemux name=d '
-                'd.video_0 ! queue ! h264parse ! avdec_h264 ! '
-                'videoconvert ! video/x-raw,format=BGR ! '
-                'appsink name=sink sync=false drop=true max-buffers=1 emit-signals=false'
+                f'rtspsrc location="{self.path}" latency={self.rtsp_latency} drop-on-late=true ! '
+                f"{depay} ! {parse} ! {decoder}{threads}"
             )
+        # File: demux tự chọn theo container, chỉ lấy nhánh video
+        return (
+            f'filesrc location="{self.path}" ! parsebin ! '
+            f"queue ! {parse} ! {decoder}{threads}"
+        )
+
+    def _output_desc(self) -> str:
+        """Phần graph sau decoder: (videorate) ! (videoscale) ! videoconvert ! appsink."""
+        sink = 'appsink name=sink sync=false drop=true max-buffers=1 emit-signals=false'
+        rate = ""
+        if self.fps:
+            num, den = Gst.util_double_to_fraction(float(self.fps))
+            rate = f"videorate ! video/x-raw,framerate={num}/{den} ! "
+        if not (self.width or self.height):
+            return f"{rate}videoconvert ! video/x-raw,format=BGR ! {sink}"
+
+        size = ",".join(
+            f"{k}={v}" for k, v in (("width", self.width), ("height", self.height)) if v
+        )
+        # Scale ở không gian YUV trước khi convert để convert/copy ít pixel hơn
+        scaled = f"videoscale ! video/x-raw,{size} ! videoconvert ! video/x-raw,format=BGR ! {sink}"
+        if not self.full_res:
+            return rate + scaled
+        return (
+            f"{rate}tee name=t "
+            f"t. ! queue max-size-buffers=2 ! {scaled} "
+            "t. ! queue leaky=downstream max-size-buffers=1 ! videoconvert ! video/x-raw,format=BGR ! "
+            "appsink name=fullsink sync=false drop=true max-buffers=1 emit-signals=false"
+        )
+
+    def _build_pipeline_desc(self) -> str:
+        if self.template:
+            desc = self.template.replace("{src}", self.path).replace("{uri}", self._uri())
+            if "appsink" in desc:
+                return desc
+            return f"{desc} ! {self._output_desc()}"
+        decode = self._decode_desc()
+        if not decode:
+            return ""
+        return f"{decode} ! {self._output_desc()}"
+
+    def _on_source_setup(self, _bin, source) -> None:
+        # uridecodebin tạo rtspsrc động: đặt latency/drop-on-late như pipeline RTSP cũ
+        if source.find_property("latency") is not None:
+            source.set_property("latency", self.rtsp_latency)
+        if source.find_property("drop-on-late") is not None:
+            source.set_property("drop-on-late", True)
+
+    def _on_deep_element_added(self, _bin, _sub_bin, element) -> None:
+        # Decoder do decodebin tự chọn: đặt số thread decode nếu decoder hỗ trợ
+        for prop in ("max-threads", "n-threads"):
+            if element.find_property(prop) is not None:
+                element.set_property(prop, self.decoder_threads)
+                return
+
+    def _find_appsink(self):
+        sink = self.pipeline.get_by_name("sink")
+        if sink is not None:
+            return sink
+        # Template của người dùng có thể không đặt name=sink: lấy appsink đầu tiên
+        it = self.pipeline.iterate_sinks()
+        while True:
+            res, elem = it.next()
+            if res != Gst.IteratorResult.OK:
+                return None
+            factory = elem.get_factory()
+            if factory is not None and factory.get_name() == "appsink" and elem.get_name() != "fullsink":
+                return elem
 
     def open(self) -> bool:
         desc = self._build_pipeline_desc()
@@ -68,11 +202,19 @@ class GstSource:
         if not isinstance(self.pipeline, Gst.Pipeline):
             return False
 
+        dec = self.pipeline.get_by_name("dec")
+        if dec is not None:
+            dec.connect("source-setup", self._on_source_setup)
+        if self.decoder_threads:
+            self.pipeline.connect("deep-element-added", self._on_deep_element_added)
+
         # Lấy appsink và cast đúng type
-        sink = self.pipeline.get_by_name("sink")
+        sink = self._find_appsink()
         if sink is None:
             return False
         self.appsink = GstApp.AppSink.cast(sink)
+        full = self.pipeline.get_by_name("fullsink") if self.full_res else None
+        self.fullsink = GstApp.AppSink.cast(full) if full is not None else None
 
         self.bus = self.pipeline.get_bus()
         self.bus.add_signal_watch()
@@ -109,6 +251,7 @@ class GstSource:
         # Lấy sample từ appsink. Ưu tiên try_pull_sample (non-blocking timeout).
         sample = None
         if hasattr(self.appsink, "try_pull_sample"):
+            t0 = time.monotonic()
             sample = self.appsink.try_pull_sample(2 * Gst.SECOND)
             while sample is None:
                 # giữa các lần chờ, kiểm tra EOS/ERROR
@@ -117,6 +260,9 @@ class GstSource:
                 )
                 if msg:
                     return False, None
+                if self.stall_timeout and time.monotonic() - t0 >= self.stall_timeout:
+                    print(f"[WARN] Không nhận được frame sau {self.stall_timeout:.0f}s (stall): {self.path}")
+                    return False, None
                 sample = self.appsink.try_pull_sample(2 * Gst.SECOND)
         else:
             # Fallback: pull_sample() (blocking) – kiểm tra nhanh EOS trước khi block
@@ -140,18 +286,53 @@ class GstSource:
         if not ok:
             return False, None
         try:
-            frame = np.frombuffer(mapinfo.data, dtype=np.uint8).reshape(h, w, 3)  # BGR
-            # Trả về bản copy nếu bạn sợ buffer bị reuse: frame = frame.copy()
+            view = _bgr_view(mapinfo, w, h)  # BGR
+            if view is None:
+                print(f"[WARN] Buffer {mapinfo.size} byte không khớp caps {w}x{h} BGR: {self.path}")
+                return False, None
+            # Vùng nhớ map chỉ hợp lệ tới khi unmap (appsink tái sử dụng buffer) -> luôn chép ra ngoài
+            if self.pool is not None:
+                frame = self.pool.acquire((h, w, 3))
+                np.copyto(frame, view)
+            else:
+                frame = view.copy()
         finally:
             buf.unmap(mapinfo)
 
         return True, frame
 
+    def read_full(self) -> np.ndarray | None:
+        """Frame độ phân giải gốc mới nhất từ nhánh full-res (None nếu không bật/chưa có)."""
+        if self.fullsink is None:
+            return None
+        sample = self.fullsink.try_pull_sample(0)
+        if sample is None:
+            return None
+        s = sample.get_caps().get_structure(0)
+        w = int(s.get_value("width"))
+        h = int(s.get_value("height"))
+        buf = sample.get_buffer()
+        ok, mapinfo = buf.map(Gst.MapFlags.READ)
+        if not ok:
+            return None
+        try:
+            # videoscale theo --scale_width hay ra chiều rộng lẻ -> hàng có padding, đọc theo stride
+            view = _bgr_view(mapinfo, w, h)
+            return view.copy() if view is not None else None
+        finally:
+            buf.unmap(mapinfo)
+
+    def release_frame(self, frame: np.ndarray) -> None:
+        """Trả buffer của frame về pool (no-op nếu không bật pool)."""
+        if self.pool is not None:
+            self.pool.release(frame)
+
     def release(self):
         if self.pipeline:
             self.pipeline.set_state(Gst.State.NULL)
         self.pipeline = None
         self.appsink = None
+        self.fullsink = None
         self.bus = None
 
 
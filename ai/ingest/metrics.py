@@ -0,0 +1,303 @@
+# ai/ingest/metrics.py
+"""
+Đo độ trễ từng stage (read, motion, infer, track, emit, display) bằng histogram bucket cố định,
+kèm các gauge/counter (độ sâu hàng đợi, frame bị bỏ, số track...).
+
+- Endpoint HTTP kiểu Prometheus: GET /metrics trên --metrics_port (text exposition format).
+- Bản ghi NDJSON định kỳ (--metrics_out): p50/p95/p99 theo cửa sổ --metrics_interval giây.
+Không bật cả 2 thì không tạo Metrics và các stage không bị bọc đo thời gian.
+"""
+import bisect
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .pipeline import BatchStage
+
+# Cận trên bucket (giây): 0.25ms .. ~30s, hệ số 1.5
+BUCKETS = tuple(0.00025 * 1.5 ** i for i in range(30))
+
+
+class LatencyHistogram:
+    """Histogram độ trễ: đếm luỹ kế (Prometheus) và đếm theo cửa sổ (reset mỗi lần ghi stats)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(BUCKETS) + 1)
+        self._sum = 0.0
+        self._max = 0.0
+        self._win = [0] * (len(BUCKETS) + 1)
+        self._win_sum = 0.0
+        self._win_max = 0.0
+
+    def observe(self, seconds: float) -> None:
+        i = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self._counts[i] += 1
+            self._sum += seconds
+            if seconds > self._max:
+                self._max = seconds
+            self._win[i] += 1
+            self._win_sum += seconds
+            if seconds > self._win_max:
+                self._win_max = seconds
+
+    @staticmethod
+    def _quantile(counts: List[int], q: float, peak: float) -> float:
+        """
+        Ước lượng quantile (giây) bằng nội suy tuyến tính trong bucket, như histogram_quantile;
+        không vượt quá giá trị lớn nhất đã đo (peak).
+        """
+        total = sum(counts)
+        if not total:
+            return 0.0
+        rank = q * total
+        seen = 0
+        for i, c in enumerate(counts):
+            if seen + c >= rank and c:
+                lo = BUCKETS[i - 1] if i > 0 else 0.0
+                hi = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return min(peak, lo + (hi - lo) * (rank - seen) / c)
+            seen += c
+        return peak
+
+    def snapshot(self, window: bool = False, reset: bool = False) -> Dict[str, float]:
+        """count/mean/p50/p95/p99 (ms), luỹ kế hoặc theo cửa sổ hiện tại."""
+        with self._lock:
+            counts = list(self._win if window else self._counts)
+            total = self._win_sum if window else self._sum
+            peak = self._win_max if window else self._max
+            if reset:
+                self._win = [0] * (len(BUCKETS) + 1)
+                self._win_sum = 0.0
+                self._win_max = 0.0
+        n = sum(counts)
+        out = {
+            "count": n,
+            "mean_ms": round(1000.0 * total / n, 3) if n else 0.0,
+            "p50_ms": round(1000.0 * self._quantile(counts, 0.50, peak), 3),
+            "p95_ms": round(1000.0 * self._quantile(counts, 0.95, peak), 3),
+            "p99_ms": round(1000.0 * self._quantile(counts, 0.99, peak), 3),
+            "max_ms": round(1000.0 * peak, 3),
+        }
+        return out
+
+    def prometheus(self, name: str, labels: str) -> List[str]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        lines = []
+        acc = 0
+        for le, c in zip(BUCKETS, counts):
+            acc += c
+            lines.append(f'{name}_bucket{{{labels},le="{le:.6g}"}} {acc}')
+        acc += counts[-1]
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {acc}')
+        lines.append(f"{name}_sum{{{labels}}} {total:.6f}")
+        lines.append(f"{name}_count{{{labels}}} {acc}")
+        return lines
+
+
+def _num(v: float):
+    return int(v) if v.is_integer() else round(v, 6)
+
+
+def _escape(v) -> str:
+    """Escape \\, \" và xuống dòng trong giá trị label (text format Prometheus)."""
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _fmt_labels(labels: Dict[str, str]) -> str:
+    return ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+
+
+class Metrics:
+    """
+    Registry của 1 process: histogram theo (stage, stream) và gauge/counter đọc lúc scrape.
+    Hàm gauge trả về 1 số hoặc list [(labels dict, số)].
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hist: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self._gauges: List[Tuple[str, str, str, Callable]] = []
+        # Đầu ra (gắn bởi factory.init_metrics)
+        self.server: Optional["MetricsServer"] = None
+        self.writer: Optional["StatsWriter"] = None
+
+    def histogram(self, stage: str, stream: str = "") -> LatencyHistogram:
+        key = (stage, stream)
+        h = self._hist.get(key)
+        if h is None:
+            with self._lock:
+                h = self._hist.setdefault(key, LatencyHistogram())
+        return h
+
+    def observe(self, stage: str, seconds: float, stream: str = "") -> None:
+        self.histogram(stage, stream).observe(seconds)
+
+    def _hist_items(self) -> List[Tuple[Tuple[str, str], LatencyHistogram]]:
+        """Bản chụp histogram theo khoá (thread pipeline có thể tạo histogram mới lúc đang scrape)."""
+        with self._lock:
+            return sorted(self._hist.items())
+
+    def _gauge_list(self) -> List[Tuple[str, str, str, Callable]]:
+        with self._lock:
+            return list(self._gauges)
+
+    def timed(self, stage: str, fn, stream: str = ""):
+        """Bọc 1 stage (hàm hoặc BatchStage) để đo thời gian mỗi lần gọi."""
+        h = self.histogram(stage, stream)
+        inner = fn.fn if isinstance(fn, BatchStage) else fn
+
+        def wrapped(x):
+            t0 = time.perf_counter()
+            try:
+                return inner(x)
+            finally:
+                h.observe(time.perf_counter() - t0)
+        wrapped.__name__ = getattr(fn, "__name__", stage)
+        if isinstance(fn, BatchStage):
+            return BatchStage(wrapped, batch_size=fn.batch_size, max_wait=fn.max_wait)
+        return wrapped
+
+    def gauge(self, name: str, help_text: str, fn: Callable, kind: str = "gauge") -> None:
+        with self._lock:
+            self._gauges.append((name, help_text, kind, fn))
+
+    def _gauge_values(self, fn: Callable) -> List[Tuple[Dict[str, str], float]]:
+        try:
+            v = fn()
+        except Exception:  # noqa: BLE001  (gauge lỗi không được làm hỏng scrape)
+            return []
+        if v is None:
+            return []
+        if isinstance(v, (int, float)):
+            return [({}, float(v))]
+        return [(labels, float(x)) for labels, x in v]
+
+    def render(self) -> str:
+        """Text exposition format của Prometheus."""
+        name = "pipeline_stage_latency_seconds"
+        lines = [f"# HELP {name} Độ trễ mỗi lần gọi stage", f"# TYPE {name} histogram"]
+        for (stage, stream), h in self._hist_items():
+            labels = {"stage": stage}
+            if stream:
+                labels["stream"] = stream
+            lines += h.prometheus(name, _fmt_labels(labels))
+        for gname, help_text, kind, fn in self._gauge_list():
+            lines.append(f"# HELP {gname} {help_text}")
+            lines.append(f"# TYPE {gname} {kind}")
+            for labels, v in self._gauge_values(fn):
+                lbl = f"{{{_fmt_labels(labels)}}}" if labels else ""
+                lines.append(f"{gname}{lbl} {_num(v)}")
+        return "\n".join(lines) + "\n"
+
+    def stages(self, window: bool = False, reset: bool = False) -> Dict[str, Dict]:
+        """{stage: snapshot} (stream != "" thì key là 'stream/stage')."""
+        return {
+            (f"{stream}/{stage}" if stream else stage): h.snapshot(window=window, reset=reset)
+            for (stage, stream), h in self._hist_items()
+        }
+
+    def values(self) -> Dict[str, object]:
+        """Giá trị gauge/counter hiện tại (dùng cho bản ghi NDJSON)."""
+        out: Dict[str, object] = {}
+        for gname, _help, _kind, fn in self._gauge_list():
+            vals = self._gauge_values(fn)
+            if len(vals) == 1 and not vals[0][0]:
+                out[gname] = _num(vals[0][1])
+            elif vals:
+                out[gname] = {",".join(str(x) for x in labels.values()): _num(v) for labels, v in vals}
+        return out
+
+    def short(self) -> str:
+        """Tóm tắt cho dòng log: stage=p50/p95 (ms), luỹ kế."""
+        parts = []
+        for key, s in self.stages().items():
+            if s["count"]:
+                parts.append(f"{key}={s['p50_ms']:.1f}/{s['p95_ms']:.1f}")
+        return "lat_ms(p50/p95) " + " ".join(parts) if parts else ""
+
+    def tick(self) -> None:
+        """Gọi thường xuyên từ vòng lặp chính: ghi bản ghi stats khi tới hạn."""
+        if self.writer is not None:
+            self.writer.maybe_write()
+
+    def close(self) -> None:
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+
+class MetricsServer:
+    """HTTP server nền phục vụ GET /metrics."""
+
+    def __init__(self, metrics: Metrics, port: int, host: str = "127.0.0.1"):
+        registry = metrics
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):  # noqa: N802
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *a):  # tắt log mỗi request
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="metrics-http", daemon=True)
+        self.thread.start()
+
+    def close(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class StatsWriter:
+    """Ghi bản ghi {"record": "stats", ...} mỗi interval giây; percentile tính theo cửa sổ giữa 2 bản ghi."""
+
+    def __init__(self, metrics: Metrics, out_path: str, interval: float, base: Optional[Dict] = None):
+        from ai.emit.ndjson_writer import NdjsonWriter
+
+        self.metrics = metrics
+        self.interval = max(0.1, interval)
+        self.base = base or {}
+        self._writer = NdjsonWriter(out_path)
+        self._last = time.monotonic()
+
+    def maybe_write(self) -> None:
+        now = time.monotonic()
+        if now - self._last >= self.interval:
+            self.write(now)
+
+    def write(self, now: Optional[float] = None) -> None:
+        now = time.monotonic() if now is None else now
+        rec = {
+            "record": "stats",
+            **self.base,
+            "ts": datetime.now(timezone.utc).isoformat(),
+            "window_s": round(now - self._last, 3),
+            "stages": self.metrics.stages(window=True, reset=True),
+            "values": self.metrics.values(),
+        }
+        self._last = now
+        self._writer.write(json.dumps(rec, ensure_ascii=False))
+
+    def close(self) -> None:
+        self.write()
+        self._writer.close()
+
@@ -0,0 +1,104 @@
+# ai/ingest/motion.py
+"""
+Motion gate: so sánh frame grayscale đã thu nhỏ với background (running average)
+để bỏ qua YOLO khi cảnh không đổi, và khoanh vùng ROI khi có chuyển động.
+"""
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from ai.detect.detections import det_arrays
+
+Roi = Tuple[int, int, int, int]  # (x1,y1,x2,y2) toạ độ frame gốc
+
+
+class MotionGate:
+    """
+    - width     : chiều rộng frame thu nhỏ để so sánh (giữ tỉ lệ)
+    - thresh    : ngưỡng chênh lệch mức xám (0-255) để coi 1 pixel là thay đổi
+    - min_area  : tỉ lệ pixel thay đổi tối thiểu để coi là có chuyển động
+    - alpha     : tốc độ học background (1.0 = so với frame liền trước, tức frame differencing)
+    - roi       : trả về vùng chuyển động (hợp với bbox lần detect trước) để chỉ detect vùng đó
+    - roi_max   : ROI lớn hơn tỉ lệ này của frame thì detect cả frame
+    """
+
+    def __init__(
+        self,
+        width: int = 160,
+        thresh: int = 25,
+        min_area: float = 0.002,
+        alpha: float = 0.05,
+        roi: bool = True,
+        roi_pad: float = 0.1,
+        roi_max: float = 0.6,
+    ):
+        self.width = max(16, width)
+        self.thresh = thresh
+        self.min_area = min_area
+        self.alpha = alpha
+        self.roi = roi
+        self.roi_pad = roi_pad
+        self.roi_max = roi_max
+        self._bg: Optional[np.ndarray] = None
+        self._last_boxes: List[Roi] = []
+        # Bộ đếm
+        self.gated = 0
+        self.processed = 0
+
+    def reset(self) -> None:
+        self._bg = None
+        self._last_boxes = []
+
+    def check(self, frame: np.ndarray) -> Tuple[bool, Optional[Roi]]:
+        """
+        Trả về (có_chuyển_động, roi). roi=None nghĩa là detect cả frame.
+        Frame đầu tiên (chưa có background) luôn được xử lý.
+        """
+        h, w = frame.shape[:2]
+        sw = self.width
+        sh = max(1, int(round(h * sw / max(1, w))))
+        small = cv2.resize(frame, (sw, sh), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+        gray = cv2.GaussianBlur(gray, (5, 5), 0)
+
+        if self._bg is None or self._bg.shape != gray.shape:
+            self._bg = gray.astype(np.float32)
+            self.processed += 1
+            return True, None
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(self._bg))
+        mask = diff > self.thresh
+        cv2.accumulateWeighted(gray, self._bg, self.alpha)
+
+        if np.count_nonzero(mask) < self.min_area * mask.size:
+            self.gated += 1
+            return False, None
+
+        self.processed += 1
+        if not self.roi:
+            return True, None
+
+        ys, xs = np.nonzero(mask)
+        sx, sy = w / sw, h / sh
+        x1, y1 = int(xs.min() * sx), int(ys.min() * sy)
+        x2, y2 = int((xs.max() + 1) * sx), int((ys.max() + 1) * sy)
+        # Hợp với bbox lần detect trước để người đứng yên ngoài vùng chuyển động không bị mất track
+        for bx1, by1, bx2, by2 in self._last_boxes:
+            x1, y1, x2, y2 = min(x1, bx1), min(y1, by1), max(x2, bx2), max(y2, by2)
+        px, py = int((x2 - x1) * self.roi_pad) + 16, int((y2 - y1) * self.roi_pad) + 16
+        x1, y1 = max(0, x1 - px), max(0, y1 - py)
+        x2, y2 = min(w, x2 + px), min(h, y2 + py)
+        if (x2 - x1) * (y2 - y1) >= self.roi_max * w * h:
+            return True, None
+        return True, (x1, y1, x2, y2)
+
+    def observe(self, dets: List) -> None:
+        """Ghi nhớ bbox của lần detect gần nhất để mở rộng ROI lần sau."""
+        self._last_boxes = [tuple(b) for b in det_arrays(dets)[0].astype(int).tolist()]
+
+    @property
+    def ratio(self) -> float:
+        """Tỉ lệ frame bị chặn (không chạy YOLO)."""
+        total = self.gated + self.processed
+        return self.gated / total if total else 0.0
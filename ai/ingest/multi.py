@@ -0,0 +1,626 @@
+# ai/ingest/multi.py
+"""
+Chạy nhiều camera trong 1 process với 1 detector dùng chung.
+
+- Mỗi stream: 1 source (GstSource/CvSource) + 1 thread đọc + 1 DeepSortTracker riêng.
+- 1 thread detect duy nhất gom frame round-robin từ mọi stream thành batch (cross-stream batching).
+- Main thread ghi NDJSON và log FPS theo từng stream.
+- --procs 1: mỗi stream chạy trong 1 process con (decode vào ring shared memory + motion + track,
+  không tranh GIL với nhau); detect chạy trong process chính qua DetectServer nội bộ, đọc frame
+  theo slot shared memory, gom batch giữa các stream. Process con gửi kết quả (không có pixel) về ghi NDJSON.
+
+Ví dụ:
+    python -m ai.ingest.multi --config cameras.json --emit detection --out multi.ndjson
+    python -m ai.ingest.multi --config cameras.json --procs 1 --emit detection --out multi.ndjson
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import argparse
+import tempfile
+import threading
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from .factory import (
+    ModelLoader,
+    add_detect_track_args,
+    add_emit_args,
+    add_metrics_args,
+    add_pipeline_args,
+    init_detect_controls,
+    init_detector,
+    init_emitter,
+    init_metrics,
+    init_tracker,
+    open_source,
+    resolve_drop_policy,
+    safe_float_env,
+    safe_int_env,
+)
+from .reconnect import ReconnectingSource
+from .pipeline import EOS, FramePacket, StageQueue, detect_packets, motion_stage, track_stage
+from .startup import StartupTimer
+
+# Khoá config stream được phép ghi đè tham số --gst_* tương ứng
+STREAM_GST_KEYS = ("gst_codec", "gst_pipeline", "gst_decoder_threads", "gst_width", "gst_height", "gst_fps")
+# Vùng detect riêng từng camera (det_roi: chuỗi hoặc list polygon JSON)
+STREAM_DETECT_KEYS = ("det_roi", "tile", "tile_overlap", "tile_full", "tile_merge")
+
+
+def load_camera_config(path: str) -> List[Dict]:
+    """
+    Đọc danh sách camera từ file JSON:
+        {"streams": [{"store_id": ..., "camera_id": ..., "stream_id": ..., "src": ...}, ...]}
+    hoặc trực tiếp 1 list các stream. Trường tuỳ chọn: backend, drop_policy, out,
+    các tham số decode GStreamer riêng từng stream: gst_codec, gst_pipeline, gst_decoder_threads,
+    và vùng detect riêng: det_roi (vd [[0,300],[1920,300],[1920,1080],[0,1080]]), tile, tile_overlap...
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        cfg = json.load(f)
+    streams = cfg.get("streams", []) if isinstance(cfg, dict) else cfg
+    if not streams:
+        raise ValueError(f"Không có stream nào trong config: {path}")
+    for i, s in enumerate(streams):
+        if not s.get("src"):
+            raise ValueError(f"Stream #{i} thiếu 'src'")
+    return streams
+
+
+def _source_info(cfg: Dict, args, idx: int) -> Dict:
+    return {
+        "store_id": cfg.get("store_id", args.store_id),
+        "camera_id": cfg.get("camera_id", f"cam_{idx + 1:02d}"),
+        "stream_id": cfg.get("stream_id", f"stream_{idx + 1:02d}"),
+    }
+
+
+class StreamWorker:
+    """Trạng thái của 1 camera: source, tracker, hàng đợi và bộ đếm FPS."""
+
+    def __init__(self, cfg: Dict, args, stop: threading.Event, idx: int = 0, shared_embedder=None, metrics=None):
+        self.cfg = cfg
+        self.src_path = cfg["src"]
+        self.backend = cfg.get("backend", args.backend)
+        self.pool_size = args.frame_pool
+        # Tham số decode riêng của stream ghi đè giá trị CLI chung
+        overrides = {k: cfg[k] for k in STREAM_GST_KEYS + STREAM_DETECT_KEYS if k in cfg}
+        self.args = argparse.Namespace(**{**vars(args), **overrides}) if overrides else args
+        self.source_info = _source_info(cfg, args, idx)
+        self.name = f"{self.source_info['camera_id']}/{self.source_info['stream_id']}"
+        self.stop = stop
+        self.src = None
+        self.tracker = init_tracker(args, shared_embedder=shared_embedder)
+        self.track = track_stage(self.tracker)
+        self.controls = init_detect_controls(self.args)
+        self.motion = motion_stage(lambda _pkt: self.controls)
+        self.metrics = metrics
+        self._read_hist = None
+        if metrics is not None:
+            self._read_hist = metrics.histogram("read", self.name)
+            self.track = metrics.timed("track", self.track, self.name)
+            if self.controls.gate is not None:
+                self.motion = metrics.timed("motion", self.motion, self.name)
+        policy = resolve_drop_policy(cfg.get("drop_policy", args.drop_policy), self.src_path)
+        self.q_det = StageQueue(args.queue_size, policy)
+        self.q_track = StageQueue(args.queue_size, "block")
+        self.emitter = None
+        # Bộ đếm FPS
+        self.frames = 0
+        self.det_total = 0
+        self.t0 = time.time()
+        self._win_frames = 0
+        self._win_t0 = self.t0
+
+    def count(self, pkt: FramePacket) -> None:
+        self.frames += 1
+        self._win_frames += 1
+        if not pkt.predicted:
+            self.det_total += len(pkt.dets)
+
+    def open(self) -> bool:
+        self.src = open_source(self.src_path, self.backend, pool_size=self.pool_size, args=self.args, stop=self.stop)
+        return self.src is not None
+
+    def release(self) -> None:
+        if self.src is not None:
+            self.src.release()
+            self.src = None
+        if self.emitter:
+            self.emitter.close()
+            self.emitter = None
+
+    def read_loop(self) -> None:
+        index = 0
+        while not self.stop.is_set():
+            t0 = time.perf_counter()
+            ok, frame = self.src.read()
+            if self._read_hist is not None and ok:
+                self._read_hist.observe(time.perf_counter() - t0)
+            if not ok or frame is None:
+                print(f"[INFO] {self.name}: End of stream or read error.")
+                break
+            index += 1
+            pkt = FramePacket(
+                index, frame, datetime.now(timezone.utc).isoformat(), stream=self, on_release=self.src.release_frame
+            )
+            # Motion gate chạy ngay trên thread đọc của stream (song song giữa các camera)
+            pkt = self.motion(pkt)
+            if not self.q_det.put(pkt, self.stop):
+                return
+        self.q_det.put(EOS, self.stop)
+
+    def track_loop(self, q_out: StageQueue) -> None:
+        while not self.stop.is_set():
+            item = self.q_track.get(self.stop)
+            if item is EOS:
+                break
+            q_out.put(self.track(item), self.stop)
+        q_out.put((EOS, self), self.stop)
+
+    def fps_window(self) -> float:
+        """FPS trong cửa sổ log gần nhất (reset sau mỗi lần gọi)."""
+        now = time.time()
+        fps = self._win_frames / max(1e-6, now - self._win_t0)
+        self._win_frames = 0
+        self._win_t0 = now
+        return fps
+
+
+def _detect_loop(workers: List[StreamWorker], det, batch_size: int, max_wait: float, stop: threading.Event, metrics=None) -> None:
+    """Gom frame round-robin giữa các stream, 1 lần infer_batch cho cả batch."""
+    hist = metrics.histogram("infer") if metrics is not None else None
+    active = list(workers)
+    rr = 0
+    while active and not stop.is_set():
+        batch: List[FramePacket] = []
+        finished: List[StreamWorker] = []
+        deadline: Optional[float] = None
+        while active and len(batch) < batch_size:
+            got = False
+            for _ in range(len(active)):
+                w = active[rr % len(active)]
+                rr += 1
+                item = w.q_det.get_nowait()
+                if item is None:
+                    continue
+                got = True
+                if item is EOS:
+                    # EOS chỉ được chuyển tiếp sau khi batch chứa frame cuối của stream đã gửi đi
+                    active.remove(w)
+                    finished.append(w)
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + max_wait
+                if len(batch) >= batch_size:
+                    break
+            if deadline is not None and time.monotonic() >= deadline:
+                break
+            if not got:
+                if stop.is_set():
+                    return
+                time.sleep(0.002)
+        if batch and det is not None:
+            t0 = time.perf_counter()
+            detect_packets(det, batch, lambda pkt: pkt.stream.controls)
+            if hist is not None:
+                hist.observe(time.perf_counter() - t0)
+        for pkt in batch:
+            pkt.stream.q_track.put(pkt, stop)
+        for w in finished:
+            w.q_track.put(EOS, stop)
+
+
+def _register_gauges(metrics, workers: List[StreamWorker], q_emit: StageQueue) -> None:
+    """Gauge/counter theo từng stream (label stream=camera_id/stream_id)."""
+    def per_stream(fn):
+        return lambda: [({"stream": w.name}, fn(w)) for w in workers]
+
+    metrics.gauge("pipeline_frames_total", "Số frame đã xử lý", per_stream(lambda w: w.frames), "counter")
+    metrics.gauge("pipeline_detections_total", "Số detection từ detector", per_stream(lambda w: w.det_total), "counter")
+    metrics.gauge("pipeline_fps", "FPS trung bình từ lúc chạy", per_stream(lambda w: w.frames / max(1e-6, time.time() - w.t0)))
+    metrics.gauge("pipeline_dropped_frames_total", "Frame bị bỏ do hàng đợi đầy", per_stream(lambda w: w.q_det.dropped), "counter")
+    metrics.gauge(
+        "pipeline_queue_depth",
+        "Số phần tử trong hàng đợi giữa các stage",
+        lambda: [({"stream": w.name, "queue": "detect"}, w.q_det.qsize()) for w in workers]
+        + [({"stream": w.name, "queue": "track"}, w.q_track.qsize()) for w in workers]
+        + [({"stream": "all", "queue": "emit"}, q_emit.qsize())],
+    )
+    tracked = [w for w in workers if w.tracker is not None]
+    if tracked:
+        metrics.gauge(
+            "pipeline_active_tracks", "Số track đang giữ", lambda: [({"stream": w.name}, w.tracker.tracks_count) for w in tracked]
+        )
+    gated = [w for w in workers if w.controls.gate is not None]
+    if gated:
+        metrics.gauge(
+            "pipeline_motion_gated_total", "Frame bị motion gate chặn",
+            lambda: [({"stream": w.name}, w.controls.gate.gated) for w in gated], "counter",
+        )
+    live = [w for w in workers if isinstance(w.src, ReconnectingSource)]
+    if live:
+        metrics.gauge(
+            "pipeline_source_reconnects_total", "Số lần kết nối lại nguồn",
+            lambda: [({"stream": w.name}, w.src.reconnects) for w in live if w.src is not None], "counter",
+        )
+
+
+def _stream_process(cfg: Dict, args, idx: int, out_q, stop) -> None:
+    """
+    Process con của --procs: source (ring shared memory) + motion + detect qua RemoteDetector + track
+    cho 1 stream, dùng lại StreamWorker/_detect_loop. Gửi về process chính từng frame dạng
+    ("frame", idx, index, capture_ts, (w, h), dets, tracked, predicted), cuối cùng ("end", idx, stats).
+    """
+    stats: Dict = {}
+    w = None
+    det = None
+    threads: List[threading.Thread] = []
+    try:
+        det = init_detector(args)
+        w = StreamWorker(cfg, args, stop, idx=idx)
+        if args.model_warmup and w.tracker is not None:
+            w.tracker.warmup()
+        if not w.open():
+            stats["error"] = "open"
+            return
+        q_out = StageQueue(max(2, args.queue_size), "block")
+        threads = [
+            threading.Thread(target=w.read_loop, name="read", daemon=True),
+            threading.Thread(
+                target=_detect_loop,
+                args=([w], det, max(1, args.det_batch), args.det_batch_wait_ms / 1000.0, stop),
+                name="detect",
+                daemon=True,
+            ),
+            threading.Thread(target=w.track_loop, args=(q_out,), name="track", daemon=True),
+        ]
+        for t in threads:
+            t.start()
+        while True:
+            item = q_out.get(stop)
+            if item is EOS or isinstance(item, tuple):
+                break
+            h, wd = item.frame.shape[:2]
+            out_q.put(
+                ("frame", idx, item.index, item.capture_ts, (wd, h), item.dets, item.tracked if w.tracker else None, item.predicted)
+            )
+            item.release()
+    except KeyboardInterrupt:
+        stop.set()
+    finally:
+        for t in threads:
+            t.join(timeout=5.0)
+        if w is not None:
+            stats["dropped"] = w.q_det.dropped
+            if hasattr(w.tracker, "embed_stats"):
+                stats["embed"] = w.tracker.embed_stats()
+            if isinstance(w.src, ReconnectingSource):
+                stats["source"] = w.src.stats()
+            pool = getattr(w.src, "pool", None)
+            if pool is not None:
+                stats["pool_misses"] = pool.misses
+            w.release()
+        if det is not None and hasattr(det, "shm_frames"):
+            stats["shm_frames"] = det.shm_frames
+            det.close()
+        from .shm_ring import close_pools
+        close_pools()
+        out_q.put(("end", idx, stats))
+
+
+class _ProcStream:
+    """Phía process chính của 1 stream chạy ở process con: metadata nguồn, emitter riêng, bộ đếm FPS."""
+
+    def __init__(self, cfg: Dict, args, idx: int):
+        self.cfg = cfg
+        self.source_info = _source_info(cfg, args, idx)
+        self.name = f"{self.source_info['camera_id']}/{self.source_info['stream_id']}"
+        self.emitter = None
+        self.stats: Optional[Dict] = None
+        self.frames = 0
+        self.det_total = 0
+        self.t0 = time.time()
+        self._win_frames = 0
+        self._win_t0 = self.t0
+
+    def count(self, dets: list, predicted: bool) -> None:
+        self.frames += 1
+        self._win_frames += 1
+        if not predicted:
+            self.det_total += len(dets)
+
+    fps_window = StreamWorker.fps_window
+
+
+def _proc_address() -> str:
+    if sys.platform == "win32":
+        return rf"\\.\pipe\ai_multi_{os.getpid()}"
+    return os.path.join(tempfile.gettempdir(), f"ai_multi_{os.getpid()}.sock")
+
+
+def _run_procs(args, streams: List[Dict], models, pipeline_run_id: str, metrics=None, startup=None) -> None:
+    import multiprocessing as mp
+    from .detect_server import DetectServer
+
+    with startup.phase("wait_models"):
+        det, _ = models.result()
+    server = None
+    child_args = argparse.Namespace(**{**vars(args), "procs": 0, "frame_shm": 1})
+    if det is not None:
+        # Process con detect qua server nội bộ: 1 request/frame, server gom batch giữa các stream
+        address = _proc_address()
+        key = os.urandom(16).hex()
+        server = DetectServer(
+            det,
+            address,
+            authkey=key.encode("utf-8"),
+            batch_size=args.det_batch,
+            max_wait=args.det_batch_wait_ms / 1000.0,
+            log_interval=0,
+        )
+        threading.Thread(target=server.serve_forever, name="detect-server", daemon=True).start()
+        child_args.detector = "remote"
+        child_args.det_server = address
+        child_args.det_server_key = key
+        child_args.det_batch = 1
+
+    ctx = mp.get_context("spawn")
+    stop = ctx.Event()
+    out_q = ctx.Queue(maxsize=max(64, 16 * len(streams)))
+    states = [_ProcStream(cfg, args, i) for i, cfg in enumerate(streams)]
+    shared_emitter = None
+    procs = []
+    try:
+        if args.emit != "none":
+            shared_emitter = init_emitter(args, args.out)
+            for st in states:
+                if st.cfg.get("out"):
+                    st.emitter = init_emitter(args, st.cfg["out"])
+        procs = [
+            ctx.Process(target=_stream_process, args=(cfg, child_args, i, out_q, stop), name=f"stream-{states[i].name}", daemon=True)
+            for i, cfg in enumerate(streams)
+        ]
+        for p in procs:
+            p.start()
+        print(f"[INFO] Multi-stream (procs): {len(procs)} process | det_batch={args.det_batch}")
+        if metrics is not None:
+            metrics.gauge(
+                "pipeline_frames_total", "Số frame đã xử lý", lambda: [({"stream": st.name}, st.frames) for st in states], "counter"
+            )
+            metrics.gauge(
+                "pipeline_detections_total", "Số detection từ detector", lambda: [({"stream": st.name}, st.det_total) for st in states], "counter"
+            )
+
+        remaining = len(procs)
+        last_log = time.time()
+        while remaining > 0:
+            try:
+                msg = out_q.get(timeout=0.5)
+            except queue.Empty:
+                if not any(p.is_alive() for p in procs):
+                    print("[WARN] Mọi process stream đã dừng.")
+                    break
+                continue
+            st = states[msg[1]]
+            if msg[0] == "end":
+                st.stats = msg[2]
+                remaining -= 1
+                continue
+            _, _, index, capture_ts, image_size, dets, tracked, predicted = msg
+            st.count(dets, predicted)
+            if startup.mark_ready():
+                print(f"[INFO] Startup: {startup.summary()}")
+            emitter = st.emitter or shared_emitter
+            if emitter and det is not None:
+                t0 = time.perf_counter()
+                emitter.emit_detection(
+                    schema_version="1.0",
+                    pipeline_run_id=pipeline_run_id,
+                    source=st.source_info,
+                    frame_index=index,
+                    capture_ts=capture_ts,
+                    image_size=image_size,
+                    dets=dets,
+                    tracked=tracked,
+                    predicted=predicted,
+                )
+                if metrics is not None:
+                    metrics.observe("emit", time.perf_counter() - t0, st.name)
+            if metrics is not None:
+                metrics.tick()
+
+            now = time.time()
+            if now - last_log >= args.log_interval:
+                last_log = now
+                for s in states:
+                    avg = s.frames / max(1e-6, now - s.t0)
+                    print(f"[INFO] {s.name} | Frames={s.frames} | ~{s.fps_window():.1f} FPS (avg {avg:.1f}) | det_total={s.det_total}")
+                if server is not None:
+                    print(f"[INFO] Detect server: {server.stats()}")
+    except KeyboardInterrupt:
+        print("[INFO] Quit by user.")
+    finally:
+        stop.set()
+        for p in procs:
+            p.join(timeout=5.0)
+            if p.is_alive():
+                p.terminate()
+        if server is not None:
+            server.stop()
+        for st in states:
+            avg = st.frames / max(1e-6, time.time() - st.t0)
+            extra = "".join(f" | {k}={v}" for k, v in (st.stats or {}).items())
+            print(f"[INFO] {st.name}: frames={st.frames} | avg {avg:.1f} FPS{extra}")
+            if st.emitter:
+                st.emitter.close()
+        if server is not None:
+            print(f"[INFO] Detect server: {server.stats()}")
+        if shared_emitter:
+            shared_emitter.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Ingest nhiều camera trong 1 process, detector dùng chung")
+    ap.add_argument("--config", required=True, help="File JSON danh sách camera (store_id/camera_id/stream_id/src)")
+    add_pipeline_args(ap)
+    ap.add_argument("--log_interval", type=float, default=safe_float_env("MULTI_LOG_INTERVAL", "5"), help="Chu kỳ log FPS từng stream (giây)")
+    add_metrics_args(ap)
+    add_detect_track_args(ap)
+    ap.add_argument("--emit", type=str, default="none", choices=["none", "detection"], help="Kiểu dữ liệu xuất NDJSON")
+    ap.add_argument("--out", type=str, default="-", help="File NDJSON chung cho mọi stream (stream có 'out' riêng sẽ ghi file riêng)")
+    add_emit_args(ap)
+    ap.add_argument("--store_id", type=str, default=os.getenv("STORE_ID", "store_01"), help="store_id mặc định nếu config không có")
+    ap.add_argument("--run_id", type=str, default=os.getenv("PIPELINE_RUN_ID", ""))
+    ap.add_argument(
+        "--procs",
+        type=int,
+        default=safe_int_env("MULTI_PROCS", "0"),
+        help="1 = mỗi stream 1 process con (decode vào shared memory + motion + track), detect ở process chính (1/0)",
+    )
+    startup = StartupTimer()
+    args = ap.parse_args()
+
+    streams = load_camera_config(args.config)
+    if args.procs and args.track and args.tracker == "deepsort" and args.track_embedder != "stub":
+        # Process con không dùng chung được embedder: DeepSORT = N bản model appearance cho N stream
+        print(
+            f"[WARN] --procs + DeepSORT: mỗi process con load 1 embedder '{args.track_embedder}' riêng"
+            f" ({len(streams)} bản trong RAM); --tracker bytetrack không cần embedder."
+        )
+    stop = threading.Event()
+
+    # Detector load + warmup trên thread nền trong lúc tạo tracker/mở các source
+    models = ModelLoader(args, startup, with_tracker=False)
+    pipeline_run_id = args.run_id if args.run_id else uuid.uuid4().hex
+    metrics = init_metrics(args, base={"pipeline_run_id": pipeline_run_id})
+    workers: List[StreamWorker] = []
+    shared_emitter = None
+    # Mọi đường thoát (không mở được stream, lỗi load model, Ctrl+C) đều đóng worker/emitter/metrics/model
+    try:
+        if args.procs:
+            _run_procs(args, streams, models, pipeline_run_id, metrics, startup)
+            return
+        # Tracker riêng từng stream nhưng dùng chung 1 embedder appearance (không load N bản model)
+        shared_embedder = None
+        for i, cfg in enumerate(streams):
+            w = StreamWorker(cfg, args, stop, idx=i, shared_embedder=shared_embedder, metrics=metrics)
+            if shared_embedder is None and w.tracker is not None:
+                shared_embedder = w.tracker.embedder
+                if args.model_warmup:
+                    with startup.phase("tracker_warmup"):
+                        w.tracker.warmup()
+            workers.append(w)
+
+        if args.emit != "none":
+            shared_emitter = init_emitter(args, args.out)
+            for w in workers:
+                if w.cfg.get("out"):
+                    w.emitter = init_emitter(args, w.cfg["out"])
+
+        with startup.phase("sources"):
+            opened = [w for w in workers if w.open()]
+        if not opened:
+            print("[ERROR] Không mở được stream nào.")
+            raise SystemExit(2)
+        with startup.phase("wait_models"):
+            det, _ = models.result()
+        print(f"[INFO] Multi-stream: {len(opened)}/{len(workers)} stream | det_batch={args.det_batch}")
+
+        q_emit = StageQueue(max(args.queue_size, len(opened) * 2), "block")
+        if metrics is not None:
+            _register_gauges(metrics, opened, q_emit)
+        threads = [
+            threading.Thread(
+                target=_detect_loop,
+                args=(opened, det, max(1, args.det_batch), args.det_batch_wait_ms / 1000.0, stop, metrics),
+                name="detect",
+                daemon=True,
+            )
+        ]
+        for w in opened:
+            threads.append(threading.Thread(target=w.read_loop, name=f"read-{w.name}", daemon=True))
+            threads.append(threading.Thread(target=w.track_loop, args=(q_emit,), name=f"track-{w.name}", daemon=True))
+        for t in threads:
+            t.start()
+
+        remaining = len(opened)
+        last_log = time.time()
+        try:
+            while remaining > 0:
+                item = q_emit.get(stop)
+                if item is EOS:
+                    break
+                if isinstance(item, tuple):
+                    remaining -= 1
+                    continue
+                w = item.stream
+                w.count(item)
+                if startup.mark_ready():
+                    print(f"[INFO] Startup: {startup.summary()}")
+
+                emitter = w.emitter or shared_emitter
+                if emitter and det is not None:
+                    t0 = time.perf_counter()
+                    h, wd = item.frame.shape[:2]
+                    emitter.emit_detection(
+                        schema_version="1.0",
+                        pipeline_run_id=pipeline_run_id,
+                        source=w.source_info,
+                        frame_index=item.index,
+                        capture_ts=item.capture_ts,
+                        image_size=(wd, h),
+                        dets=item.dets,
+                        tracked=item.tracked if w.tracker else None,
+                        predicted=item.predicted,
+                    )
+                    if metrics is not None:
+                        metrics.observe("emit", time.perf_counter() - t0, w.name)
+                item.release()
+                if metrics is not None:
+                    metrics.tick()
+
+                now = time.time()
+                if now - last_log >= args.log_interval:
+                    last_log = now
+                    for ww in opened:
+                        avg = ww.frames / max(1e-6, now - ww.t0)
+                        print(
+                            f"[INFO] {ww.name} | Frames={ww.frames} | ~{ww.fps_window():.1f} FPS (avg {avg:.1f})"
+                            f" | det_total={ww.det_total} | dropped={ww.q_det.dropped}"
+                            + (f" | detect_ratio={ww.controls.cadence.ratio:.2f}" if ww.controls.cadence else "")
+                            + (f" | motion_gated={ww.controls.gate.gated}" if ww.controls.gate else "")
+                            + (f" | {ww.src.stats()}" if isinstance(ww.src, ReconnectingSource) else "")
+                        )
+                    if metrics is not None:
+                        print(f"[INFO] {metrics.short()}")
+        except KeyboardInterrupt:
+            print("[INFO] Quit by user.")
+        finally:
+            stop.set()
+            for t in threads:
+                t.join(timeout=5.0)
+            for w in opened:
+                avg = w.frames / max(1e-6, time.time() - w.t0)
+                print(
+                    f"[INFO] {w.name}: frames={w.frames} | avg {avg:.1f} FPS | dropped={w.q_det.dropped}"
+                    + (f" | {w.tracker.embed_stats()}" if hasattr(w.tracker, "embed_stats") else "")
+                    + (f" | {w.src.stats()}" if isinstance(w.src, ReconnectingSource) else "")
+                )
+    finally:
+        stop.set()
+        if metrics is not None:
+            metrics.close()
+        for w in workers:
+            w.release()
+        if shared_emitter:
+            shared_emitter.close()
+        models.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,484 @@
+# ai/ingest/pipeline.py
+"""
+Pipeline nhiều stage chạy song song: ingest -> detect -> track -> emit.
+
+Mỗi stage là một thread riêng, nối với nhau bằng hàng đợi có giới hạn (bounded
+queue) để decode, YOLO và ghi NDJSON chồng lấn thời gian với nhau.
+"""
+import queue
+import threading
+import time
+from typing import TYPE_CHECKING, Callable, List, Optional
+
+import numpy as np
+
+from ai.detect.detections import Detections
+
+if TYPE_CHECKING:  # chỉ để chú thích kiểu; motion/region import cv2
+    from .cadence import DetectCadence
+    from .motion import MotionGate
+    from .region import DetectRegion
+
+# Chính sách khi hàng đợi đầy
+DROP_POLICIES = ("block", "drop_oldest")
+
+EOS = object()  # sentinel báo hết stream
+
+
+class FramePacket:
+    """Dữ liệu của 1 frame đi qua các stage."""
+
+    __slots__ = ("index", "frame", "capture_ts", "dets", "tracked", "stream", "predicted", "roi", "on_release", "full")
+
+    def __init__(
+        self,
+        index: int,
+        frame: np.ndarray,
+        capture_ts: Optional[str] = None,
+        stream=None,
+        on_release: Optional[Callable[[np.ndarray], None]] = None,
+    ):
+        self.index = index
+        self.frame = frame
+        self.capture_ts = capture_ts
+        self.dets: list = []
+        self.tracked: Optional[list] = None
+        self.stream = stream  # stream nguồn (chế độ multi-camera)
+        self.predicted = False  # True = không chạy detector, bbox do tracker dự đoán
+        self.roi = None  # (x1,y1,x2,y2) vùng cần detect; None = cả frame
+        self.on_release = on_release  # trả buffer frame về pool của source
+        self.full: Optional[np.ndarray] = None  # frame độ phân giải gốc (chỉ khi scale trong GStreamer + display)
+
+    def release(self) -> None:
+        """Gọi khi packet không còn dùng (sink xong hoặc bị drop); chỉ có tác dụng 1 lần."""
+        if self.on_release is not None:
+            self.on_release(self.frame)
+            self.on_release = None
+
+
+class StageQueue:
+    """
+    Hàng đợi có giới hạn giữa 2 stage.
+
+    - block      : producer chờ tới khi còn chỗ (phù hợp file, không mất frame)
+    - drop_oldest: bỏ phần tử cũ nhất để nhường chỗ (phù hợp RTSP live)
+    """
+
+    def __init__(self, maxsize: int = 4, policy: str = "block"):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"drop policy không hợp lệ: {policy}")
+        self._q: "queue.Queue" = queue.Queue(maxsize=max(1, maxsize))
+        self.policy = policy
+        self.dropped = 0
+
+    def qsize(self) -> int:
+        return self._q.qsize()
+
+    def put(self, item, stop: threading.Event) -> bool:
+        """Đưa item vào hàng đợi. Trả về False nếu pipeline đã dừng."""
+        if self.policy == "drop_oldest":
+            while not stop.is_set():
+                try:
+                    self._q.put_nowait(item)
+                    return True
+                except queue.Full:
+                    try:
+                        old = self._q.get_nowait()
+                        self.dropped += 1
+                        if isinstance(old, FramePacket):
+                            old.release()
+                    except queue.Empty:
+                        pass
+            return False
+
+        while not stop.is_set():
+            try:
+                self._q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def drain(self) -> int:
+        """Bỏ mọi item còn trong hàng đợi (lúc dừng pipeline), trả buffer frame về pool; trả về số packet."""
+        n = 0
+        while True:
+            try:
+                item = self._q.get_nowait()
+            except queue.Empty:
+                return n
+            if isinstance(item, FramePacket):
+                item.release()
+                n += 1
+
+    def get_nowait(self):
+        """Lấy item nếu có sẵn, ngược lại trả về None (không chờ)."""
+        try:
+            return self._q.get_nowait()
+        except queue.Empty:
+            return None
+
+    def get(self, stop: threading.Event, deadline: Optional[float] = None):
+        """
+        Lấy item; trả về EOS nếu pipeline đã dừng.
+        Nếu có deadline (time.monotonic()) mà hết hạn vẫn chưa có item thì trả về None.
+        """
+        while not stop.is_set():
+            timeout = 0.1
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return None
+                timeout = min(timeout, remaining)
+            try:
+                return self._q.get(timeout=timeout)
+            except queue.Empty:
+                continue
+        return EOS
+
+
+class BatchStage:
+    """
+    Stage xử lý theo lô: gom tối đa batch_size packet, hoặc dừng gom khi quá max_wait
+    giây kể từ packet đầu tiên (deadline độ trễ). fn(list[pkt]) -> list[pkt] cùng thứ tự.
+    """
+
+    def __init__(
+        self,
+        fn: Callable[[List[FramePacket]], List[FramePacket]],
+        batch_size: int = 1,
+        max_wait: float = 0.05,
+    ):
+        self.fn = fn
+        self.batch_size = max(1, batch_size)
+        self.max_wait = max(0.0, max_wait)
+        self.__name__ = getattr(fn, "__name__", "batch")
+
+    def __call__(self, batch: List[FramePacket]) -> List[FramePacket]:
+        return self.fn(batch)
+
+
+class DetectControls:
+    """Bộ điều khiển detect của 1 stream: cadence (bỏ frame), motion gate và vùng detect (đều có thể None)."""
+
+    __slots__ = ("cadence", "gate", "region")
+
+    def __init__(
+        self,
+        cadence: Optional["DetectCadence"] = None,
+        gate: Optional["MotionGate"] = None,
+        region: Optional["DetectRegion"] = None,
+    ):
+        self.cadence = cadence
+        self.gate = gate
+        self.region = region
+
+
+def motion_stage(controls_for: Callable[[FramePacket], DetectControls]):
+    """Stage motion gate (trước detect): frame không chuyển động -> predicted, có chuyển động -> gán ROI."""
+    def motion(pkt: FramePacket) -> FramePacket:
+        gate = controls_for(pkt).gate
+        if gate is not None:
+            moving, roi = gate.check(pkt.frame)
+            if moving:
+                pkt.roi = roi
+            else:
+                pkt.predicted = True
+        return pkt
+    return motion
+
+
+def _shift(dets: list, ox: int, oy: int) -> list:
+    if isinstance(dets, Detections):
+        return dets.shifted(ox, oy)
+    return [(x1 + ox, y1 + oy, x2 + ox, y2 + oy, cf, ci, name) for (x1, y1, x2, y2, cf, ci, name) in dets]
+
+
+def detect_packets(det, batch: List[FramePacket], controls_for: Callable[[FramePacket], DetectControls]) -> None:
+    """
+    Chạy det.infer_batch cho các packet tới lượt detect; packet bị motion gate chặn hoặc bị bỏ
+    qua theo cadence được đánh dấu predicted để stage track dùng dự đoán Kalman.
+    Packet có ROI chỉ detect phần crop, bbox được dịch lại về toạ độ frame gốc.
+    Stream có DetectRegion (polygon ROI / tile): mỗi frame thành nhiều ảnh, tất cả ảnh của cả batch
+    đi chung 1 lần infer_batch rồi được gộp lại theo frame.
+    Detector có frame_keyed (replay/synthetic, không nhìn pixel) nhận thêm khoá
+    (frame_index, stream, ox, oy, frame_shape) của từng ảnh.
+    """
+    todo = []
+    for pkt in batch:
+        if pkt.predicted:
+            continue
+        cadence = controls_for(pkt).cadence
+        if cadence is None or cadence.should_detect(pkt.index):
+            todo.append(pkt)
+        else:
+            pkt.predicted = True
+    if not todo:
+        return
+    keyed = getattr(det, "frame_keyed", False)
+    frames = []
+    keys = []
+    spans = []  # (vị trí đầu trong frames, offsets các ảnh) theo packet
+    for pkt in todo:
+        region = controls_for(pkt).region
+        if region is not None:
+            views = region.split(pkt.frame, pkt.roi)
+        elif pkt.roi is not None:
+            x1, y1, x2, y2 = pkt.roi
+            views = [(pkt.frame[y1:y2, x1:x2], x1, y1)]
+        else:
+            views = [(pkt.frame, 0, 0)]
+        spans.append((len(frames), [(ox, oy) for _, ox, oy in views]))
+        frames.extend(img for img, _, _ in views)
+        if keyed:
+            stream = getattr(pkt.stream, "name", None)
+            keys.extend((pkt.index, stream, ox, oy, pkt.frame.shape[:2]) for _, ox, oy in views)
+    if not frames:
+        results = []
+    elif keyed:
+        results = det.infer_batch(frames, keys=keys)
+    else:
+        results = det.infer_batch(frames)  # [[(x1,y1,x2,y2,conf,cls_id,cls_name)], ...]
+    for pkt, (start, offsets) in zip(todo, spans):
+        controls = controls_for(pkt)
+        parts = results[start:start + len(offsets)]
+        if controls.region is not None:
+            dets = controls.region.merge_views(pkt.frame.shape, parts, offsets)
+        else:
+            dets = _shift(parts[0], *offsets[0]) if offsets[0] != (0, 0) else parts[0]
+        pkt.dets = dets
+        if controls.cadence is not None:
+            controls.cadence.observe(pkt.index, dets)
+        if controls.gate is not None:
+            controls.gate.observe(dets)
+
+
+def detect_stage(det, batch_size: int = 1, max_wait_ms: float = 50.0, controls: Optional[DetectControls] = None) -> BatchStage:
+    """Stage detect theo lô: 1 lần det.infer_batch cho cả batch, gán lại dets cho từng packet."""
+    controls = controls or DetectControls()
+
+    def detect(batch: List[FramePacket]) -> List[FramePacket]:
+        detect_packets(det, batch, lambda _pkt: controls)
+        return batch
+    return BatchStage(detect, batch_size=batch_size, max_wait=max_wait_ms / 1000.0)
+
+
+def track_stage(tracker):
+    """
+    Stage track; không có tracker thì giữ nguyên dets với track_id=-1.
+    Packet predicted: tracker chỉ dự đoán Kalman, dets được dựng lại từ bbox dự đoán.
+    """
+    name2id: dict = {}
+
+    def track(pkt: FramePacket) -> FramePacket:
+        if pkt.predicted:
+            pkt.tracked = tracker.predict(pkt.frame) if tracker else []
+            pkt.dets = [
+                (x1, y1, x2, y2, conf, name2id.get(cls, -1), cls) for (x1, y1, x2, y2, _tid, conf, cls) in pkt.tracked
+            ]
+            return pkt
+        if isinstance(pkt.dets, Detections):
+            for ci in np.unique(pkt.dets.cls_id).tolist():
+                name2id[pkt.dets.names.get(ci, str(ci))] = ci
+        else:
+            for d in pkt.dets:
+                name2id[d[6]] = d[5]
+        if tracker:
+            pkt.tracked = tracker.update(pkt.dets, pkt.frame)  # [(x1,y1,x2,y2,tid,conf,cls)]
+        else:
+            pkt.tracked = [(x1, y1, x2, y2, -1, conf, cls) for (x1, y1, x2, y2, conf, _, cls) in pkt.dets]
+        return pkt
+    return track
+
+
+def run_serial(
+    read_fn: Callable[[], Optional[FramePacket]],
+    stages: list,
+    sink: Callable[[FramePacket], bool],
+) -> None:
+    """
+    Chạy cùng các stage như ThreadedPipeline nhưng tuần tự trên thread hiện tại.
+    Nếu có BatchStage, gom packet theo batch_size/max_wait lớn nhất trước khi xử lý.
+    """
+    batch_size = max([s.batch_size for s in stages if isinstance(s, BatchStage)] or [1])
+    max_wait = max([s.max_wait for s in stages if isinstance(s, BatchStage)] or [0.0])
+    eos = False
+    while not eos:
+        batch: List[FramePacket] = []
+        deadline = None
+        while len(batch) < batch_size:
+            pkt = read_fn()
+            if pkt is None:
+                eos = True
+                break
+            batch.append(pkt)
+            if deadline is None:
+                deadline = time.monotonic() + max_wait
+            elif time.monotonic() >= deadline:
+                break
+        for stage in stages:
+            if isinstance(stage, BatchStage):
+                batch = stage(batch) if batch else batch
+            else:
+                batch = [stage(pkt) for pkt in batch]
+        for i, pkt in enumerate(batch):
+            keep_going = sink(pkt)
+            pkt.release()
+            if not keep_going:
+                for rest in batch[i + 1:]:
+                    rest.release()
+                return
+
+
+class ThreadedPipeline:
+    """
+    Chạy read_fn (ingest) và các stage trên thread riêng, sink chạy trên thread gọi
+    (để cv2.imshow luôn ở main thread).
+
+    read_fn() -> FramePacket | None (None = hết stream)
+    stage(pkt) -> pkt, hoặc BatchStage(list[pkt]) -> list[pkt]
+    sink(pkt) -> bool (False = dừng pipeline, vd: user bấm 'q')
+
+    Drop policy chỉ áp dụng cho hàng đợi ingest -> stage đầu tiên; các hàng đợi sau
+    luôn block vì bỏ frame sau khi đã detect là lãng phí công inference.
+    Khi dừng (EOS, sink trả False, lỗi), packet còn trong hàng đợi hoặc đang xử lý dở đều được
+    release() để trả slot về frame pool.
+    """
+
+    def __init__(
+        self,
+        read_fn: Callable[[], Optional[FramePacket]],
+        stages: list,
+        sink: Callable[[FramePacket], bool],
+        *,
+        queue_size: int = 4,
+        drop_policy: str = "block",
+    ):
+        self.read_fn = read_fn
+        self.stages = stages
+        self.sink = sink
+        self.stop = threading.Event()
+        n = len(stages) + 1
+        self.queues = [
+            StageQueue(queue_size, drop_policy if i == 0 else "block") for i in range(n)
+        ]
+        self._threads: List[threading.Thread] = []
+        self._error: Optional[BaseException] = None
+
+    @property
+    def dropped(self) -> int:
+        return sum(q.dropped for q in self.queues)
+
+    def queue_depths(self) -> List[int]:
+        return [q.qsize() for q in self.queues]
+
+    def _fail(self, e: BaseException) -> None:
+        if self._error is None:
+            self._error = e
+        self.stop.set()
+
+    def _ingest_loop(self) -> None:
+        out = self.queues[0]
+        try:
+            while not self.stop.is_set():
+                pkt = self.read_fn()
+                if pkt is None:
+                    break
+                if not out.put(pkt, self.stop):
+                    pkt.release()
+                    return
+        except BaseException as e:  # noqa: BLE001 - chuyển lỗi về main thread
+            self._fail(e)
+            return
+        # EOS không được phép bị drop: chờ tới khi có chỗ
+        out.put(EOS, self.stop)
+
+    def _batch_loop(self, stage: BatchStage, q_in: StageQueue, q_out: StageQueue) -> None:
+        batch: List[FramePacket] = []
+        try:
+            while not self.stop.is_set():
+                batch = []
+                item = q_in.get(self.stop)
+                if item is EOS:
+                    q_out.put(EOS, self.stop)
+                    return
+                batch = [item]
+                eos = False
+                deadline = time.monotonic() + stage.max_wait
+                while len(batch) < stage.batch_size:
+                    item = q_in.get(self.stop, deadline)
+                    if item is None:
+                        break
+                    if item is EOS:
+                        eos = True
+                        break
+                    batch.append(item)
+                batch = stage(batch)
+                while batch:
+                    if not q_out.put(batch[0], self.stop):
+                        break
+                    batch.pop(0)
+                if batch:
+                    break
+                if eos:
+                    q_out.put(EOS, self.stop)
+                    return
+        except BaseException as e:  # noqa: BLE001
+            self._fail(e)
+        for pkt in batch:
+            pkt.release()
+
+    def _stage_loop(self, fn: Callable[[FramePacket], FramePacket], q_in: StageQueue, q_out: StageQueue) -> None:
+        item = None
+        try:
+            while not self.stop.is_set():
+                item = q_in.get(self.stop)
+                if item is EOS:
+                    q_out.put(EOS, self.stop)
+                    return
+                item = fn(item)
+                if not q_out.put(item, self.stop):
+                    break
+                item = None
+        except BaseException as e:  # noqa: BLE001
+            self._fail(e)
+        if isinstance(item, FramePacket):
+            item.release()
+
+    def run(self) -> None:
+        self._threads = [threading.Thread(target=self._ingest_loop, name="ingest", daemon=True)]
+        for i, fn in enumerate(self.stages):
+            name = getattr(fn, "__name__", f"stage{i}")
+            self._threads.append(
+                threading.Thread(
+                    target=self._batch_loop if isinstance(fn, BatchStage) else self._stage_loop,
+                    args=(fn, self.queues[i], self.queues[i + 1]),
+                    name=name,
+                    daemon=True,
+                )
+            )
+        for t in self._threads:
+            t.start()
+
+        last = self.queues[-1]
+        try:
+            while not self.stop.is_set():
+                item = last.get(self.stop)
+                if item is EOS:
+                    break
+                try:
+                    keep_going = self.sink(item)
+                finally:
+                    item.release()
+                if not keep_going:
+                    break
+        finally:
+            self.stop.set()
+            for t in self._threads:
+                t.join(timeout=5.0)
+            # Packet chưa tới sink (dừng sớm/lỗi): trả slot về frame pool
+            for q in self.queues:
+                q.drain()
+
+        if self._error is not None:
+            raise self._error
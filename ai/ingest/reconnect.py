@@ -0,0 +1,130 @@
+# ai/ingest/reconnect.py
+"""
+Tự kết nối lại nguồn live (RTSP/HTTP) khi mất tín hiệu, thay vì thoát cả process
+(mất 5-10s nạp lại YOLO + embedder). Detector, tracker, emitter và số thứ tự frame
+giữ nguyên qua các lần reconnect vì chỉ source bên dưới được tạo lại.
+"""
+import time
+import threading
+from typing import Callable, Optional, Tuple
+
+import numpy as np
+
+
+def is_live_source(path: str) -> bool:
+    """Nguồn mạng (RTSP/HTTP/UDP...) có thể reconnect; file hết là EOS thật."""
+    return "://" in path and not path.startswith("file://")
+
+
+class ReconnectingSource:
+    """
+    Bọc GstSource/CvSource. read() lỗi (ERROR/EOS/stall) thì release source cũ và mở
+    source mới qua `opener`, chờ theo exponential backoff [backoff_initial, backoff_max].
+
+    - opener      : hàm tạo + open() source mới, trả về None nếu thất bại
+    - max_retries : số lần thử liên tiếp tối đa cho 1 lần mất kết nối (0 = không giới hạn)
+    - stop        : Event dùng chung của pipeline để ngắt backoff khi tắt
+
+    Bộ đếm: reconnects (lần nối lại thành công), failures (lần mở thất bại),
+    downtime (tổng giây mất tín hiệu), frames.
+    """
+
+    def __init__(
+        self,
+        opener: Callable[[], Optional[object]],
+        name: str = "",
+        backoff_initial: float = 0.5,
+        backoff_max: float = 30.0,
+        max_retries: int = 0,
+        stop: Optional[threading.Event] = None,
+    ):
+        self.opener = opener
+        self.name = name
+        self.backoff_initial = max(0.01, backoff_initial)
+        self.backoff_max = max(self.backoff_initial, backoff_max)
+        self.max_retries = max(0, max_retries)
+        self.stop = stop
+        self._closed = threading.Event()
+        self.src = None
+        # Bộ đếm
+        self.frames = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.downtime = 0.0
+
+    @property
+    def pool(self):
+        return getattr(self.src, "pool", None)
+
+    def _stopped(self) -> bool:
+        return self._closed.is_set() or (self.stop is not None and self.stop.is_set())
+
+    def _sleep(self, delay: float) -> bool:
+        """Chờ backoff, trả về False nếu pipeline dừng trong lúc chờ."""
+        end = time.monotonic() + delay
+        while not self._stopped():
+            left = end - time.monotonic()
+            if left <= 0:
+                return True
+            self._closed.wait(min(left, 0.5))
+        return False
+
+    def open(self) -> bool:
+        self.src = self.opener()
+        return self.src is not None
+
+    def _reconnect(self) -> bool:
+        t0 = time.monotonic()
+        delay = self.backoff_initial
+        attempt = 0
+        if self.src is not None:
+            self.src.release()
+            self.src = None
+        try:
+            while not self._stopped():
+                attempt += 1
+                print(f"[WARN] {self.name}: mất tín hiệu, thử kết nối lại #{attempt} sau {delay:.1f}s")
+                if not self._sleep(delay):
+                    return False
+                self.src = self.opener()
+                if self.src is not None:
+                    self.reconnects += 1
+                    print(f"[INFO] {self.name}: đã kết nối lại (lần {self.reconnects})")
+                    return True
+                self.failures += 1
+                if self.max_retries and attempt >= self.max_retries:
+                    print(f"[ERROR] {self.name}: bỏ cuộc sau {attempt} lần thử kết nối lại")
+                    return False
+                delay = min(self.backoff_max, delay * 2)
+            return False
+        finally:
+            self.downtime += time.monotonic() - t0
+
+    def read(self) -> Tuple[bool, Optional[np.ndarray]]:
+        while not self._stopped():
+            if self.src is not None:
+                ok, frame = self.src.read()
+                if ok and frame is not None:
+                    self.frames += 1
+                    return True, frame
+            if not self._reconnect():
+                break
+        return False, None
+
+    def read_full(self) -> Optional[np.ndarray]:
+        read_full = getattr(self.src, "read_full", None)
+        return read_full() if read_full is not None else None
+
+    def release_frame(self, frame: np.ndarray) -> None:
+        # Frame của source cũ không thuộc pool mới -> pool bỏ qua, GC thu hồi
+        if self.src is not None:
+            self.src.release_frame(frame)
+
+    def stats(self) -> str:
+        return f"reconnects={self.reconnects} | reconnect_failures={self.failures} | downtime={self.downtime:.1f}s"
+
+    def release(self) -> None:
+        self._closed.set()
+        if self.src is not None:
+            self.src.release()
+            self.src = None
@@ -0,0 +1,186 @@
+# ai/ingest/region.py
+"""
+Vùng detect của 1 camera: polygon ROI (pixel ngoài sàn cửa hàng không bao giờ tới model)
+và chế độ tile (chia frame độ phân giải cao thành các ô chồng lấn, detect theo lô rồi gộp
+bbox bằng NMS giữa các ô) để người nhỏ trong khung hình rộng không bị mất khi resize.
+"""
+import math
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+Window = Tuple[int, int, int, int]  # (x1,y1,x2,y2) toạ độ frame gốc
+
+_PAD_VALUE = 114  # cùng màu pad letterbox của YOLO
+
+
+def parse_polygons(spec) -> List[np.ndarray]:
+    """
+    Đọc polygon ROI từ chuỗi "x,y;x,y;x,y|x,y;..." (nhiều polygon ngăn bởi '|')
+    hoặc từ JSON: [[x,y],...] / [[[x,y],...], ...].
+    Toạ độ đều <= 1.0 được hiểu là tỉ lệ theo kích thước frame.
+    """
+    if not spec:
+        return []
+    if isinstance(spec, str):
+        polys = [
+            [[float(v) for v in pt.split(",")] for pt in part.split(";") if pt.strip()]
+            for part in spec.split("|") if part.strip()
+        ]
+    else:
+        polys = [spec] if spec and isinstance(spec[0][0], (int, float)) else list(spec)
+    out = []
+    for p in polys:
+        arr = np.asarray(p, dtype=np.float64).reshape(-1, 2)
+        if len(arr) < 3:
+            raise ValueError(f"Polygon ROI cần ít nhất 3 điểm: {p}")
+        out.append(arr)
+    return out
+
+
+def tile_windows(window: Window, tile: int, overlap: float) -> List[Window]:
+    """Chia window thành lưới ô tile x tile chồng lấn theo tỉ lệ overlap, phủ kín cả mép."""
+    x1, y1, x2, y2 = window
+    w, h = x2 - x1, y2 - y1
+    stride = max(1, int(tile * (1.0 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        if length <= tile:
+            return [0]
+        n = math.ceil((length - tile) / stride) + 1
+        return [int(round(v)) for v in np.linspace(0, length - tile, n)]
+
+    return [
+        (x1 + sx, y1 + sy, x1 + min(w, sx + tile), y1 + min(h, sy + tile))
+        for sy in starts(h) for sx in starts(w)
+    ]
+
+
+def _overlap_over_min(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Diện tích giao / diện tích box nhỏ hơn giữa từng cặp bbox xyxy (N,4) x (M,4)."""
+    ix = np.clip(np.minimum(a[:, None, 2], b[None, :, 2]) - np.maximum(a[:, None, 0], b[None, :, 0]), 0, None)
+    iy = np.clip(np.minimum(a[:, None, 3], b[None, :, 3]) - np.maximum(a[:, None, 1], b[None, :, 1]), 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    return ix * iy / np.maximum(np.minimum(area_a[:, None], area_b[None, :]), 1e-9)
+
+
+def merge_tiles(dets: list, parts: Sequence[int], thresh: float) -> list:
+    """
+    NMS giữa các ô: bbox cùng class, khác ô, chồng nhau (giao / box nhỏ hơn >= thresh) -> giữ bbox
+    conf cao hơn. Dùng giao/box nhỏ thay cho IoU để bỏ được mảnh người bị cắt ở mép ô.
+    Bbox trong cùng 1 ô đã qua NMS của model nên không so với nhau.
+    """
+    if len(dets) < 2:
+        return dets
+    order = sorted(range(len(dets)), key=lambda i: -dets[i][4])
+    boxes = np.array([dets[i][:4] for i in order], dtype=np.float64)
+    cls = np.array([dets[i][5] for i in order])
+    part = np.array([parts[i] for i in order])
+    ov = _overlap_over_min(boxes, boxes)
+    clash = (ov >= thresh) & (cls[:, None] == cls[None, :]) & (part[:, None] != part[None, :])
+    keep = np.ones(len(order), dtype=bool)
+    for i in range(len(order)):
+        if keep[i]:
+            keep[i + 1:] &= ~clash[i, i + 1:]
+    return [dets[order[i]] for i in np.flatnonzero(keep)]
+
+
+class DetectRegion:
+    """
+    - polygons : polygon ROI (pixel hoặc tỉ lệ); pixel ngoài polygon được tô màu pad trước khi detect
+                 và detection có điểm chân (giữa cạnh dưới bbox) ngoài polygon bị bỏ
+    - tile     : cạnh ô (pixel frame gốc), 0 = không chia ô
+    - overlap  : tỉ lệ chồng lấn giữa 2 ô kề nhau
+    - full     : detect thêm cả vùng (thu nhỏ) để bắt người lớn bị cắt qua nhiều ô
+    - merge    : ngưỡng giao/box nhỏ hơn khi gộp bbox giữa các ô
+    """
+
+    def __init__(
+        self,
+        polygons: Optional[List[np.ndarray]] = None,
+        tile: int = 0,
+        overlap: float = 0.2,
+        full: bool = True,
+        merge: float = 0.6,
+    ):
+        self.polygons = polygons or []
+        self.tile = max(0, tile)
+        self.overlap = min(max(overlap, 0.0), 0.9)
+        self.full = full
+        self.merge = merge
+        # Mask + bbox polygon theo kích thước frame (tính 1 lần cho mỗi kích thước)
+        self._masks: Dict[Tuple[int, int], Tuple[np.ndarray, Optional[Window]]] = {}
+        # Bộ đếm
+        self.views = 0
+
+    def _mask(self, h: int, w: int) -> Tuple[Optional[np.ndarray], Optional[Window]]:
+        if not self.polygons:
+            return None, (0, 0, w, h)
+        cached = self._masks.get((h, w))
+        if cached is None:
+            mask = np.zeros((h, w), dtype=np.uint8)
+            pts = []
+            for p in self.polygons:
+                scale = (w, h) if p.max() <= 1.0 else (1, 1)
+                pts.append(np.round(p * scale).astype(np.int32))
+            cv2.fillPoly(mask, pts, 255)
+            x, y, bw, bh = cv2.boundingRect(mask)
+            cached = (mask, (x, y, x + bw, y + bh) if bw and bh else None)
+            self._masks[(h, w)] = cached
+        return cached
+
+    def split(self, frame: np.ndarray, roi: Optional[Window] = None) -> List[Tuple[np.ndarray, int, int]]:
+        """
+        Các ảnh cần detect cho 1 frame: [(ảnh, offset_x, offset_y)].
+        roi (từ motion gate) được giao với bbox polygon; rỗng -> không detect.
+        """
+        h, w = frame.shape[:2]
+        mask, bound = self._mask(h, w)
+        if bound is None:
+            return []
+        x1, y1, x2, y2 = bound
+        if roi is not None:
+            x1, y1 = max(x1, roi[0]), max(y1, roi[1])
+            x2, y2 = min(x2, roi[2]), min(y2, roi[3])
+            if x2 <= x1 or y2 <= y1:
+                return []
+        img = frame[y1:y2, x1:x2]
+        sub = None
+        if mask is not None:
+            sub = mask[y1:y2, x1:x2]
+            if cv2.countNonZero(sub) < sub.size:
+                masked = np.full_like(img, _PAD_VALUE)
+                cv2.copyTo(img, sub, masked)
+                img = masked
+        if not self.tile or (x2 - x1 <= self.tile and y2 - y1 <= self.tile):
+            out = [(img, x1, y1)]
+        else:
+            out = [(img, x1, y1)] if self.full else []
+            for tx1, ty1, tx2, ty2 in tile_windows((0, 0, x2 - x1, y2 - y1), self.tile, self.overlap):
+                if sub is not None and not cv2.countNonZero(sub[ty1:ty2, tx1:tx2]):
+                    continue
+                out.append((img[ty1:ty2, tx1:tx2], x1 + tx1, y1 + ty1))
+        self.views += len(out)
+        return out
+
+    def merge_views(self, frame_shape: Tuple[int, ...], results: List[list], offsets: List[Tuple[int, int]]) -> list:
+        """Dịch bbox từng ảnh về toạ độ frame, lọc theo polygon và gộp bbox trùng giữa các ô."""
+        h, w = frame_shape[:2]
+        mask, _ = self._mask(h, w)
+        dets: list = []
+        parts: List[int] = []
+        for k, (res, (ox, oy)) in enumerate(zip(results, offsets)):
+            for (x1, y1, x2, y2, cf, ci, name) in res:
+                x1, y1, x2, y2 = x1 + ox, y1 + oy, x2 + ox, y2 + oy
+                if mask is not None:
+                    fx = min(max(int((x1 + x2) / 2), 0), w - 1)
+                    fy = min(max(int(y2) - 1, 0), h - 1)
+                    if not mask[fy, fx]:
+                        continue
+                dets.append((x1, y1, x2, y2, cf, ci, name))
+                parts.append(k)
+        if len(results) > 1:
+            dets = merge_tiles(dets, parts, self.merge)
+        return dets
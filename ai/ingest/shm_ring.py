@@ -0,0 +1,199 @@
+# ai/ingest/shm_ring.py
+"""
+Ring frame trên shared memory (multiprocessing.shared_memory) cho truyền frame giữa các process
+không pickle/không copy mảng pixel.
+
+- ShmFramePool: cùng interface FramePool (acquire/release, allocated/misses/in_use); source decode
+  thẳng vào slot nằm trong 1 segment shared memory (--frame_shm 1).
+- shm_ref(arr): frame (hoặc crop/view) nằm trong slot -> (tên segment, offset, strides) để process
+  khác dựng lại đúng view đó bằng ShmAttachments.view(); None nếu frame không nằm trong shared memory.
+- ShmAttachments: phía đọc (detect server) giữ các segment đã attach theo tên.
+
+Vòng đời slot vẫn do process tạo ra nó quản lý (release khi sink xử lý xong); process đọc chỉ dùng
+slot trong lúc process ghi còn chờ kết quả (detect server trả lời đồng bộ) nên không cần khoá liên process.
+"""
+import atexit
+import mmap
+import os
+import sys
+import threading
+import weakref
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Mọi pool còn sống trong process (để shm_ref tìm segment chứa 1 frame và dọn segment khi thoát)
+_POOLS: "weakref.WeakSet[ShmFramePool]" = weakref.WeakSet()
+
+
+def _addr(buf) -> int:
+    return np.frombuffer(buf, dtype=np.uint8).__array_interface__["data"][0]
+
+
+class _Segment:
+    __slots__ = ("shm", "base", "size")
+
+    def __init__(self, shm: shared_memory.SharedMemory):
+        self.shm = shm
+        self.base = _addr(shm.buf)
+        self.size = shm.size
+
+
+class ShmFramePool:
+    """
+    size slot cùng shape trong 1 segment, tạo khi acquire() lần đầu (shape lấy từ frame decode).
+    Đổi độ phân giải: tạo segment mới; segment cũ chỉ được giải phóng lúc close() vì frame
+    đang cho mượn có thể còn trỏ vào. Pool cạn thì trả mảng thường ngoài shared memory (misses),
+    frame đó được gửi qua socket như bình thường.
+    """
+
+    def __init__(self, size: int, dtype=np.uint8):
+        self.size = max(1, size)
+        self.dtype = np.dtype(dtype)
+        self._shape: Optional[Tuple[int, ...]] = None
+        self._segments: List[_Segment] = []
+        self._free: List[np.ndarray] = []
+        self._leased: Dict[int, np.ndarray] = {}
+        self._lock = threading.Lock()
+        self.allocated = 0
+        self.misses = 0
+        _POOLS.add(self)
+
+    def _new_segment(self, shape: Tuple[int, ...]) -> None:
+        nbytes = int(np.prod(shape)) * self.dtype.itemsize
+        shm = shared_memory.SharedMemory(create=True, size=nbytes * self.size)
+        self._segments.append(_Segment(shm))
+        self._free = [np.ndarray(shape, dtype=self.dtype, buffer=shm.buf, offset=i * nbytes) for i in range(self.size)]
+        self._leased = {}
+        self._shape = shape
+        self.allocated = self.size
+
+    def acquire(self, shape: Tuple[int, ...]) -> np.ndarray:
+        with self._lock:
+            if shape != self._shape:
+                self._new_segment(shape)
+            if self._free:
+                arr = self._free.pop()
+                self._leased[id(arr)] = arr
+                return arr
+            self.misses += 1
+            return np.empty(shape, dtype=self.dtype)
+
+    def release(self, arr: np.ndarray) -> None:
+        """Trả slot về pool; mảng không thuộc pool (miss, slice, segment cũ) được bỏ qua."""
+        with self._lock:
+            if self._leased.pop(id(arr), None) is not None:
+                self._free.append(arr)
+
+    @property
+    def in_use(self) -> int:
+        return len(self._leased)
+
+    def locate(self, addr: int, nbytes: int) -> Optional[Tuple[str, int]]:
+        for seg in self._segments:
+            if seg.base <= addr and addr + nbytes <= seg.base + seg.size:
+                return seg.shm.name, addr - seg.base
+        return None
+
+    def close(self) -> None:
+        """Giải phóng mọi segment (unlink tên; vùng nhớ được thu hồi khi không process nào còn map)."""
+        with self._lock:
+            self._free = []
+            self._leased = {}
+            segments, self._segments = self._segments, []
+            self._shape = None
+        for seg in segments:
+            try:
+                seg.shm.close()
+            except BufferError:
+                pass  # còn frame trỏ vào segment; unlink vẫn được, mapping tự hết khi process thoát
+            try:
+                seg.shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def shm_ref(arr: np.ndarray) -> Optional[Tuple[str, int, Tuple[int, ...]]]:
+    """(tên segment, offset byte, strides) nếu arr nằm trọn trong 1 ShmFramePool của process này."""
+    if not _POOLS or arr.size == 0:
+        return None
+    addr = arr.__array_interface__["data"][0]
+    # Khoảng byte mà view chiếm (strides dương: view/crop của frame)
+    span = sum((n - 1) * s for n, s in zip(arr.shape, arr.strides)) + arr.itemsize
+    for pool in list(_POOLS):
+        hit = pool.locate(addr, span)
+        if hit is not None:
+            return hit[0], hit[1], arr.strides
+    return None
+
+
+class _UntrackedShm:
+    """
+    Attach segment POSIX có sẵn mà không đăng ký resource_tracker (tương đương track=False của 3.13).
+    Python < 3.13 đăng ký cả segment attach (bpo-39959): tracker của process đọc sẽ unlink segment
+    khi thoát, còn unregister sau attach lại xoá bản đăng ký của process tạo khi 2 bên dùng chung
+    tracker (process con spawn). Chỉ cần buf và close() như SharedMemory.
+    """
+
+    def __init__(self, name: str):
+        import _posixshmem  # type: ignore
+
+        self.name = name
+        self._fd = _posixshmem.shm_open("/" + name, os.O_RDWR, mode=0o600)
+        try:
+            self._mmap = mmap.mmap(self._fd, os.fstat(self._fd).st_size)
+        except OSError:
+            os.close(self._fd)
+            raise
+        self.buf = memoryview(self._mmap)
+        self.size = len(self.buf)
+
+    def close(self) -> None:
+        if self.buf is not None:
+            self.buf.release()  # BufferError nếu còn mảng trỏ vào, như SharedMemory.close()
+            self.buf = None
+        if self._mmap is not None:
+            self._mmap.close()
+            self._mmap = None
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+
+def _attach(name: str):
+    """Attach segment do process khác tạo mà không để resource_tracker của process này unlink nó."""
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    if sys.platform == "win32":
+        return shared_memory.SharedMemory(name=name)
+    return _UntrackedShm(name)
+
+
+class ShmAttachments:
+    """Segment đã attach phía đọc, theo tên; close() khi client ngắt kết nối."""
+
+    def __init__(self):
+        self._shm: Dict[str, "shared_memory.SharedMemory | _UntrackedShm"] = {}
+
+    def view(self, name: str, offset: int, shape: Tuple[int, ...], strides: Tuple[int, ...], dtype) -> np.ndarray:
+        shm = self._shm.get(name)
+        if shm is None:
+            shm = _attach(name)
+            self._shm[name] = shm
+        return np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset, strides=strides)
+
+    def close(self) -> None:
+        for shm in self._shm.values():
+            try:
+                shm.close()
+            except BufferError:
+                pass
+        self._shm = {}
+
+
+@atexit.register
+def close_pools() -> None:
+    """Dọn mọi ShmFramePool của process (atexit; process con multiprocessing thoát bằng os._exit nên phải tự gọi)."""
+    for pool in list(_POOLS):
+        pool.close()
@@ -0,0 +1,60 @@
+# ai/ingest/startup.py
+"""
+Đo thời gian khởi động theo từng phase (import, parse tham số, mở source, load + warmup model...).
+Các phase có thể chạy song song trên nhiều thread (model load trong lúc mở source), nên tổng các
+phase có thể lớn hơn thời gian tới frame đầu tiên.
+"""
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+
+class StartupTimer:
+    """
+    t0: mốc bắt đầu (perf_counter), mặc định là lúc tạo đối tượng; entry point truyền mốc lúc
+    module được import để tính cả thời gian import.
+    """
+
+    def __init__(self, t0: Optional[float] = None):
+        self.t0 = time.perf_counter() if t0 is None else t0
+        self._lock = threading.Lock()
+        self._phases: Dict[str, float] = {}
+        self.first_frame: Optional[float] = None
+        self.ready: Optional[float] = None
+
+    def record(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self._phases[name] = self._phases.get(name, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, name: str):
+        t = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t)
+
+    def mark_first_frame(self) -> None:
+        """Frame đầu tiên đọc được từ source."""
+        if self.first_frame is None:
+            self.first_frame = time.perf_counter() - self.t0
+
+    def mark_ready(self) -> bool:
+        """Frame đầu tiên đi hết pipeline; trả về True ở lần gọi đầu (để in báo cáo 1 lần)."""
+        if self.ready is not None:
+            return False
+        self.ready = time.perf_counter() - self.t0
+        return True
+
+    def phases(self) -> List[Tuple[str, float]]:
+        with self._lock:
+            out = list(self._phases.items())
+        if self.first_frame is not None:
+            out.append(("first_frame", self.first_frame))
+        if self.ready is not None:
+            out.append(("first_result", self.ready))
+        return out
+
+    def summary(self) -> str:
+        return " | ".join(f"{name}={sec:.2f}s" for name, sec in self.phases())
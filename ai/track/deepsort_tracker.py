@@ -2,6 +2,10 @@ from typing import List, Tuple
 
 import numpy as np
 
+from ai.detect.detections import det_arrays, det_names
+
+from .matching import iou_matrix, linear_assignment, warmup as _warmup_matching
+
 # Kiểu bbox từ detector: (x1,y1,x2,y2,conf,cls_id,cls_name)
 BBox = Tuple[int, int, int, int, float, int, str]
 
@@ -12,6 +16,13 @@ class DeepSortTracker:
 
     Input detections: List[(x1, y1, x2, y2, conf, cls_id, cls_name)]
     Output: List[(x1, y1, x2, y2, track_id, conf, cls_name)]
+
+    Embedding appearance được tính trong 1 lần gọi embedder.predict cho mọi crop của frame.
+    Cache embedding theo track: detection gần như đứng yên (IoU >= embed_cache_iou với bbox lúc
+    tính embedding) và entry chưa quá embed_refresh lần update thì dùng lại embedding cũ thay vì
+    chạy lại embedder. embed_cache_iou <= 0 tắt cache.
+
+    embedder="stub": StubEmbedder (lưới màu thu nhỏ, không torch/weights) cho chạy offline/profiling.
     """
 
     def __init__(
@@ -24,6 +35,9 @@ class DeepSortTracker:
         embedder: str = "mobilenet",
         embedder_gpu: bool = False,
         half: bool = False,
+        shared_embedder=None,
+        embed_cache_iou: float = 0.9,
+        embed_refresh: int = 10,
     ) -> None:
         try:
             from deep_sort_realtime.deepsort_tracker import DeepSort
@@ -32,6 +46,10 @@ class DeepSortTracker:
                 "deep-sort-realtime is required for DeepSortTracker. Install with 'pip install deep-sort-realtime'."
             ) from e
 
+        if embedder == "stub" and shared_embedder is None:
+            from .stub_embedder import StubEmbedder
+            shared_embedder = StubEmbedder()
+
         # Lazily import to avoid hard dependency when not used
         self._DeepSort = DeepSort
         self.tracker = self._DeepSort(
@@ -39,90 +57,157 @@ class DeepSortTracker:
             n_init=n_init,
             max_iou_distance=max_iou_distance,
             nms_max_overlap=nms_max_overlap,
-            embedder=embedder,
+            embedder=None if shared_embedder is not None else embedder,
             embedder_gpu=embedder_gpu,
             half=half,
             bgr=True,
         )
+        if shared_embedder is not None:
+            # Dùng chung embedder đã load (multi-camera) thay vì load thêm 1 bản model
+            self.tracker.embedder = shared_embedder
+        self.embedder = self.tracker.embedder
+        # Conf detection gần nhất theo track_id (dùng cho bbox dự đoán ở frame bỏ qua detect)
+        self._last_conf: dict[int, float] = {}
+        # Cache embedding theo track_id: (bbox xyxy lúc tính, embedding, số update lúc tính)
+        self.embed_cache_iou = embed_cache_iou
+        self.embed_refresh = max(1, embed_refresh)
+        self._embed_cache: dict[int, tuple] = {}
+        self._updates = 0
+        self.embed_hits = 0
+        self.embed_misses = 0
+
+    @property
+    def tracks_count(self) -> int:
+        return len(self.tracker.tracker.tracks)
+
+    def warmup(self) -> None:
+        """Chạy embedder 1 lần trên crop giả (load weights/khởi tạo kernel) trước frame đầu tiên."""
+        _warmup_matching()
+        self.embedder.predict([np.zeros((128, 64, 3), dtype=np.uint8)])
+
+    def embed_stats(self) -> str:
+        total = self.embed_hits + self.embed_misses
+        rate = 100.0 * self.embed_hits / total if total else 0.0
+        return f"embed_hits={self.embed_hits} | embed_misses={self.embed_misses} ({rate:.0f}% hit)"
+
+    def _embed(self, frame: np.ndarray, raw: list, boxes: np.ndarray) -> tuple:
+        """
+        Embedding cho các detection (đã lọc bbox rỗng): lấy từ cache nếu bbox gần như không đổi,
+        phần còn lại crop và chạy embedder 1 lần. Trả về (embeds, entry cache dùng lại theo detection).
+        """
+        embeds: list = [None] * len(raw)
+        reused: list = [None] * len(raw)
+        if self.embed_cache_iou > 0 and self._embed_cache:
+            entries = [
+                e for e in self._embed_cache.values() if self._updates - e[2] < self.embed_refresh
+            ]
+            if entries:
+                cached = np.array([e[0] for e in entries], dtype=np.float64)
+                matches, _, _ = linear_assignment(
+                    1.0 - iou_matrix(boxes, cached), 1.0 - self.embed_cache_iou
+                )
+                for di, ej in matches:
+                    embeds[di] = entries[ej][1]
+                    reused[di] = entries[ej]
+        miss = [i for i, e in enumerate(embeds) if e is None]
+        if miss:
+            crops, _ = self.tracker.crop_bb(frame, [raw[i] for i in miss])
+            for i, e in zip(miss, self.embedder.predict(crops)):
+                embeds[i] = e
+        self.embed_misses += len(miss)
+        self.embed_hits += len(raw) - len(miss)
+        return embeds, reused
 
     def update(self, detections: List[BBox], frame: np.ndarray | None = None) -> List[Tuple[int, int, int, int, int, float, str]]:
-        # Convert xyxy detections to DeepSORT expected ltwh
-        raw = []
-        for x1, y1, x2, y2, conf, _cls_id, cls_name in detections:
-            w = max(0, int(x2 - x1))
-            h = max(0, int(y2 - y1))
-            raw.append(([int(x1), int(y1), w, h], float(conf), str(cls_name)))
-
-        # Update the underlying DeepSort tracker
-        tracks = self.tracker.update_tracks(raw, frame=frame)
-
-        # Build an alignment from detections -> track_id by IoU with original det bboxes
-        def iou(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> float:
-            ax1, ay1, ax2, ay2 = a
-            bx1, by1, bx2, by2 = b
-            ix1 = max(ax1, bx1)
-            iy1 = max(ay1, by1)
-            ix2 = min(ax2, bx2)
-            iy2 = min(ay2, by2)
-            iw = max(0, ix2 - ix1)
-            ih = max(0, iy2 - iy1)
-            inter = iw * ih
-            if inter <= 0:
-                return 0.0
-            area_a = max(0, ax2 - ax1) * max(0, ay2 - ay1)
-            area_b = max(0, bx2 - bx1) * max(0, by2 - by1)
-            union = area_a + area_b - inter
-            if union <= 0:
-                return 0.0
-            return inter / union
-
-        det_xyxy = [
-            (int(x1), int(y1), int(x2), int(y2)) for (x1, y1, x2, y2, _c, _id, _n) in detections
-        ]
-
-        # For current frame, many tracks may be unconfirmed; only consider confirmed tracks with an original bbox
-        candidates: list[tuple[int, Tuple[int, int, int, int], str, float]] = []
+        # Convert xyxy detections to DeepSORT expected ltwh. Bbox rỗng bị DeepSORT lọc bỏ và làm lệch
+        # chỉ số `others`, nên lọc trước và giữ chỉ số gốc của detection trong `others`.
+        all_boxes, all_conf, _ = det_arrays(detections)
+        names = det_names(detections)
+        ltwh = np.concatenate([all_boxes[:, :2], all_boxes[:, 2:] - all_boxes[:, :2]], axis=1).astype(np.int64)
+        idx = np.flatnonzero((ltwh[:, 2] > 0) & (ltwh[:, 3] > 0)).tolist()
+        raw = [(ltwh[i].tolist(), float(all_conf[i]), str(names[i])) for i in idx]
+
+        # Embedding tính 1 lần theo lô (kèm cache), rồi update DeepSORT với embeds có sẵn
+        self._updates += 1
+        boxes = all_boxes[idx].reshape(-1, 4)
+        embeds, reused = self._embed(frame, raw, boxes) if raw else ([], [])
+        tracks = self.tracker.update_tracks(raw, embeds=embeds, frame=frame, others=idx)
+        self._refresh_cache(tracks, idx, boxes, embeds, reused)
+
+        # Track được match ở frame này giữ chỉ số detection gốc (others) -> lấy track_id trực tiếp,
+        # không cần ghép lại theo IoU. Chỉ track đã xác nhận mới có ID.
+        assigned = [-1] * len(detections)
+        unresolved = []
         for t in tracks:
-            if hasattr(t, "is_confirmed") and not t.is_confirmed():
-                continue
-            # Prefer original detection bbox for this frame to align back to dets
-            orig = None
-            if hasattr(t, "to_ltrb"):
-                orig = t.to_ltrb(orig=True, orig_strict=True)
-            if orig is None and hasattr(t, "to_tlbr"):
-                orig = t.to_tlbr()
-            if orig is None:
+            if not t.is_confirmed() or t.time_since_update > 0:
                 continue
-            l, t_, r, b = [int(v) for v in orig]
-            tid = int(getattr(t, "track_id", -1))
-            cls_name = str(getattr(t, "det_class", None) or "object")
-            conf = float(getattr(t, "det_conf", 1.0) or 1.0)
-            candidates.append((tid, (l, t_, r, b), cls_name, conf))
-
-        # Map each detection to best matching track by IoU
-        assigned = [-1] * len(det_xyxy)
-        assigned_meta: list[tuple[str, float]] = [("object", 1.0)] * len(det_xyxy)
-        for i, dbox in enumerate(det_xyxy):
-            best_iou = 0.0
-            best_tid = -1
-            best_meta = ("object", 1.0)
-            for tid, tbox, cname, cconf in candidates:
-                v = iou(dbox, tbox)
-                if v > best_iou:
-                    best_iou = v
-                    best_tid = tid
-                    best_meta = (cname, cconf)
-            # Consider a valid match only if IoU is reasonably high
-            if best_iou >= 0.5 and best_tid > 0:
-                assigned[i] = best_tid
-                assigned_meta[i] = best_meta
+            di = t.get_det_supplementary()
+            if di is None:
+                unresolved.append(t)
+            elif assigned[di] == -1:
+                assigned[di] = int(t.track_id)
+        if unresolved:
+            self._align_by_iou(detections, unresolved, assigned)
 
         # Return list aligned with detections length for downstream emitter
         aligned: List[Tuple[int, int, int, int, int, float, str]] = []
-        for (x1, y1, x2, y2, conf, _cls_id, cls_name), tid, meta in zip(detections, assigned, assigned_meta):
-            cname, tconf = meta
-            # Keep the original det class name if present
-            out_name = cls_name or cname
-            track_id = int(tid) if tid is not None else -1
-            aligned.append((int(x1), int(y1), int(x2), int(y2), track_id, float(conf if conf is not None else tconf), str(out_name)))
+        for (x1, y1, x2, y2), conf, cls_name, track_id in zip(all_boxes.tolist(), all_conf.tolist(), names, assigned):
+            aligned.append((int(x1), int(y1), int(x2), int(y2), track_id, conf, str(cls_name or "object")))
+            if track_id > 0:
+                self._last_conf[track_id] = conf
         return aligned
+
+    def _refresh_cache(self, tracks, idx: List[int], boxes: np.ndarray, embeds: list, reused: list) -> None:
+        """Gắn embedding của frame này vào track vừa được match; bỏ entry của track đã bị xoá."""
+        if self.embed_cache_iou <= 0:
+            return
+        pos = {d: k for k, d in enumerate(idx)}
+        cache = {}
+        for t in tracks:
+            tid = int(t.track_id)
+            k = pos.get(t.get_det_supplementary()) if t.time_since_update == 0 else None
+            if k is None:
+                if tid in self._embed_cache:
+                    cache[tid] = self._embed_cache[tid]
+            elif reused[k] is not None:
+                # Giữ bbox/thời điểm gốc để drift tích luỹ vẫn buộc tính lại
+                cache[tid] = reused[k]
+            else:
+                cache[tid] = (boxes[k], embeds[k], self._updates)
+        self._embed_cache = cache
+
+    @staticmethod
+    def _align_by_iou(detections: List[BBox], tracks, assigned: List[int], min_iou: float = 0.5) -> None:
+        """Dự phòng khi track không mang chỉ số detection: IoU vector hoá + gán tối ưu."""
+        free = [i for i, tid in enumerate(assigned) if tid == -1]
+        if not free:
+            return
+        det_xyxy = np.array([detections[i][:4] for i in free], dtype=np.float64)
+        trk_xyxy = np.array([t.to_ltrb(orig=True) for t in tracks], dtype=np.float64)
+        matches, _, _ = linear_assignment(1.0 - iou_matrix(det_xyxy, trk_xyxy), 1.0 - min_iou)
+        for di, tj in matches:
+            assigned[free[di]] = int(tracks[tj].track_id)
+
+    def predict(self, frame: np.ndarray | None = None) -> List[Tuple[int, int, int, int, int, float, str]]:
+        """
+        Frame không chạy detector: chỉ ngoại suy Kalman (mean/covariance) cho mọi track và trả về
+        bbox dự đoán của các track đã xác nhận được match ở lần detect gần nhất.
+
+        Không gọi update_tracks([]) / Track.predict vì cả hai tăng time_since_update: track tentative
+        bị xoá, còn iou_cost của DeepSORT bỏ qua mọi track có time_since_update > 1, nên khi detect
+        thưa track mới không bao giờ đủ n_init. Vì vậy max_age được tính theo số lần detect.
+        """
+        inner = self.tracker.tracker
+        out: List[Tuple[int, int, int, int, int, float, str]] = []
+        for t in inner.tracks:
+            t.mean, t.covariance = inner.kf.predict(t.mean, t.covariance)
+            if not t.is_confirmed() or t.time_since_update > 0:
+                continue
+            l, t_, r, b = [int(v) for v in t.to_ltrb()]
+            tid = int(t.track_id)
+            cls_name = str(getattr(t, "det_class", None) or "object")
+            out.append((l, t_, r, b, tid, self._last_conf.get(tid, 0.0), cls_name))
+        # Giới hạn cache theo các track còn sống
+        live_ids = {int(t.track_id) for t in inner.tracks}
+        self._last_conf = {k: v for k, v in self._last_conf.items() if k in live_ids}
+        return out
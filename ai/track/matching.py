@@ -0,0 +1,115 @@
+# ai/track/matching.py
+"""
+Tiện ích ghép cặp dùng chung cho các tracker: ma trận IoU vector hoá và gán tối ưu.
+
+Gán tối ưu dùng scipy.optimize.linear_sum_assignment nếu đã cài; không có scipy thì dùng Hungarian
+thuần NumPy bên dưới (cùng kết quả tối ưu, đủ nhanh cho vài chục track/detection mỗi frame) nên
+SORT/ByteTrack chạy được chỉ với NumPy.
+"""
+from typing import List, Tuple
+
+import numpy as np
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    IoU giữa từng cặp bbox xyxy: a (N,4), b (M,4) -> (N,M).
+    Tính bằng broadcast NumPy, không có vòng lặp Python.
+    """
+    a = np.asarray(a, dtype=np.float64).reshape(-1, 4)
+    b = np.asarray(b, dtype=np.float64).reshape(-1, 4)
+    if not len(a) or not len(b):
+        return np.zeros((len(a), len(b)), dtype=np.float64)
+    ix1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    iy1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    ix2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    iy2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(ix2 - ix1, 0, None) * np.clip(iy2 - iy1, 0, None)
+    area_a = np.clip(a[:, 2] - a[:, 0], 0, None) * np.clip(a[:, 3] - a[:, 1], 0, None)
+    area_b = np.clip(b[:, 2] - b[:, 0], 0, None) * np.clip(b[:, 3] - b[:, 1], 0, None)
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+_SOLVER = None
+
+
+def _hungarian(cost: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Hungarian (thế vị u/v, đường tăng ngắn nhất) O(n^2 m) thuần NumPy; trả về (rows, cols) như
+    linear_sum_assignment: mỗi hàng/cột ghép tối đa 1 lần, tổng cost nhỏ nhất.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    if cost.shape[0] > cost.shape[1]:
+        cols, rows = _hungarian(cost.T)
+        order = np.argsort(rows)
+        return rows[order], cols[order]
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    p = np.zeros(m + 1, dtype=np.int64)  # p[j]: hàng (1-based) đang giữ cột j, 0 = cột trống
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            free = np.flatnonzero(~used[1:]) + 1
+            cur = cost[i0 - 1, free - 1] - u[i0] - v[free]
+            better = cur < minv[free]
+            minv[free[better]] = cur[better]
+            way[free[better]] = j0
+            k = int(np.argmin(minv[free]))
+            j1 = int(free[k])
+            delta = minv[j1]
+            done = np.flatnonzero(used)
+            u[p[done]] += delta
+            v[done] -= delta
+            minv[free] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        # Đảo đường tăng
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    cols = np.flatnonzero(p[1:])
+    rows = p[cols + 1] - 1
+    order = np.argsort(rows)
+    return rows[order], cols[order]
+
+
+def _solver():
+    """linear_sum_assignment của scipy nếu có, không thì Hungarian NumPy (chọn 1 lần)."""
+    global _SOLVER
+    if _SOLVER is None:
+        try:
+            from scipy.optimize import linear_sum_assignment
+            _SOLVER = linear_sum_assignment
+        except ImportError:
+            _SOLVER = _hungarian
+    return _SOLVER
+
+
+def warmup() -> None:
+    """Import trước scipy.optimize (~0.3-0.5s) để frame đầu tiên có match không bị trễ."""
+    _solver()
+
+
+def linear_assignment(cost: np.ndarray, max_cost: float) -> Tuple[List[Tuple[int, int]], List[int], List[int]]:
+    """
+    Gán tối ưu (Hungarian: scipy, hoặc NumPy nếu không có scipy) trên ma trận cost (N,M); bỏ cặp có cost > max_cost.
+    Trả về (matches [(i,j)], unmatched_rows, unmatched_cols).
+    """
+    n, m = cost.shape
+    if n == 0 or m == 0:
+        return [], list(range(n)), list(range(m))
+    rows, cols = _solver()(cost)
+    matches = [(int(i), int(j)) for i, j in zip(rows, cols) if cost[i, j] <= max_cost]
+    mr = {i for i, _ in matches}
+    mc = {j for _, j in matches}
+    return matches, [i for i in range(n) if i not in mr], [j for j in range(m) if j not in mc]
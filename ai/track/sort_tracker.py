@@ -0,0 +1,217 @@
+# ai/track/sort_tracker.py
+from typing import List, Tuple
+
+import numpy as np
+
+from ai.detect.detections import det_arrays, det_names
+
+from .matching import iou_matrix, linear_assignment, warmup as _warmup_matching
+
+# Kiểu bbox từ detector: (x1,y1,x2,y2,conf,cls_id,cls_name)
+BBox = Tuple[int, int, int, int, float, int, str]
+
+# Nhiễu Kalman theo chiều cao bbox (cùng giá trị với DeepSORT)
+_STD_POS = 1.0 / 20
+_STD_VEL = 1.0 / 160
+
+_F = np.eye(8)
+_F[:4, 4:] = np.eye(4)
+_H = np.eye(4, 8)
+
+
+def _xyxy_to_xyah(b: np.ndarray) -> np.ndarray:
+    w = b[:, 2] - b[:, 0]
+    h = np.maximum(b[:, 3] - b[:, 1], 1e-6)
+    return np.stack([b[:, 0] + w / 2, b[:, 1] + h / 2, w / h, h], axis=1)
+
+
+def _xyah_to_xyxy(m: np.ndarray) -> np.ndarray:
+    h = m[:, 3]
+    w = m[:, 2] * h
+    return np.stack([m[:, 0] - w / 2, m[:, 1] - h / 2, m[:, 0] + w / 2, m[:, 1] + h / 2], axis=1)
+
+
+class SortTracker:
+    """
+    Tracker chỉ dựa trên chuyển động (Kalman + IoU), không có embedder appearance.
+
+    - mode="sort"     : 1 vòng ghép IoU (Hungarian) giữa track dự đoán và mọi detection.
+    - mode="bytetrack": 2 vòng như ByteTrack: detection conf >= high_thresh ghép trước với mọi track,
+                        track còn lại ghép tiếp với detection conf thấp [low_thresh, high_thresh);
+                        chỉ detection conf cao mới tạo track mới.
+
+    Cùng giao diện với DeepSortTracker:
+    Input detections: List[(x1, y1, x2, y2, conf, cls_id, cls_name)]
+    Output: List[(x1, y1, x2, y2, track_id, conf, cls_name)] cùng thứ tự detections
+    (track_id = -1 nếu chưa xác nhận hoặc không ghép được).
+
+    Kalman của mọi track được tính theo lô (mảng (N,8) / (N,8,8)), không lặp Python theo track.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_age: int = 30,
+        n_init: int = 3,
+        max_iou_distance: float = 0.7,
+        mode: str = "sort",
+        high_thresh: float = 0.5,
+        low_thresh: float = 0.1,
+    ) -> None:
+        self.max_age = max_age
+        self.n_init = n_init
+        self.max_iou_distance = max_iou_distance
+        self.mode = mode
+        self.high_thresh = high_thresh
+        self.low_thresh = low_thresh
+        # Không có embedder appearance (multi-camera dùng để chia sẻ embedder)
+        self.embedder = None
+        self._next_id = 1
+        # Trạng thái track dạng mảng song song
+        self._mean = np.zeros((0, 8))
+        self._cov = np.zeros((0, 8, 8))
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._hits = np.zeros(0, dtype=np.int64)
+        self._tsu = np.zeros(0, dtype=np.int64)  # time_since_update (tính theo số lần update)
+        self._conf = np.zeros(0)
+        self._cls: List[str] = []
+
+    @property
+    def tracks_count(self) -> int:
+        return len(self._ids)
+
+    def warmup(self) -> None:
+        _warmup_matching()
+
+    def _kf_predict(self) -> None:
+        if not len(self._ids):
+            return
+        h = self._mean[:, 3]
+        std = np.stack(
+            [_STD_POS * h, _STD_POS * h, np.full_like(h, 1e-2), _STD_POS * h,
+             _STD_VEL * h, _STD_VEL * h, np.full_like(h, 1e-5), _STD_VEL * h],
+            axis=1,
+        )
+        q = np.zeros_like(self._cov)
+        q[:, np.arange(8), np.arange(8)] = std ** 2
+        self._mean = self._mean @ _F.T
+        self._cov = _F @ self._cov @ _F.T + q
+
+    def _kf_update(self, rows: np.ndarray, z: np.ndarray) -> None:
+        mean, cov = self._mean[rows], self._cov[rows]
+        h = mean[:, 3]
+        r = np.zeros((len(rows), 4, 4))
+        r[:, np.arange(4), np.arange(4)] = np.stack(
+            [_STD_POS * h, _STD_POS * h, np.full_like(h, 1e-1), _STD_POS * h], axis=1
+        ) ** 2
+        s = _H @ cov @ _H.T + r                          # (n,4,4)
+        pht = cov @ _H.T                                 # (n,8,4)
+        gain = np.linalg.solve(s, pht.transpose(0, 2, 1)).transpose(0, 2, 1)  # (n,8,4)
+        innov = z - mean @ _H.T
+        self._mean[rows] = mean + np.einsum("nij,nj->ni", gain, innov)
+        self._cov[rows] = cov - gain @ s @ gain.transpose(0, 2, 1)
+
+    def _initiate(self, boxes: np.ndarray, conf: np.ndarray, cls: List[str]) -> None:
+        z = _xyxy_to_xyah(boxes)
+        h = z[:, 3]
+        mean = np.concatenate([z, np.zeros_like(z)], axis=1)
+        std = np.stack(
+            [2 * _STD_POS * h, 2 * _STD_POS * h, np.full_like(h, 1e-2), 2 * _STD_POS * h,
+             10 * _STD_VEL * h, 10 * _STD_VEL * h, np.full_like(h, 1e-5), 10 * _STD_VEL * h],
+            axis=1,
+        )
+        cov = np.zeros((len(z), 8, 8))
+        cov[:, np.arange(8), np.arange(8)] = std ** 2
+        n = len(z)
+        self._mean = np.concatenate([self._mean, mean])
+        self._cov = np.concatenate([self._cov, cov])
+        self._ids = np.concatenate([self._ids, np.arange(self._next_id, self._next_id + n)])
+        self._next_id += n
+        self._hits = np.concatenate([self._hits, np.ones(n, dtype=np.int64)])
+        self._tsu = np.concatenate([self._tsu, np.zeros(n, dtype=np.int64)])
+        self._conf = np.concatenate([self._conf, conf])
+        self._cls += cls
+
+    def _match(self, track_rows: np.ndarray, det_rows: np.ndarray, boxes: np.ndarray, max_dist: float):
+        if not len(track_rows) or not len(det_rows):
+            return [], list(track_rows), list(det_rows)
+        pred = _xyah_to_xyxy(self._mean[track_rows])
+        cost = 1.0 - iou_matrix(pred, boxes[det_rows])
+        matches, ut, ud = linear_assignment(cost, max_dist)
+        return (
+            [(track_rows[i], det_rows[j]) for i, j in matches],
+            [track_rows[i] for i in ut],
+            [det_rows[j] for j in ud],
+        )
+
+    def update(self, detections: List[BBox], frame: np.ndarray | None = None) -> List[Tuple[int, int, int, int, int, float, str]]:
+        n = len(detections)
+        boxes, conf, _ = det_arrays(detections)
+        names = det_names(detections)
+        valid = (boxes[:, 2] > boxes[:, 0]) & (boxes[:, 3] > boxes[:, 1])
+
+        self._kf_predict()
+        all_tracks = np.arange(len(self._ids))
+        if self.mode == "bytetrack":
+            high = np.flatnonzero(valid & (conf >= self.high_thresh))
+            low = np.flatnonzero(valid & (conf >= self.low_thresh) & (conf < self.high_thresh))
+            matches, rest, new = self._match(all_tracks, high, boxes, self.max_iou_distance)
+            # Vòng 2: detection conf thấp chỉ dùng để giữ track đang có (ngưỡng IoU chặt hơn)
+            m2, _, _ = self._match(np.asarray(rest, dtype=np.int64), low, boxes, min(self.max_iou_distance, 0.5))
+            matches += m2
+        else:
+            matches, _, new = self._match(all_tracks, np.flatnonzero(valid), boxes, self.max_iou_distance)
+
+        assigned = [-1] * n
+        matched = np.zeros(len(self._ids), dtype=bool)
+        if matches:
+            rows = np.array([t for t, _ in matches], dtype=np.int64)
+            dets = np.array([d for _, d in matches], dtype=np.int64)
+            self._kf_update(rows, _xyxy_to_xyah(boxes[dets]))
+            self._hits[rows] += 1
+            self._tsu[rows] = 0
+            self._conf[rows] = conf[dets]
+            for r, d in zip(rows, dets):
+                self._cls[r] = str(names[d])
+            matched[rows] = True
+        self._tsu[~matched] += 1
+
+        # Xoá track: tentative bị lỡ 1 lần, hoặc đã quá max_age lần update không ghép được
+        confirmed = self._hits >= self.n_init
+        keep = np.where(confirmed, self._tsu <= self.max_age, self._tsu == 0)
+        if matches:
+            for r, d in matches:
+                if keep[r] and confirmed[r]:
+                    assigned[d] = int(self._ids[r])
+        if not keep.all():
+            idx = np.flatnonzero(keep)
+            self._mean, self._cov = self._mean[idx], self._cov[idx]
+            self._ids, self._hits, self._tsu, self._conf = self._ids[idx], self._hits[idx], self._tsu[idx], self._conf[idx]
+            self._cls = [self._cls[i] for i in idx]
+
+        if new:
+            new = np.asarray(new, dtype=np.int64)
+            self._initiate(boxes[new], conf[new], [str(names[d]) for d in new])
+            if self.n_init <= 1:
+                for k, d in enumerate(new):
+                    assigned[d] = int(self._ids[len(self._ids) - len(new) + k])
+
+        return [
+            (int(x1), int(y1), int(x2), int(y2), tid, float(c), str(cls_name or "object"))
+            for (x1, y1, x2, y2), c, cls_name, tid in zip(boxes.tolist(), conf.tolist(), names, assigned)
+        ]
+
+    def predict(self, frame: np.ndarray | None = None) -> List[Tuple[int, int, int, int, int, float, str]]:
+        """
+        Frame không chạy detector: ngoại suy Kalman cho mọi track, trả về bbox dự đoán của các track
+        đã xác nhận được ghép ở lần update gần nhất (time_since_update không tăng, như DeepSortTracker).
+        """
+        self._kf_predict()
+        out: List[Tuple[int, int, int, int, int, float, str]] = []
+        live = np.flatnonzero((self._hits >= self.n_init) & (self._tsu == 0))
+        if not len(live):
+            return out
+        boxes = _xyah_to_xyxy(self._mean[live])
+        for i, (l, t, r, b) in zip(live, boxes):
+            out.append((int(l), int(t), int(r), int(b), int(self._ids[i]), float(self._conf[i]), self._cls[i]))
+        return out
@@ -0,0 +1,40 @@
+# ai/track/stub_embedder.py
+"""
+Embedder appearance thay cho mobilenet/torchreid khi chạy offline (--track_embedder stub):
+không torch, không tải weights, kết quả xác định. Dùng để test/profiling DeepSORT, không dùng cho production.
+"""
+from typing import List
+
+import cv2
+import numpy as np
+
+
+class StubEmbedder:
+    """
+    Embedding = ảnh crop thu nhỏ về lưới màu grid_w x grid_h (BGR), trừ trung bình, chuẩn hoá L2.
+    Cùng interface predict(crops) với embedder của deep-sort-realtime; cosine distance vẫn có nghĩa
+    (đối tượng khác màu/khác hình dạng cho embedding khác nhau).
+    """
+
+    def __init__(self, grid_w: int = 4, grid_h: int = 8):
+        self.size = (grid_w, grid_h)
+        self.dim = grid_w * grid_h * 3
+
+    def predict(self, crops: List[np.ndarray]) -> List[np.ndarray]:
+        out = []
+        for crop in crops:
+            if crop is None or crop.size == 0:
+                v = np.zeros(self.dim, dtype=np.float32)
+                v[0] = 1.0
+                out.append(v)
+                continue
+            v = cv2.resize(crop, self.size, interpolation=cv2.INTER_AREA).astype(np.float32).reshape(-1)
+            v -= v.mean()
+            n = float(np.linalg.norm(v))
+            if n < 1e-6:
+                v = np.zeros(self.dim, dtype=np.float32)
+                v[0] = 1.0
+            else:
+                v /= n
+            out.append(v)
+        return out
@@ -1,44 +1,449 @@
-import argparse
+"""
+Phân tích NDJSON detection (schema full hoặc compact, nhiều file, kể cả segment .gz/.zst đã xoay).
+
+- File lớn được chia chunk theo byte và parse song song trên nhiều process; kết quả từng chunk
+  là aggregate gộp được (merge), nên bộ nhớ chỉ tăng theo số track/số phút, không theo số dòng.
+- Báo cáo: số frame, ID duy nhất, đếm class (như bản cũ) + vòng đời từng track, ước lượng
+  fragmentation/ID switch, thời gian lưu lại (dwell) theo camera, occupancy theo phút.
+
+Ví dụ:
+    python scripts/analyze_ndjson.py out/*.ndjson out/*.ndjson.gz --workers 8 --json report.json
+"""
+import os
+import io
+import sys
+import glob
+import gzip
 import json
+import argparse
+from bisect import bisect_left
 from collections import Counter, defaultdict
+from datetime import datetime
+from multiprocessing import Pool
 
+try:
+    import orjson  # type: ignore
+    _loads = orjson.loads
+except ImportError:
+    _loads = json.loads
 
-def analyze(path: str):
-    ids = set()
-    per_class_ids = defaultdict(set)
-    frames = 0
-    missing = 0
-    cls_counter = Counter()
-    with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-        for line in f:
-            line = line.strip()
+# Trạng thái track: [first_frame, last_frame, first_ts, last_ts, n, segments, first_xyh, last_xyh, classes]
+# segments: các khoảng frame [start, end] liên tục (cách nhau > gap frame) -> fragments = len - 1
+# classes: tập mọi class track_id mang (gộp bằng hợp), để đếm class_unique_ids như bản cũ
+FIRST, LAST, FIRST_TS, LAST_TS, N, SEGS, FIRST_BOX, LAST_BOX, CLS = range(9)
+
+
+class Agg:
+    """Aggregate gộp được của 1 hoặc nhiều chunk."""
+
+    def __init__(self):
+        self.frames = 0
+        self.missing = 0
+        self.cls_counter = Counter()
+        self.pred_frames = 0
+        self.pred_cls_counter = Counter()       # detection của frame predicted (bbox Kalman, không phải detect thật)
+        self.tracks = {}                        # (stream_key, track_id) -> trạng thái track
+        self.occupancy = {}                     # (stream_key, 'YYYY-mm-ddTHH:MM') -> [frames, {class: dets}, {class: max}]
+        self.stream_names = {}                  # khoá compact (file, stream) -> tên camera
+        self.errors = 0
+
+    def merge(self, other: 'Agg', gap: int) -> None:
+        self.frames += other.frames
+        self.missing += other.missing
+        self.errors += other.errors
+        self.cls_counter.update(other.cls_counter)
+        self.pred_frames += other.pred_frames
+        self.pred_cls_counter.update(other.pred_cls_counter)
+        for k, v in other.stream_names.items():
+            if len(k) == 3:
+                # Bảng tên class: hợp các bản ghi 'classes' (chunk có thể tới không theo thứ tự)
+                self.stream_names.setdefault(k, {}).update(v)
+            else:
+                self.stream_names[k] = v
+        for k, t in other.tracks.items():
+            cur = self.tracks.get(k)
+            self.tracks[k] = t if cur is None else _merge_track(cur, t, gap)
+        for k, o in other.occupancy.items():
+            cur = self.occupancy.get(k)
+            if cur is None:
+                self.occupancy[k] = o
+            else:
+                _merge_occ(cur, o)
+
+
+def _merge_occ(cur, o) -> None:
+    cur[0] += o[0]
+    for c, n in o[1].items():
+        cur[1][c] = cur[1].get(c, 0) + n
+    for c, n in o[2].items():
+        cur[2][c] = max(cur[2].get(c, 0), n)
+
+
+def _merge_segments(segs, gap: int):
+    out = []
+    for s, e in sorted(segs):
+        if out and s - out[-1][1] <= gap:
+            out[-1][1] = max(out[-1][1], e)
+        else:
+            out.append([s, e])
+    return out
+
+
+def _merge_track(a, b, gap: int):
+    """Gộp 2 phần của cùng 1 track (không phụ thuộc thứ tự chunk)."""
+    if b[FIRST] < a[FIRST]:
+        a, b = b, a
+    out = list(a)
+    out[N] = a[N] + b[N]
+    out[CLS] = a[CLS] | b[CLS]
+    out[SEGS] = _merge_segments(a[SEGS] + b[SEGS], gap)
+    if b[LAST] > a[LAST]:
+        out[LAST], out[LAST_TS], out[LAST_BOX] = b[LAST], b[LAST_TS], b[LAST_BOX]
+    return out
+
+
+def _observe(agg: Agg, skey, frame, ts, dets, gap: int, predicted: bool = False) -> None:
+    """
+    dets: list (class, track_id, x1, y1, x2, y2) của 1 frame.
+    predicted: frame không chạy detector -> không cộng vào class_counts (đếm riêng), vẫn dùng cho
+    vòng đời track và occupancy (vật vẫn ở đó, bbox là dự đoán Kalman).
+    """
+    agg.frames += 1
+    counter = agg.cls_counter
+    if predicted:
+        agg.pred_frames += 1
+        counter = agg.pred_cls_counter
+    occ = Counter()
+    for cls, tid, x1, y1, x2, y2 in dets:
+        if cls is not None:
+            counter[cls] += 1
+            occ[cls] += 1
+        if tid is None:
+            agg.missing += 1
+            continue
+        box = ((x1 + x2) / 2.0, (y1 + y2) / 2.0, float(y2 - y1))
+        k = (skey, tid)
+        t = agg.tracks.get(k)
+        if t is None:
+            agg.tracks[k] = [frame, frame, ts, ts, 1, [[frame, frame]], box, box, {cls} if cls is not None else set()]
+            continue
+        if cls is not None:
+            t[CLS].add(cls)
+        if frame - t[LAST] > gap:
+            t[SEGS].append([frame, frame])
+        else:
+            t[SEGS][-1][1] = frame
+        t[LAST], t[LAST_TS], t[LAST_BOX] = frame, ts, box
+        t[N] += 1
+    if ts:
+        o = agg.occupancy.get((skey, ts[:16]))
+        if o is None:
+            agg.occupancy[(skey, ts[:16])] = [1, dict(occ), dict(occ)]
+        else:
+            _merge_occ(o, [1, occ, occ])
+
+
+def _iter_lines(path: str, start: int, end: int):
+    if path.endswith('.gz'):
+        with gzip.open(path, 'rb') as f:
+            yield from f
+        return
+    if path.endswith('.zst'):
+        import zstandard  # type: ignore
+        with open(path, 'rb') as raw:
+            yield from io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(raw))
+        return
+    with open(path, 'rb') as f:
+        if start > 0:
+            # Dòng thuộc chunk chứa byte đầu tiên của nó: bỏ phần dòng dở của chunk trước
+            f.seek(start - 1)
+            f.readline()
+        while True:
+            if end >= 0 and f.tell() >= end:
+                break
+            line = f.readline()
             if not line:
+                break
+            yield line
+
+
+def scan_chunk(task) -> Agg:
+    path, start, end, gap = task
+    agg = Agg()
+    for line in _iter_lines(path, start, end):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = _loads(line)
+        except ValueError:
+            agg.errors += 1
+            continue
+        rec = obj.get('record')
+        if rec is None:
+            src = obj.get('source') or {}
+            skey = (obj.get('pipeline_run_id'), src.get('store_id'), src.get('camera_id'), src.get('stream_id'))
+            dets = [
+                (d.get('class'), d.get('track_id'), d['bbox']['x1'], d['bbox']['y1'], d['bbox']['x2'], d['bbox']['y2'])
+                for d in obj.get('detections', [])
+            ]
+            _observe(agg, skey, obj.get('frame_index', 0), obj.get('capture_ts'), dets, gap, bool(obj.get('predicted')))
+        elif rec == 'run':
+            src = obj.get('source') or {}
+            agg.stream_names[(path, obj['stream'])] = (
+                obj.get('pipeline_run_id'), src.get('store_id'), src.get('camera_id'), src.get('stream_id')
+            )
+        elif rec == 'classes':
+            agg.stream_names[(path, obj['stream'], 'classes')] = obj.get('names', {})
+        elif rec == 'frame':
+            # Schema compact: tên class được gán sau khi gộp (bản ghi 'classes' có thể nằm ở chunk khác)
+            skey = ('@', path, obj['stream'])
+            tids = obj.get('track_id') or [None] * len(obj.get('bbox', []))
+            dets = [
+                ('#%d' % c, tid, b[0], b[1], b[2], b[3])
+                for c, tid, b in zip(obj.get('class_id', []), tids, obj.get('bbox', []))
+            ]
+            _observe(agg, skey, obj.get('frame_index', 0), obj.get('capture_ts'), dets, gap, bool(obj.get('predicted')))
+    return agg
+
+
+def plan_chunks(paths, chunk_bytes: int, gap: int):
+    tasks = []
+    for p in paths:
+        if p.endswith(('.gz', '.zst')):
+            tasks.append((p, 0, -1, gap))
+            continue
+        size = os.path.getsize(p)
+        start = 0
+        while start < size:
+            end = min(size, start + chunk_bytes)
+            tasks.append((p, start, end, gap))
+            start = end
+    return tasks
+
+
+def _resolve_compact(agg: Agg, gap: int) -> None:
+    """Đổi khoá stream/tên class tạm của schema compact sang giá trị thật."""
+    names = {}
+    classes = {}
+    for k, v in agg.stream_names.items():
+        if len(k) == 3:
+            classes.setdefault((k[0], k[1]), {}).update(v)
+        else:
+            names[k] = v
+
+    def real_key(skey):
+        if skey and skey[0] == '@':
+            return names.get((skey[1], skey[2]), (None, None, f'{os.path.basename(skey[1])}#{skey[2]}', None))
+        return skey
+
+    def real_cls(skey, cls):
+        if skey and skey[0] == '@' and cls and cls.startswith('#'):
+            return classes.get((skey[1], skey[2]), {}).get(cls[1:], cls)
+        return cls
+
+    if not any(k[0] == '@' for k, _ in agg.tracks) and not any(k[0][0] == '@' for k in agg.occupancy):
+        return
+    # Đổi tên class trong bộ đếm: class tạm '#id' -> tên (nếu mọi file cùng bảng tên)
+    all_names = {}
+    for v in classes.values():
+        all_names.update(v)
+    def renamed(counts):
+        counter = Counter()
+        for c, n in counts.items():
+            counter[all_names.get(c[1:], c) if c.startswith('#') else c] += n
+        return counter
+
+    agg.cls_counter = renamed(agg.cls_counter)
+    agg.pred_cls_counter = renamed(agg.pred_cls_counter)
+
+    # Segment đã xoay của cùng 1 stream là các file khác nhau -> gộp track cùng camera
+    tracks = {}
+    for (skey, tid), t in agg.tracks.items():
+        t[CLS] = {real_cls(skey, c) for c in t[CLS]}
+        k = (real_key(skey), tid)
+        tracks[k] = t if k not in tracks else _merge_track(tracks[k], t, gap)
+    agg.tracks = tracks
+    occ = {}
+    for (skey, minute), (frames, dets, peak) in agg.occupancy.items():
+        o = [frames, {real_cls(skey, c): n for c, n in dets.items()}, {real_cls(skey, c): n for c, n in peak.items()}]
+        k = (real_key(skey), minute)
+        if k in occ:
+            _merge_occ(occ[k], o)
+        else:
+            occ[k] = o
+    agg.occupancy = occ
+
+
+def _parse_ts(ts):
+    try:
+        return datetime.fromisoformat(ts) if ts else None
+    except ValueError:
+        return None
+
+
+def _percentile(sorted_vals, q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+def _id_switches(tracks, gap: int, dist: float) -> int:
+    """
+    Ước lượng ID switch: track mới bắt đầu trong vòng `gap` frame sau khi 1 track khác (cùng stream)
+    kết thúc, và vị trí đầu gần vị trí cuối của track cũ (khoảng cách tâm <= dist * chiều cao bbox).
+    """
+    switches = 0
+    by_end = sorted(tracks, key=lambda t: t[LAST])
+    ends = [t[LAST] for t in by_end]
+    used = set()
+    for t in sorted(tracks, key=lambda t: t[FIRST]):
+        lo = bisect_left(ends, t[FIRST] - gap)
+        hi = bisect_left(ends, t[FIRST])
+        fx, fy, fh = t[FIRST_BOX]
+        for j in range(hi - 1, lo - 1, -1):
+            u = by_end[j]
+            if j in used or u is t or u[FIRST] >= t[FIRST]:
                 continue
-            frames += 1
-            obj = json.loads(line)
-            for det in obj.get('detections', []):
-                tid = det.get('track_id')
-                cls = det.get('class')
-                if cls is not None:
-                    cls_counter[cls] += 1
-                if tid is None:
-                    missing += 1
-                else:
-                    ids.add(tid)
-                    if cls is not None:
-                        per_class_ids[cls].add(tid)
-
-    print(f'frames: {frames}')
-    print(f'unique_ids: {len(ids)} {sorted(list(ids))[:50]}')
-    print(f'missing_track_ids: {missing}')
-    print(f'class_counts: {dict(cls_counter)}')
-    for c, s in per_class_ids.items():
-        print(f'class_unique_ids[{c}]: {len(s)} {sorted(list(s))[:50]}')
+            lx, ly, lh = u[LAST_BOX]
+            if ((fx - lx) ** 2 + (fy - ly) ** 2) ** 0.5 <= dist * max(1.0, fh, lh):
+                used.add(j)
+                switches += 1
+                break
+    return switches
+
+
+def build_report(agg: Agg, gap: int, switch_dist: float, min_frames: int, occ_class: str) -> dict:
+    ids = {tid for (_, tid) in agg.tracks}
+    per_class_ids = defaultdict(set)
+    per_stream = defaultdict(list)
+    for (skey, tid), t in agg.tracks.items():
+        for c in t[CLS]:
+            per_class_ids[c].add(tid)
+        per_stream[skey].append(t)
+
+    def label(skey):
+        return '/'.join(str(x) for x in skey[1:] if x is not None) or str(skey)
+
+    cameras = {}
+    for skey, tracks in per_stream.items():
+        kept = [t for t in tracks if t[N] >= min_frames]
+        dwell = []
+        for t in kept:
+            a, b = _parse_ts(t[FIRST_TS]), _parse_ts(t[LAST_TS])
+            if a and b:
+                dwell.append((b - a).total_seconds())
+        dwell.sort()
+        lifetimes = sorted(t[LAST] - t[FIRST] + 1 for t in kept)
+        cam = cameras.setdefault(label(skey), {
+            'tracks': 0, 'short_tracks': 0, 'fragments': 0, 'fragmented_tracks': 0, 'id_switches': 0,
+            'dwell_s': [], 'lifetime_frames': [],
+        })
+        cam['tracks'] += len(kept)
+        cam['short_tracks'] += len(tracks) - len(kept)
+        cam['fragments'] += sum(len(t[SEGS]) - 1 for t in kept)
+        cam['fragmented_tracks'] += sum(1 for t in kept if len(t[SEGS]) > 1)
+        cam['id_switches'] += _id_switches(kept, gap, switch_dist)
+        cam['dwell_s'] += dwell
+        cam['lifetime_frames'] += lifetimes
+
+    for cam in cameras.values():
+        d = sorted(cam.pop('dwell_s'))
+        lt = sorted(cam.pop('lifetime_frames'))
+        cam['dwell_s'] = {
+            'mean': round(sum(d) / len(d), 2) if d else 0.0,
+            'p50': round(_percentile(d, 0.5), 2),
+            'p95': round(_percentile(d, 0.95), 2),
+            'max': round(d[-1], 2) if d else 0.0,
+        }
+        cam['lifetime_frames'] = {'p50': _percentile(lt, 0.5), 'p95': _percentile(lt, 0.95), 'max': lt[-1] if lt else 0}
+
+    occupancy = defaultdict(dict)
+    for (skey, minute), (frames, dets, peak) in sorted(agg.occupancy.items(), key=lambda kv: kv[0][1]):
+        occupancy[label(skey)][minute] = {
+            'avg': round(dets.get(occ_class, 0) / max(1, frames), 2),
+            'max': peak.get(occ_class, 0),
+            'frames': frames,
+        }
+
+    return {
+        'frames': agg.frames,
+        'unique_ids': len(ids),
+        'missing_track_ids': agg.missing,
+        'class_counts': dict(agg.cls_counter),
+        'predicted_frames': agg.pred_frames,
+        'predicted_class_counts': dict(agg.pred_cls_counter),
+        'class_unique_ids': {c: len(s) for c, s in per_class_ids.items()},
+        'cameras': cameras,
+        'occupancy_per_minute': occupancy,
+        'parse_errors': agg.errors,
+    }
+
+
+def analyze(paths, workers: int = 0, chunk_mb: float = 64.0, gap: int = 30,
+            switch_dist: float = 0.5, min_frames: int = 3, occ_class: str = 'person') -> dict:
+    if isinstance(paths, str):
+        paths = [paths]
+    tasks = plan_chunks(paths, max(1, int(chunk_mb * 1024 * 1024)), gap)
+    total = Agg()
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(tasks) <= 1:
+        for t in tasks:
+            total.merge(scan_chunk(t), gap)
+    else:
+        with Pool(processes=min(workers, len(tasks))) as pool:
+            for part in pool.imap_unordered(scan_chunk, tasks):
+                total.merge(part, gap)
+    _resolve_compact(total, gap)
+    return build_report(total, gap, switch_dist, min_frames, occ_class)
+
+
+def print_report(rep: dict) -> None:
+    print(f"frames: {rep['frames']}")
+    print(f"unique_ids: {rep['unique_ids']}")
+    print(f"missing_track_ids: {rep['missing_track_ids']}")
+    print(f"class_counts: {rep['class_counts']}")
+    if rep['predicted_frames']:
+        print(f"predicted_frames: {rep['predicted_frames']} | predicted_class_counts: {rep['predicted_class_counts']}")
+    for c, n in rep['class_unique_ids'].items():
+        print(f'class_unique_ids[{c}]: {n}')
+    for name, cam in rep['cameras'].items():
+        d = cam['dwell_s']
+        print(
+            f"[{name}] tracks={cam['tracks']} (short={cam['short_tracks']}) | fragments={cam['fragments']}"
+            f" in {cam['fragmented_tracks']} tracks | id_switches~{cam['id_switches']}"
+            f" | dwell mean={d['mean']}s p50={d['p50']}s p95={d['p95']}s max={d['max']}s"
+        )
+    for name, minutes in rep['occupancy_per_minute'].items():
+        print(f'[{name}] occupancy/minute:')
+        for minute, o in minutes.items():
+            print(f"  {minute}  avg={o['avg']}  max={o['max']}  frames={o['frames']}")
+    if rep['parse_errors']:
+        print(f"parse_errors: {rep['parse_errors']}")
 
 
 if __name__ == '__main__':
-    ap = argparse.ArgumentParser()
-    ap.add_argument('path')
+    ap = argparse.ArgumentParser(description='Phân tích NDJSON detection (song song, nhiều file)')
+    ap.add_argument('paths', nargs='+', help='File NDJSON (.ndjson/.gz/.zst), hỗ trợ glob')
+    ap.add_argument('--workers', type=int, default=0, help='Số process (0 = số CPU)')
+    ap.add_argument('--chunk_mb', type=float, default=64.0, help='Kích thước chunk mỗi tác vụ (MB)')
+    ap.add_argument('--gap', type=int, default=30, help='Khoảng frame tối đa coi là liền mạch (fragment/ID switch)')
+    ap.add_argument('--switch_dist', type=float, default=0.5, help='Khoảng cách tâm (x chiều cao bbox) để coi là ID switch')
+    ap.add_argument('--min_frames', type=int, default=3, help='Bỏ qua track xuất hiện ít hơn N frame')
+    ap.add_argument('--occupancy_class', type=str, default='person', help='Class dùng để tính occupancy')
+    ap.add_argument('--json', type=str, default='', help='Ghi báo cáo ra file JSON')
     args = ap.parse_args()
-    analyze(args.path)
 
+    files = []
+    for p in args.paths:
+        files.extend(sorted(glob.glob(p)) or [p])
+    missing = [p for p in files if not os.path.exists(p)]
+    if missing:
+        print(f'[ERROR] Không tìm thấy file: {missing}')
+        sys.exit(2)
+    report = analyze(files, args.workers, args.chunk_mb, args.gap, args.switch_dist, args.min_frames, args.occupancy_class)
+    print_report(report)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,508 @@
+"""
+Benchmark tái lập được cho đường ingest -> detect -> track -> emit trên cảnh tổng hợp.
+
+- Cảnh tổng hợp tham số hoá: độ phân giải, số đối tượng, tốc độ, tỉ lệ đứng yên, số frame, seed.
+- Đo từng stage riêng (decode, motion, detect, track, emit) và end-to-end (e2e), với detector
+  synth (ground truth của cảnh, tuỳ chọn thêm độ trễ --stub_latency_ms), replay hoặc YOLO thật.
+- Mỗi case chạy trong 1 process riêng để peak RSS không lẫn giữa các case; --warmup bỏ các frame
+  đầu, --repeat lấy lần chạy trung vị để giảm nhiễu.
+- Báo cáo JSON: FPS, latency p50/p95/p99 mỗi frame (hoặc mỗi lô), CPU time, peak RSS;
+  --baseline so sánh với báo cáo cũ và trả exit code 1 nếu có regression vượt --tolerance.
+
+Mọi tham số CLI của ai.ingest (--tracker, --runtime, --det_batch, --emit_format, --motion_gate...)
+dùng được trực tiếp và áp dụng cho các stage tương ứng.
+
+Ví dụ:
+    python scripts/benchmark.py --res 640x480,1920x1080 --objects 1,20 --frames 300 --out bench.json
+    python scripts/benchmark.py --stages track --tracker bytetrack --baseline bench.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+import tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from itertools import product
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ai.detect.stub_detector import SyntheticDetector, SyntheticScene  # noqa: E402
+from ai.ingest.factory import (  # noqa: E402
+    add_detect_track_args,
+    add_emit_args,
+    add_pipeline_args,
+)
+
+STAGES = ('decode', 'motion', 'detect', 'track', 'emit', 'e2e')
+
+# Chỉ số so với baseline: (key, True nếu lớn hơn là tốt hơn)
+COMPARE = (('fps', True), ('latency_ms.p95', False), ('cpu_ms_per_frame', False), ('peak_rss_mb', False))
+
+def _percentiles(samples):
+    if not samples:
+        return {'p50': 0.0, 'p95': 0.0, 'p99': 0.0, 'mean': 0.0, 'max': 0.0}
+    a = np.asarray(samples) * 1000.0
+    return {
+        'p50': round(float(np.percentile(a, 50)), 3),
+        'p95': round(float(np.percentile(a, 95)), 3),
+        'p99': round(float(np.percentile(a, 99)), 3),
+        'mean': round(float(a.mean()), 3),
+        'max': round(float(a.max()), 3),
+    }
+
+
+def _peak_rss_mb():
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return round(peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0), 1)
+    except ImportError:
+        pass
+    try:
+        import psutil  # type: ignore
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / (1024.0 * 1024.0), 1)
+    except ImportError:
+        return None
+
+
+class _Timer:
+    """Cộng dồn thời gian tường (từng lần) và CPU time (mọi thread) của riêng các đoạn được đo."""
+
+    def __init__(self):
+        self.lat = []
+        self.cpu = []
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        self._c0 = time.process_time()
+        return self
+
+    def __exit__(self, *exc):
+        self.lat.append(time.perf_counter() - self._t0)
+        self.cpu.append(time.process_time() - self._c0)
+        return False
+
+    def result(self, warmup):
+        """Bỏ warmup lần đo đầu (import lười, cấp phát lần đầu...) khỏi kết quả."""
+        lat, cpu = self.lat[warmup:], self.cpu[warmup:]
+        return len(lat), lat, sum(lat), sum(cpu)
+
+
+def _write_video(scene, frames, path):
+    import cv2
+    out = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30.0, (scene.width, scene.height))
+    for i in range(frames):
+        out.write(scene.frame(i))
+    out.release()
+
+
+def _make_detector(args, scene):
+    if args.detector == 'synth':
+        # Ground truth đúng cảnh của case (không dựng cảnh mới theo --synth_*)
+        return SyntheticDetector(
+            seed=args.seed, jitter=args.synth_jitter, miss=args.synth_miss,
+            latency_ms=args.stub_latency_ms, scene=scene,
+        )
+    from ai.ingest.factory import init_detector
+    return init_detector(args)
+
+
+def _batches(n, size):
+    size = max(1, size)
+    return [list(range(i, min(n, i + size))) for i in range(0, n, size)]
+
+
+# --- Từng stage: trả về (số frame, [latency mỗi lần gọi], thời gian tường, CPU time) -------------
+# Chỉ phần được đo mới tính: sinh frame tổng hợp, ghi video, warmup model nằm ngoài phép đo.
+
+def _bench_decode(args, scene, work):
+    from ai.ingest.cv_source import CvSource
+    path = os.path.join(work, 'scene.avi')
+    _write_video(scene, args.frames, path)
+    src = CvSource(path, pool_size=args.frame_pool)
+    if not src.open():
+        raise RuntimeError(f'Không mở được {path}')
+    timer, n = _Timer(), 0
+    while True:
+        with timer:
+            ok, frame = src.read()
+        if not ok or frame is None:
+            # Lần đọc EOF không phải 1 frame: bỏ cả latency lẫn CPU để 2 list khớp nhau
+            timer.lat.pop()
+            timer.cpu.pop()
+            break
+        n += 1
+        src.release_frame(frame)
+    src.release()
+    return timer.result(args.warmup)
+
+
+def _bench_motion(args, scene, work):
+    from ai.ingest.factory import init_motion_gate
+    args.motion_gate = 1
+    gate = init_motion_gate(args)
+    timer = _Timer()
+    for i in range(args.frames):
+        f = scene.frame(i)
+        with timer:
+            gate.check(f)
+    return timer.result(args.warmup)
+
+
+def _bench_detect(args, scene, work):
+    from ai.ingest.factory import init_detect_controls
+    from ai.ingest.pipeline import FramePacket, detect_packets
+    det = _make_detector(args, scene)
+    controls = init_detect_controls(args)
+    controls.cadence = None
+    controls.gate = None
+    # Warmup (model thật: load graph/lazy init không tính vào kết quả)
+    det.infer_batch([scene.frame(0)])
+    timer = _Timer()
+    batches = _batches(args.frames, args.det_batch)
+    for idx in batches:
+        pkts = [FramePacket(i + 1, scene.frame(i)) for i in idx]
+        with timer:
+            detect_packets(det, pkts, lambda _pkt: controls)
+    # Latency tính theo lô; số frame = tổng frame của các lô sau warmup
+    skip = -(-args.warmup // max(1, args.det_batch))
+    _, lat, wall, cpu = timer.result(skip)
+    return sum(len(idx) for idx in batches[skip:]), lat, wall, cpu
+
+
+def _bench_track(args, scene, work):
+    from ai.ingest.factory import init_tracker
+    args.track = 1
+    tracker = init_tracker(args)
+    det = SyntheticDetector(seed=args.seed, jitter=args.synth_jitter, miss=args.synth_miss, scene=scene)
+    timer = _Timer()
+    for i in range(args.frames):
+        f = scene.frame(i)
+        dets = det.detect_index(i + 1, f.shape)
+        with timer:
+            tracker.update(dets, f)
+    return timer.result(args.warmup)
+
+
+def _bench_emit(args, scene, work):
+    from datetime import datetime, timezone
+    from ai.ingest.factory import init_emitter
+    ext = {'ndjson': '.ndjson', 'parquet': '.parquet', 'arrow': '.arrow'}[args.emit_format]
+    emitter = init_emitter(args, os.path.join(work, 'out' + ext))
+    det = SyntheticDetector(seed=args.seed, jitter=args.synth_jitter, miss=args.synth_miss, scene=scene)
+    source = {'store_id': 'bench', 'camera_id': 'cam_01', 'stream_id': 'stream_01'}
+    size = (scene.width, scene.height)
+    timer = _Timer()
+    for i in range(args.frames):
+        dets = det.detect_index(i + 1, (scene.height, scene.width))
+        tracked = [(d[0], d[1], d[2], d[3], k + 1, d[4], d[6]) for k, d in enumerate(dets)]
+        ts = datetime.now(timezone.utc).isoformat()
+        with timer:
+            emitter.emit_detection(
+                schema_version='1.0', pipeline_run_id='bench', source=source, frame_index=i + 1,
+                capture_ts=ts, image_size=size, dets=dets, tracked=tracked,
+            )
+    # close() (flush/ghi nốt row group) tính vào thời gian tổng nhưng không vào percentile mỗi frame
+    n, lat, wall, cpu = timer.result(args.warmup)
+    with timer:
+        emitter.close()
+    return n, lat, wall + timer.lat.pop(), cpu + timer.cpu.pop()
+
+
+def _bench_e2e(args, scene, work):
+    """Đọc video -> (motion) -> detect -> track -> emit; latency = từ lúc đọc xong tới lúc emit xong."""
+    from datetime import datetime, timezone
+    from ai.ingest.factory import init_detect_controls, init_emitter, init_tracker, open_source
+    from ai.ingest.pipeline import (
+        FramePacket, ThreadedPipeline, detect_stage, motion_stage, run_serial, track_stage,
+    )
+    path = os.path.join(work, 'scene.avi')
+    _write_video(scene, args.frames, path)
+    args.reconnect = 0
+    src = open_source(path, 'cv', pool_size=args.frame_pool, args=args)
+    if src is None:
+        raise RuntimeError(f'Không mở được {path}')
+    det = _make_detector(args, scene)
+    det.infer_batch([scene.frame(0)])
+    tracker = init_tracker(args)
+    controls = init_detect_controls(args)
+    emitter = init_emitter(args, os.path.join(work, 'e2e.' + args.emit_format))
+    source = {'store_id': 'bench', 'camera_id': 'cam_01', 'stream_id': 'stream_01'}
+    started = {}
+    lat = []
+    warm = {}
+    state = {'index': 0, 'next': None}
+    period = 1.0 / args.src_fps if args.src_fps > 0 else 0.0
+
+    def read():
+        if period:
+            # Giả lập camera: frame tới đúng nhịp src_fps thay vì đọc file nhanh hết mức
+            now = time.perf_counter()
+            due = state['next'] if state['next'] is not None else now
+            if due > now:
+                time.sleep(due - now)
+            state['next'] = max(due, now - period) + period
+        ok, frame = src.read()
+        if not ok or frame is None:
+            return None
+        state['index'] += 1
+        started[state['index']] = time.perf_counter()
+        return FramePacket(state['index'], frame, datetime.now(timezone.utc).isoformat(), on_release=src.release_frame)
+
+    def sink(pkt):
+        h, w = pkt.frame.shape[:2]
+        emitter.emit_detection(
+            schema_version='1.0', pipeline_run_id='bench', source=source, frame_index=pkt.index,
+            capture_ts=pkt.capture_ts, image_size=(w, h), dets=pkt.dets,
+            tracked=pkt.tracked if tracker else None, predicted=pkt.predicted,
+        )
+        now = time.perf_counter()
+        lat.append(now - started.pop(pkt.index))
+        if len(lat) == args.warmup:
+            warm.update(t=now, cpu=time.process_time())
+        return True
+
+    stages = [motion_stage(lambda _pkt: controls)] if controls.gate is not None else []
+    stages += [detect_stage(det, args.det_batch, args.det_batch_wait_ms, controls=controls), track_stage(tracker)]
+    warm.update(t=time.perf_counter(), cpu=time.process_time())
+    if args.pipeline == 'threaded':
+        ThreadedPipeline(read, stages, sink, queue_size=args.queue_size, drop_policy='block').run()
+    else:
+        run_serial(read, stages, sink)
+    emitter.close()
+    wall, cpu = time.perf_counter() - warm['t'], time.process_time() - warm['cpu']
+    src.release()
+    lat = lat[args.warmup:]
+    return len(lat), lat, wall, cpu
+
+
+BENCHES = {
+    'decode': _bench_decode,
+    'motion': _bench_motion,
+    'detect': _bench_detect,
+    'track': _bench_track,
+    'emit': _bench_emit,
+    'e2e': _bench_e2e,
+}
+
+
+def case_name(stage, params, args):
+    name = f"{stage}/{params['width']}x{params['height']}/o{params['objects']}/s{params['speed']:g}"
+    if stage in ('detect', 'e2e'):
+        if args.detector == 'yolo':
+            name += f'/yolo-{args.runtime}-{args.imgsz}-{args.precision}'
+        else:
+            name += f'/{args.detector}' + (f'{args.stub_latency_ms:g}ms' if args.stub_latency_ms else '')
+        if args.det_batch > 1:
+            name += f'/b{args.det_batch}'
+    if stage in ('track', 'e2e'):
+        if not args.track:
+            name += '/notrack'
+        else:
+            name += f'/{args.tracker}' + (f'-{args.track_embedder}' if args.tracker == 'deepsort' else '')
+    if stage in ('emit', 'e2e'):
+        name += f'/{args.emit_format}'
+    if stage == 'e2e':
+        name += f'/{args.pipeline}' + (f'@{args.src_fps:g}fps' if args.src_fps > 0 else '')
+    return name
+
+
+def run_case(stage, params, args):
+    """Chạy 1 case (trong process riêng nếu --isolate): trả về dict kết quả."""
+    # Bench được phép sửa args (motion_gate/track/reconnect); bản sao riêng để --isolate 0
+    # không rò sang case sau và case_name giống hệt khi chạy --isolate 1
+    args = argparse.Namespace(**vars(args))
+    scene = SyntheticScene(
+        params['width'], params['height'], params['objects'], params['speed'], args.still, args.seed,
+    )
+    work = tempfile.mkdtemp(prefix='bench-')
+    try:
+        n, lat, wall, cpu = BENCHES[stage](args, scene, work)
+    except SystemExit as e:
+        # init_* báo lỗi cấu hình/thiếu thư viện bằng SystemExit; đổi thành lỗi của case
+        raise RuntimeError(f'khởi tạo thất bại (exit {e.code})') from None
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    per = 'batch' if stage == 'detect' and args.det_batch > 1 else 'frame'
+    return {
+        'name': case_name(stage, params, args),
+        'stage': stage,
+        'params': params,
+        'frames': n,
+        'wall_s': round(wall, 4),
+        'fps': round(n / wall, 2) if wall > 0 else 0.0,
+        'latency_per': per,
+        'latency_ms': _percentiles(lat),
+        'cpu_s': round(cpu, 4),
+        'cpu_ms_per_frame': round(1000.0 * cpu / max(1, n), 4),
+        'peak_rss_mb': _peak_rss_mb(),
+    }
+
+
+def _run_isolated(stage, params, args):
+    # Executor (không dùng Pool): process con chết bất thường -> BrokenProcessPool thay vì treo
+    with ProcessPoolExecutor(1, mp_context=mp.get_context('spawn')) as pool:
+        return pool.submit(run_case, stage, params, args).result()
+
+
+def _get(d, dotted):
+    for k in dotted.split('.'):
+        if not isinstance(d, dict) or k not in d:
+            return None
+        d = d[k]
+    return d
+
+
+def compare(report, baseline, tolerance):
+    """So từng case cùng tên với baseline; regression khi tệ hơn quá tolerance (tỉ lệ)."""
+    base = {c['name']: c for c in baseline.get('cases', [])}
+    rows = []
+    for c in report['cases']:
+        b = base.get(c['name'])
+        if b is None:
+            continue
+        for key, higher_better in COMPARE:
+            new, old = _get(c, key), _get(b, key)
+            if not new or not old:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_better else change
+            rows.append({
+                'name': c['name'], 'metric': key, 'baseline': old, 'current': new,
+                'change_pct': round(100.0 * change, 1), 'regression': worse > tolerance,
+            })
+    return rows
+
+
+def _meta(args, argv):
+    import cv2
+    commit = None
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        pass
+    return {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'commit': commit,
+        'argv': argv,
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'isolated': bool(args.isolate),
+        'args': vars(args),
+    }
+
+
+def print_report(report, rows):
+    print(f"{'case':<58} {'fps':>9} {'p50ms':>8} {'p95ms':>8} {'p99ms':>8} {'cpu/f':>8} {'rssMB':>7}")
+    for c in report['cases']:
+        lat = c['latency_ms']
+        rss = c['peak_rss_mb'] if c['peak_rss_mb'] is not None else '-'
+        print(
+            f"{c['name']:<58} {c['fps']:>9.1f} {lat['p50']:>8.2f} {lat['p95']:>8.2f} {lat['p99']:>8.2f}"
+            f" {c['cpu_ms_per_frame']:>8.2f} {rss:>7}"
+        )
+    if rows:
+        print('\nSo với baseline:')
+        for r in rows:
+            flag = 'REGRESSION' if r['regression'] else ''
+            print(
+                f"  {r['name']:<58} {r['metric']:<18} {r['baseline']:>10} -> {r['current']:>10}"
+                f" ({r['change_pct']:+.1f}%) {flag}"
+            )
+
+
+def _parse_res(spec):
+    out = []
+    for part in spec.split(','):
+        w, h = part.lower().split('x')
+        out.append((int(w), int(h)))
+    return out
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    ap = argparse.ArgumentParser(description='Benchmark ingest -> detect -> track -> emit trên cảnh tổng hợp')
+    ap.add_argument('--stages', default=','.join(STAGES), help=f"Các stage cần đo, ngăn bởi ',' ({','.join(STAGES)})")
+    ap.add_argument('--res', default='640x480,1920x1080', help="Danh sách độ phân giải WxH, ngăn bởi ','")
+    ap.add_argument('--objects', default='1,20', help="Danh sách số đối tượng, ngăn bởi ','")
+    ap.add_argument('--speed', default='4', help="Danh sách tốc độ (pixel/frame), ngăn bởi ','")
+    ap.add_argument('--still', type=float, default=0.3, help='Tỉ lệ đối tượng đứng yên')
+    ap.add_argument('--frames', type=int, default=300, help='Số frame mỗi case')
+    ap.add_argument('--seed', type=int, default=0)
+    ap.add_argument('--warmup', type=int, default=10, help='Số frame (lần gọi) đầu không tính vào kết quả')
+    ap.add_argument('--pipeline', choices=['serial', 'threaded'], default='serial', help='Chế độ chạy case e2e')
+    ap.add_argument('--src_fps', type=float, default=0.0, help='Case e2e: phát frame theo nhịp camera (FPS); 0 = đọc nhanh hết mức (đo throughput)')
+    ap.add_argument('--repeat', type=int, default=1, help='Chạy mỗi case N lần, báo cáo lần có FPS trung vị')
+    ap.add_argument('--isolate', type=int, default=1, help='Chạy mỗi case trong process riêng (peak RSS chính xác) (1/0)')
+    ap.add_argument('--out', default='', help='Ghi báo cáo JSON ra file')
+    ap.add_argument('--baseline', default='', help='Báo cáo JSON cũ để so sánh')
+    ap.add_argument('--tolerance', type=float, default=0.10, help='Ngưỡng regression (tỉ lệ, vd 0.10 = 10%%)')
+    add_pipeline_args(ap)
+    add_detect_track_args(ap)
+    add_emit_args(ap)
+    # Mặc định dùng ground truth của cảnh thay vì YOLO (--detector yolo để đo model thật)
+    ap.set_defaults(detector='synth')
+    args = ap.parse_args(argv)
+
+    if args.frames <= args.warmup:
+        ap.error('--frames phải lớn hơn --warmup')
+    stages = [s.strip() for s in args.stages.split(',') if s.strip()]
+    bad = [s for s in stages if s not in STAGES]
+    if bad:
+        ap.error(f'stage không hợp lệ: {bad}')
+    scenes = [
+        {'width': w, 'height': h, 'objects': int(o), 'speed': float(s)}
+        for (w, h), o, s in product(_parse_res(args.res), args.objects.split(','), args.speed.split(','))
+    ]
+
+    report = {'meta': _meta(args, argv), 'cases': []}
+    for stage, params in product(stages, scenes):
+        name = case_name(stage, params, args)
+        print(f'[INFO] {name} ...', flush=True)
+        try:
+            runs = [
+                _run_isolated(stage, params, args) if args.isolate else run_case(stage, params, args)
+                for _ in range(max(1, args.repeat))
+            ]
+            # Lặp nhiều lần: giữ lần chạy có FPS trung vị để giảm nhiễu từ máy
+            runs.sort(key=lambda r: r['fps'])
+            res = runs[len(runs) // 2]
+            if len(runs) > 1:
+                res['fps_runs'] = [r['fps'] for r in runs]
+        except Exception as e:  # noqa: BLE001  (1 case lỗi không dừng cả suite)
+            print(f'[WARN] {name}: {e}')
+            res = {'name': name, 'stage': stage, 'params': params, 'error': str(e)}
+        report['cases'].append(res)
+
+    ok_cases = {'meta': report['meta'], 'cases': [c for c in report['cases'] if 'error' not in c]}
+    rows = []
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            rows = compare(ok_cases, json.load(f), args.tolerance)
+        report['comparison'] = {'baseline': args.baseline, 'tolerance': args.tolerance, 'rows': rows}
+    print_report(ok_cases, rows)
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f'[INFO] Đã ghi {args.out}')
+    if any(r['regression'] for r in rows):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,21 +1,44 @@
+import argparse
+import os
+import sys
+
 import cv2
 import numpy as np
-import os
+
 
 def main():
-    os.makedirs('data', exist_ok=True)
-    h, w = 480, 640
+    ap = argparse.ArgumentParser(description='Tạo video tổng hợp để chạy thử pipeline')
+    ap.add_argument('--out', default='data/synth.avi')
+    ap.add_argument('--objects', type=int, default=0, help='0 = 1 hình chữ nhật chạy ngang (mặc định cũ); N > 0 = cảnh SyntheticScene N đối tượng')
+    ap.add_argument('--width', type=int, default=640)
+    ap.add_argument('--height', type=int, default=480)
+    ap.add_argument('--frames', type=int, default=180)
+    ap.add_argument('--speed', type=float, default=4.0)
+    ap.add_argument('--still', type=float, default=0.0)
+    ap.add_argument('--seed', type=int, default=0)
+    args = ap.parse_args()
+
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    h, w = args.height, args.width
     fourcc = cv2.VideoWriter_fourcc(*'XVID')
-    out = cv2.VideoWriter('data/synth.avi', fourcc, 30.0, (w, h))
-    for i in range(180):
+    out = cv2.VideoWriter(args.out, fourcc, 30.0, (w, h))
+    scene = None
+    if args.objects > 0:
+        # Cùng cảnh với --detector synth (cùng --synth_objects/--synth_speed/--synth_still/--synth_seed)
+        sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        from ai.detect.stub_detector import SyntheticScene
+        scene = SyntheticScene(w, h, args.objects, args.speed, args.still, args.seed)
+    for i in range(args.frames):
+        if scene is not None:
+            out.write(scene.frame(i))
+            continue
         img = np.zeros((h, w, 3), dtype=np.uint8)
         x = 50 + (i * 3) % 500
         y = 200
         cv2.rectangle(img, (x, y), (x + 60, y + 100), (0, 255, 0), -1)
         out.write(img)
     out.release()
-    print('Wrote data/synth.avi')
+    print(f'Wrote {args.out}')
 
 if __name__ == '__main__':
     main()
-
@@ -0,0 +1,87 @@
+# tests/test_analyze_ndjson.py
+"""
+Kiểm thử scripts/analyze_ndjson.py: chia chunk theo byte + gộp Agg/_merge_track phải cho cùng
+báo cáo với khi đọc cả file trong 1 chunk, ở cả schema full lẫn compact, 1 hay nhiều process.
+
+Chạy: python -m unittest discover -s tests   (hoặc pytest tests)
+"""
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from ai.emit.json_emitter import JsonEmitter
+from scripts import analyze_ndjson
+
+CLASSES = {0: "person", 1: "túi xách"}
+
+
+def _write_run(path: str, schema: str, seed: int = 0, frames: int = 400) -> None:
+    """2 camera, track dài xuyên nhiều chunk, có đứt đoạn (fragment), đổi class và frame predicted."""
+    rng = random.Random(seed)
+    emitter = JsonEmitter(path, schema=schema)
+    for cam in ("cam_01", "cam_02"):
+        source = {"store_id": "store_01", "camera_id": cam, "stream_id": "stream_01"}
+        for i in range(1, frames + 1):
+            dets, tracked = [], []
+            for tid in range(1, 6):
+                # Track tid vắng mặt 1 đoạn dài hơn gap ở giữa -> 2 segment
+                if tid % 2 and 150 + 10 * tid <= i < 200 + 10 * tid:
+                    continue
+                ci = 1 if tid == 3 and i > frames // 2 else 0
+                x = 20 * tid + i % 50 + rng.randint(0, 2)
+                y = 30 + 5 * tid
+                dets.append((x, y, x + 40, y + 80, round(rng.uniform(0.3, 0.99), 3), ci, CLASSES[ci]))
+                tracked.append((x, y, x + 40, y + 80, tid + (100 if cam == "cam_02" else 0), dets[-1][4], CLASSES[ci]))
+            ts = f"2026-01-01T10:{i // 60:02d}:{i % 60:02d}+00:00"
+            emitter.emit_detection(
+                schema_version="1.0", pipeline_run_id="run-1", source=source, frame_index=i,
+                capture_ts=ts, image_size=(640, 480), dets=dets, tracked=tracked, predicted=i % 7 == 0,
+            )
+    emitter.close()
+
+
+class ChunkMergeTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.dir = tempfile.mkdtemp()
+        cls.paths = {}
+        for schema in ("full", "compact"):
+            path = os.path.join(cls.dir, f"{schema}.ndjson")
+            _write_run(path, schema)
+            cls.paths[schema] = path
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.dir, ignore_errors=True)
+
+    def _check(self, schema: str):
+        path = self.paths[schema]
+        size = os.path.getsize(path)
+        ref = analyze_ndjson.analyze(path, workers=1, chunk_mb=1024)
+        self.assertEqual(ref["frames"], 800)
+        self.assertGreater(ref["predicted_frames"], 0)
+        # ~16 chunk: mọi track dài cắt qua nhiều ranh giới chunk
+        chunk_mb = size / 16 / (1024 * 1024)
+        self.assertGreater(len(analyze_ndjson.plan_chunks([path], int(chunk_mb * 1024 * 1024), 30)), 10)
+        for workers in (1, 4):
+            with self.subTest(workers=workers):
+                self.assertEqual(analyze_ndjson.analyze(path, workers=workers, chunk_mb=chunk_mb), ref)
+        return ref
+
+    def test_full_schema_chunks_match_single_pass(self):
+        self._check("full")
+
+    def test_compact_schema_chunks_match_single_pass(self):
+        self._check("compact")
+
+    def test_schemas_give_same_report(self):
+        full, compact = self._check("full"), self._check("compact")
+        self.assertEqual(full["class_unique_ids"], compact["class_unique_ids"])
+        self.assertEqual(full["class_counts"], compact["class_counts"])
+        self.assertEqual(full["unique_ids"], compact["unique_ids"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,191 @@
+# tests/test_ndjson_writer.py
+"""
+Kiểm thử NdjsonWriter / RotatingFile: xoay file, ghi lại preamble, đếm byte UTF-8,
+flush theo thời gian khi không có write() mới và lỗi của thread ghi nền.
+
+Chạy: python -m unittest discover -s tests   (hoặc pytest tests)
+"""
+import glob
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+from ai.emit.ndjson_writer import NdjsonWriter
+
+
+class _FailingOut:
+    """Thay RotatingFile: mọi lần ghi đều lỗi như disk đầy."""
+
+    def write(self, text, preamble_key=None):
+        raise OSError("disk full")
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def _read(path):
+    with open(path, encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+class _TmpDir(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.dir, "out.ndjson")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def segments(self):
+        """Segment đã xoay theo thứ tự ghi, file đang ghi ở cuối."""
+        def order(p):
+            # out.<YYYYmmdd-HHMMSS>[-n].ndjson: cùng giây thì đánh số -1, -2...
+            m = re.search(r"\.(\d{8}-\d{6})(?:-(\d+))?\.ndjson$", p)
+            return m.group(1), int(m.group(2) or 0)
+
+        segs = sorted(glob.glob(os.path.join(self.dir, "out.*.ndjson")), key=order)
+        return [_read(p) for p in segs] + [_read(self.path)]
+
+
+class RotationTest(_TmpDir):
+    def test_rotate_by_bytes_on_line_boundary(self):
+        w = NdjsonWriter(self.path, rotate_bytes=50)
+        lines = [f'{{"i": {i}, "pad": "{"x" * 20}"}}' for i in range(10)]
+        for line in lines:
+            w.write(line)
+        w.close()
+        segs = self.segments()
+        self.assertGreater(len(segs), 1)
+        self.assertEqual([line for seg in segs for line in seg], lines)
+        for seg in segs[:-1]:
+            # Mỗi segment vượt ngưỡng tối đa 1 dòng
+            self.assertLess(sum(len(x) + 1 for x in seg[:-1]), 50)
+
+    def test_rotate_bytes_counts_utf8(self):
+        w = NdjsonWriter(self.path, rotate_bytes=30)
+        for _ in range(4):
+            w.write('"' + "ệ" * 10 + '"')  # 13 ký tự, 33 byte kèm '\n': mỗi dòng 1 segment
+        w.close()
+        self.assertEqual(len(self.segments()), 4)
+
+    def test_preamble_rewritten_after_rotation(self):
+        w = NdjsonWriter(self.path, rotate_bytes=30)
+        w.write('{"record": "run"}', preamble_key="run")
+        for i in range(6):
+            w.write(f'{{"frame": {i}, "pad": "xxxxxxxxxx"}}')
+        w.close()
+        segs = self.segments()
+        self.assertGreater(len(segs), 2)
+        for seg in segs:
+            self.assertEqual(seg[0], '{"record": "run"}')
+            self.assertEqual(seg.count('{"record": "run"}'), 1)
+
+    def test_preamble_replaced_by_same_key(self):
+        w = NdjsonWriter(self.path, rotate_bytes=30)
+        w.write('{"classes": 1}', preamble_key="classes")
+        w.write('{"classes": 2}', preamble_key="classes")
+        w.write('{"frame": 0, "pad": "xxxxxxxxxxxx"}')
+        w.write('{"frame": 1}')
+        w.close()
+        self.assertEqual(self.segments()[-1], ['{"classes": 2}', '{"frame": 1}'])
+
+    def test_buffered_preamble_not_duplicated_by_rotation(self):
+        # Cả 3 dòng nằm chung buffer; dòng 2 làm xoay file trước khi header được ghi
+        w = NdjsonWriter(self.path, rotate_bytes=30, flush_bytes=1 << 20)
+        w.write('{"frame": 0, "pad": "' + "x" * 30 + '"}')
+        w.write('{"frame": 1}')
+        w.write('{"hdr": 1}', preamble_key="run")
+        w.close()
+        self.assertEqual(self.segments()[-1], ['{"frame": 1}', '{"hdr": 1}'])
+
+    def test_append_keeps_previous_content(self):
+        for i in range(2):
+            w = NdjsonWriter(self.path)
+            w.write(f'{{"run": {i}}}')
+            w.close()
+        self.assertEqual(_read(self.path), ['{"run": 0}', '{"run": 1}'])
+
+
+class FlushTest(_TmpDir):
+    def test_flush_bytes_counts_utf8(self):
+        w = NdjsonWriter(self.path, flush_bytes=20)
+        w.write('"' + "đ" * 8 + '"')  # 10 ký tự + '\n', 19 byte
+        self.assertEqual(w.flushes, 0)
+        w.write('"a"')
+        self.assertEqual(w.flushes, 1)
+        w.close()
+
+    def test_flush_interval_without_new_writes(self):
+        w = NdjsonWriter(self.path, flush_interval=0.05, flush_bytes=1 << 20)
+        w.write('{"frame": 0}')
+        self.assertEqual(_read(self.path), [])
+        deadline = time.monotonic() + 2.0
+        while not _read(self.path) and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertEqual(_read(self.path), ['{"frame": 0}'])
+        w.close()
+
+    def test_async_writes_everything_in_order(self):
+        w = NdjsonWriter(self.path, async_write=True, queue_size=4, flush_interval=0.01)
+        lines = [f'{{"i": {i}}}' for i in range(200)]
+        for line in lines:
+            w.write(line)
+        w.close()
+        self.assertEqual(_read(self.path), lines)
+
+
+class AsyncErrorTest(_TmpDir):
+    def _close_in_thread(self, w):
+        result = {}
+
+        def run():
+            try:
+                w.close()
+            except BaseException as e:  # noqa: BLE001
+                result["error"] = e
+
+        t = threading.Thread(target=run, daemon=True)
+        t.start()
+        t.join(timeout=5.0)
+        self.assertFalse(t.is_alive(), "close() treo khi thread ghi đã chết")
+        return result.get("error")
+
+    def _failing(self, **kw):
+        w = NdjsonWriter(self.path, **kw)
+        self.addCleanup(w._out.close)
+        w._out = _FailingOut()
+        return w
+
+    def test_write_raises_writer_error(self):
+        w = self._failing(async_write=True, queue_size=1)
+        with self.assertRaises(OSError):
+            deadline = time.monotonic() + 5.0
+            while time.monotonic() < deadline:
+                w.write('{"i": 0}')
+        self.assertIsInstance(self._close_in_thread(w), OSError)
+
+    def test_close_does_not_hang_on_dead_writer(self):
+        w = self._failing(async_write=True, queue_size=1)
+        w.write('{"i": 0}')
+        w._thread.join(timeout=5.0)
+        self.assertFalse(w._thread.is_alive())
+        self.assertIsInstance(self._close_in_thread(w), OSError)
+
+    def test_sync_timer_error_raised_on_write(self):
+        w = self._failing(flush_interval=0.02, flush_bytes=1 << 20)
+        w.write('{"i": 0}')
+        w._timer.join(timeout=5.0)
+        with self.assertRaises(OSError):
+            w.write('{"i": 1}')
+        self.assertIsInstance(self._close_in_thread(w), OSError)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+# tests/test_pipeline.py
+"""
+Kiểm thử StageQueue (block / drop_oldest) và ThreadedPipeline với stage đơn giản:
+thứ tự packet, BatchStage, dừng sớm, lỗi từ stage/read_fn và trả packet về pool khi dừng.
+
+Chạy: python -m unittest discover -s tests   (hoặc pytest tests)
+"""
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from ai.ingest.pipeline import EOS, BatchStage, FramePacket, StageQueue, ThreadedPipeline
+
+
+class _Source:
+    """read_fn phát n packet; ghi lại packet nào đã được release (như slot của frame pool)."""
+
+    def __init__(self, n: int, delay: float = 0.0):
+        self.n = n
+        self.delay = delay
+        self.read = 0
+        self.released = []
+        self._lock = threading.Lock()
+
+    def __call__(self):
+        if self.read >= self.n:
+            return None
+        if self.delay:
+            time.sleep(self.delay)
+        self.read += 1
+        idx = self.read
+        return FramePacket(idx, np.zeros((2, 2, 3), np.uint8), on_release=lambda _f: self._release(idx))
+
+    def _release(self, idx: int) -> None:
+        with self._lock:
+            self.released.append(idx)
+
+
+def _pkt(i: int, released: list) -> FramePacket:
+    return FramePacket(i, np.zeros((1, 1, 3), np.uint8), on_release=lambda _f: released.append(i))
+
+
+class StageQueueTest(unittest.TestCase):
+    def test_block_keeps_fifo_and_waits_until_stop(self):
+        q, stop = StageQueue(2, "block"), threading.Event()
+        self.assertTrue(q.put(1, stop))
+        self.assertTrue(q.put(2, stop))
+        threading.Timer(0.2, stop.set).start()
+        t0 = time.monotonic()
+        self.assertFalse(q.put(3, stop))  # đầy: chờ tới khi pipeline dừng
+        self.assertGreaterEqual(time.monotonic() - t0, 0.15)
+        self.assertEqual(q.dropped, 0)
+        self.assertEqual([q.get_nowait(), q.get_nowait(), q.get_nowait()], [1, 2, None])
+
+    def test_drop_oldest_releases_dropped_packets(self):
+        q, stop, released = StageQueue(2, "drop_oldest"), threading.Event(), []
+        for i in range(1, 6):
+            self.assertTrue(q.put(_pkt(i, released), stop))
+        self.assertEqual(q.dropped, 3)
+        self.assertEqual(released, [1, 2, 3])
+        self.assertEqual([q.get(stop).index, q.get(stop).index], [4, 5])
+
+    def test_get_deadline_and_stop(self):
+        q, stop = StageQueue(1), threading.Event()
+        self.assertIsNone(q.get(stop, time.monotonic() + 0.05))
+        stop.set()
+        self.assertIs(q.get(stop), EOS)
+
+    def test_drain_releases_packets(self):
+        q, stop, released = StageQueue(4), threading.Event(), []
+        q.put(_pkt(1, released), stop)
+        q.put(_pkt(2, released), stop)
+        q.put(EOS, stop)
+        self.assertEqual(q.drain(), 2)
+        self.assertEqual(released, [1, 2])
+        self.assertEqual(q.qsize(), 0)
+
+
+class ThreadedPipelineTest(unittest.TestCase):
+    def _run(self, src, stages, sink, **kw):
+        pipe = ThreadedPipeline(src, stages, sink, **kw)
+        t = threading.Thread(target=self._run_catch, args=(pipe,), daemon=True)
+        t.start()
+        t.join(timeout=10.0)
+        self.assertFalse(t.is_alive(), "pipeline không dừng")
+        return pipe
+
+    def _run_catch(self, pipe):
+        try:
+            pipe.run()
+        except BaseException as e:  # noqa: BLE001
+            self.error = e
+
+    def setUp(self):
+        self.error = None
+
+    def test_order_through_stages_and_batches(self):
+        src, seen, batches = _Source(50), [], []
+
+        def tag(pkt):
+            pkt.dets = [pkt.index]
+            return pkt
+
+        def batch_fn(batch):
+            batches.append(len(batch))
+            return batch
+
+        pipe = self._run(src, [tag, BatchStage(batch_fn, batch_size=4, max_wait=0.01), tag], lambda p: seen.append(p.index) or True)
+        self.assertIsNone(self.error)
+        self.assertEqual(seen, list(range(1, 51)))
+        self.assertEqual(sum(batches), 50)
+        self.assertLessEqual(max(batches), 4)
+        self.assertEqual(sorted(src.released), list(range(1, 51)))
+        self.assertEqual(pipe.dropped, 0)
+
+    def test_sink_stop_releases_queued_packets(self):
+        src = _Source(1000)
+
+        def slow(pkt):
+            time.sleep(0.001)
+            return pkt
+
+        self._run(src, [slow, BatchStage(lambda b: b, batch_size=3, max_wait=0.01)], lambda p: p.index < 5, queue_size=8)
+        self.assertIsNone(self.error)
+        self.assertLess(src.read, 1000)
+        # Mọi packet đã đọc (kể cả còn trong hàng đợi lúc dừng) đều trả về pool đúng 1 lần
+        self.assertEqual(sorted(src.released), list(range(1, src.read + 1)))
+
+    def test_stage_error_propagates_and_releases(self):
+        src = _Source(100)
+
+        def boom(pkt):
+            if pkt.index == 10:
+                raise ValueError("stage lỗi")
+            return pkt
+
+        self._run(src, [boom, lambda p: p], lambda p: True, queue_size=4)
+        self.assertIsInstance(self.error, ValueError)
+        self.assertEqual(sorted(src.released), list(range(1, src.read + 1)))
+
+    def test_batch_stage_error_releases_batch(self):
+        src = _Source(100)
+
+        def boom(batch):
+            if any(p.index >= 7 for p in batch):
+                raise RuntimeError("detect lỗi")
+            return batch
+
+        self._run(src, [BatchStage(boom, batch_size=4, max_wait=0.01)], lambda p: True, queue_size=4)
+        self.assertIsInstance(self.error, RuntimeError)
+        self.assertEqual(sorted(src.released), list(range(1, src.read + 1)))
+
+    def test_read_error_propagates(self):
+        def read():
+            raise OSError("decode lỗi")
+
+        self._run(read, [lambda p: p], lambda p: True)
+        self.assertIsInstance(self.error, OSError)
+
+    def test_drop_oldest_under_slow_stage(self):
+        src, seen = _Source(200), []
+
+        def slow(pkt):
+            time.sleep(0.005)
+            return pkt
+
+        pipe = self._run(src, [slow], lambda p: seen.append(p.index) or True, queue_size=2, drop_policy="drop_oldest")
+        self.assertIsNone(self.error)
+        self.assertGreater(pipe.dropped, 0)
+        self.assertEqual(len(seen) + pipe.dropped, 200)
+        self.assertEqual(seen, sorted(seen))
+        self.assertEqual(seen[-1], 200)  # frame mới nhất không bị bỏ
+        self.assertEqual(sorted(src.released), list(range(1, 201)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+# tests/test_sort_tracker.py
+"""
+Kiểm thử SortTracker (SORT / ByteTrack 2 vòng) và gán Hungarian thuần NumPy.
+
+Chạy: python -m unittest discover -s tests   (hoặc pytest tests)
+Tracker chạy với Hungarian NumPy (nhánh không có scipy).
+"""
+import itertools
+import unittest
+
+import numpy as np
+
+from ai.track import matching
+from ai.track.sort_tracker import SortTracker
+
+
+def _det(x, y, conf=0.9, size=40, name="person"):
+    return (x, y, x + size, y + size, conf, 0, name)
+
+
+class HungarianTest(unittest.TestCase):
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for n, m in [(1, 1), (3, 3), (2, 5), (5, 2), (4, 4)]:
+            for _ in range(20):
+                cost = np.round(rng.random((n, m)), 1)  # có cost trùng nhau
+                rows, cols = matching._hungarian(cost)
+                self.assertEqual(len(rows), min(n, m))
+                self.assertEqual(len(set(cols.tolist())), len(cols))
+                best = min(
+                    sum(cost[i, j] for i, j in zip(r, c))
+                    for r in itertools.permutations(range(n), min(n, m))
+                    for c in itertools.permutations(range(m), min(n, m))
+                )
+                self.assertAlmostEqual(cost[rows, cols].sum(), best)
+
+    def test_linear_assignment_threshold(self):
+        cost = np.array([[0.1, 0.9], [0.8, 0.95]])
+        solver = matching._SOLVER
+        matching._SOLVER = matching._hungarian
+        try:
+            matches, ur, uc = matching.linear_assignment(cost, 0.5)
+        finally:
+            matching._SOLVER = solver
+        self.assertEqual(matches, [(0, 0)])
+        self.assertEqual(ur, [1])
+        self.assertEqual(uc, [1])
+
+
+class _NumpySolver(unittest.TestCase):
+    def setUp(self):
+        self._solver = matching._SOLVER
+        matching._SOLVER = matching._hungarian
+
+    def tearDown(self):
+        matching._SOLVER = self._solver
+
+
+class SortModeTest(_NumpySolver):
+    def test_ids_confirmed_after_n_init_and_stable(self):
+        trk = SortTracker(n_init=3, mode="sort")
+        for k in range(3):
+            out = trk.update([_det(10 + 2 * k, 10), _det(200 + 2 * k, 100)])
+            if k < 2:
+                self.assertEqual([t[4] for t in out], [-1, -1])
+        ids = [t[4] for t in out]
+        self.assertTrue(all(i > 0 for i in ids))
+        self.assertEqual(len(set(ids)), 2)
+        for k in range(3, 8):
+            # Đảo thứ tự detection: ID đi theo vị trí, không theo chỉ số
+            out = trk.update([_det(200 + 2 * k, 100), _det(10 + 2 * k, 10)])
+            self.assertEqual([t[4] for t in out], ids[::-1])
+
+    def test_output_aligned_with_detections(self):
+        trk = SortTracker(n_init=1, mode="sort")
+        dets = [_det(10, 10, 0.8, name="bag"), _det(300, 300, 0.7)]
+        out = trk.update(dets)
+        self.assertEqual([(t[0], t[1], t[2], t[3], t[5], t[6]) for t in out], [(10, 10, 50, 50, 0.8, "bag"), (300, 300, 340, 340, 0.7, "person")])
+
+    def test_tentative_track_dropped_after_miss(self):
+        trk = SortTracker(n_init=3, mode="sort")
+        trk.update([_det(10, 10)])
+        self.assertEqual(trk.tracks_count, 1)
+        trk.update([])
+        self.assertEqual(trk.tracks_count, 0)
+
+    def test_confirmed_track_survives_max_age(self):
+        trk = SortTracker(n_init=1, max_age=2, mode="sort")
+        tid = trk.update([_det(10, 10)])[0][4]
+        trk.update([])
+        trk.update([])
+        self.assertEqual(trk.update([_det(10, 10)])[0][4], tid)
+        for _ in range(3):
+            trk.update([])
+        self.assertEqual(trk.tracks_count, 0)
+
+
+class ByteTrackTest(_NumpySolver):
+    def _confirmed(self, x=10, y=10):
+        trk = SortTracker(n_init=1, mode="bytetrack", high_thresh=0.5, low_thresh=0.1)
+        tid = trk.update([_det(x, y, 0.9)])[0][4]
+        self.assertGreater(tid, 0)
+        return trk, tid
+
+    def test_low_conf_detection_keeps_existing_track(self):
+        trk, tid = self._confirmed()
+        out = trk.update([_det(12, 10, 0.3)])
+        self.assertEqual(out[0][4], tid)
+
+    def test_low_conf_detection_does_not_start_track(self):
+        trk, _ = self._confirmed()
+        out = trk.update([_det(12, 10, 0.9), _det(300, 300, 0.3)])
+        self.assertEqual(out[1][4], -1)
+        self.assertEqual(trk.tracks_count, 1)
+
+    def test_below_low_thresh_ignored(self):
+        trk, _ = self._confirmed()
+        out = trk.update([_det(12, 10, 0.05)])
+        self.assertEqual(out[0][4], -1)
+
+    def test_high_conf_matched_before_low(self):
+        trk, tid = self._confirmed()
+        # Cả 2 detection chồng lên track; vòng 1 chỉ xét detection conf cao
+        out = trk.update([_det(14, 10, 0.3), _det(12, 10, 0.9)])
+        self.assertEqual(out[1][4], tid)
+        self.assertEqual(out[0][4], -1)
+
+    def test_second_stage_uses_only_unmatched_tracks(self):
+        trk = SortTracker(n_init=1, mode="bytetrack", high_thresh=0.5, low_thresh=0.1)
+        a, b = [t[4] for t in trk.update([_det(10, 10, 0.9), _det(200, 10, 0.9)])]
+        # Track a được detection conf cao giữ; track b chỉ còn detection conf thấp
+        out = trk.update([_det(12, 10, 0.9), _det(202, 10, 0.3)])
+        self.assertEqual([t[4] for t in out], [a, b])
+
+
+if __name__ == "__main__":
+    unittest.main()